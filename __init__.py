@@ -28,7 +28,9 @@ try:
     source = os.path.join(path_prefix, source)
     dest = os.path.join(path_prefix, dest)
 
-    if not os.path.exists(dest):
+    if not os.path.exists(source):
+        pass # Not built here. The import below finds whatever was installed in lib/bin, or fails.
+    elif not os.path.exists(dest):
         os.makedirs(os.path.dirname(dest), exist_ok=True)
         shutil.copy2(source, dest)
     else:
@@ -48,10 +50,12 @@ except Exception as e:
     raise e
 print("WhatCanWePlay rust lib loaded (" + str(wcwp.__file__) + ")")
 
-from flask import Flask, request, jsonify, Response, render_template, redirect, session, url_for, make_response
+from flask import Flask, request, jsonify, Response, render_template, redirect, session, url_for, make_response, stream_with_context, g, has_request_context
 import requests
+import click
 from urllib import parse
 from werkzeug.exceptions import BadRequest
+from werkzeug.http import generate_etag
 import json
 from requests import HTTPError
 import secrets
@@ -59,11 +63,36 @@ from datetime import timezone, datetime, timedelta
 from itsdangerous import URLSafeSerializer
 from os import path
 import traceback
+import threading
+import time
+import gzip
+import zlib
+import queue
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+import atexit
+from array import array
+from .memory_cache import LRUCache
+from .owner_counts import apply_owner_delta, count_owners
+from .cache_schema import CACHE_VERSION, prepare_cache
+from .cache_backends import SQLiteGameCache, SQLiteMissCache, RedisClient, RedisCache, GAME_COLUMNS
+from .game_view import parse_game_view, apply_game_view, game_columns
+from .metrics import MetricsRegistry
+try:
+    import fcntl
+except ImportError:
+    fcntl = None # Windows, token refreshes are only serialized within a process
+try:
+    import brotli
+except ImportError:
+    brotli = None # Responses are only gzipped
 
 # Load config
-def create_app():
+# config_path defaults to config.json next to this file. The IGDB bearer token is kept in the config's directory.
+def create_app(config_path=None):
     root_path = path.dirname(__file__)
-    config = json.load(open(path.join(root_path, "config.json"), "r"))
+    config_path = config_path or path.join(root_path, "config.json")
+    config = json.load(open(config_path, "r"))
     steam_key = config["steam-key"]
     igdb_key = config["igdb-client-id"]
     igdb_secret = config["igdb-secret"]
@@ -71,6 +100,32 @@ def create_app():
     enable_api_tests = config.get("enable-api-tests", debug)
     cookie_max_age_dict = config.get("cookie-max-age", {})
     cache_max_age_dict = config.get("igdb-cache-max-age", config.get("igdb-cache-info-age", {}))
+    miss_max_age_dict = config.get("igdb-cache-miss-max-age", {"days": 3})
+    miss_memory_cache_size = config.get("igdb-cache-miss-memory-entries", 16384)
+    owned_games_max_age_dict = config.get("owned-games-cache-max-age", {"minutes": 10})
+    owned_games_cache_size = config.get("owned-games-cache-size", 1024)
+    friend_list_max_age_dict = config.get("friend-list-cache-max-age", {"minutes": 10})
+    friend_list_cache_size = config.get("friend-list-cache-size", 1024)
+    user_summary_max_age_dict = config.get("user-summary-cache-max-age", {"minutes": 2})
+    user_summary_cache_size = config.get("user-summary-cache-size", 8192)
+    steam_max_concurrency = max(1, config.get("steam-max-concurrency", 4))
+    max_group_size = max(2, config.get("max-group-size", 50))
+    prefetch_friends = max(0, config.get("prefetch-friends", 0))
+    prefetch_concurrency = max(1, config.get("prefetch-concurrency", 2))
+    prefetch_budget_per_minute = max(0, config.get("prefetch-budget-per-minute", 60))
+    igdb_max_in_flight = max(1, config.get("igdb-max-in-flight", 4))
+    cache_write_queue_size = max(1, config.get("cache-write-queue-size", 256))
+    game_memory_cache_size = config.get("igdb-cache-memory-entries", 4096)
+    intersection_max_age_dict = config.get("intersection-cache-max-age", {"seconds": 60})
+    intersection_cache_size = config.get("intersection-cache-size", 256)
+    group_cache_size = config.get("group-cache-size", 256)
+    cache_stale_grace_dict = config.get("igdb-cache-stale-grace", {})
+    cache_max_entries = max(0, config.get("igdb-cache-max-entries", 0))
+    cache_sweep_interval_dict = config.get("cache-sweep-interval", {"minutes": 10})
+    cache_sweep_batch_size = max(1, config.get("cache-sweep-batch-size", 500))
+    enable_metrics = config.get("enable-metrics", False)
+    compress_responses = config.get("compress-responses", True)
+    slow_request_threshold = config.get("slow-request-threshold", 0.0)
     source_url = config.get("source-url", "")
     contact_email = config["contact-email"]
     privacy_email = config.get("privacy-email", contact_email)
@@ -82,9 +137,56 @@ def create_app():
     read_timeout = config.get("read-timeout", 0.0)
     if read_timeout <= 0.0:
         read_timeout = None
+    request_deadline_seconds = config.get("request-deadline", 0.0)
+    steam_api_url = config.get("steam-api-url")
+    igdb_api_url = config.get("igdb-api-url")
+    twitch_token_url = config.get("twitch-token-url")
     cache_file = config.get("igdb-cache-file")
-    if not os.path.isabs(cache_file):
+    if cache_file and not os.path.isabs(cache_file):
         cache_file = os.path.join(root_path, cache_file)
+    cache_backend = config.get("igdb-cache-backend", "sqlite")
+    redis_url = config.get("igdb-cache-redis-url", "redis://127.0.0.1:6379/0")
+    redis_timeout = config.get("igdb-cache-redis-timeout", 1.0)
+    if cache_backend not in ("sqlite", "redis"):
+        raise ValueError("igdb-cache-backend must be \"sqlite\" or \"redis\", got %r" % cache_backend)
+    game_cache_enabled = cache_backend == "redis" or bool(cache_file)
+    upstream_limits_dict = config.get("upstream-limits", {})
+    circuit_breaker_dict = config.get("circuit-breaker", {})
+    rate_limit_dir = config.get("rate-limit-dir")
+    if rate_limit_dir and not os.path.isabs(rate_limit_dir):
+        rate_limit_dir = os.path.join(root_path, rate_limit_dir)
+
+    # The rust lib's HTTP client is built on first use, so this has to happen before any Steam or IGDB call
+    try:
+        wcwp.set_timeouts(connect_timeout, read_timeout)
+    except RuntimeError:
+        print("Steam/IGDB timeouts were already set in this process, keeping the earlier ones")
+
+    # Point the rust lib at other API servers, used by the benchmarks' local stand-ins
+    if steam_api_url or igdb_api_url or twitch_token_url:
+        wcwp.set_api_urls(steam_api_url, igdb_api_url, twitch_token_url)
+
+    # Every worker process pointed at the same rate-limit-dir shares one token bucket per upstream,
+    # so together they stay under the upstream's rate limit
+    if rate_limit_dir:
+        os.makedirs(rate_limit_dir, exist_ok=True)
+    
+    default_upstream_limits = {
+        "steam": {"requests-per-second": 10, "burst": 20, "max-concurrency": 16},
+        "igdb": {"requests-per-second": 4, "burst": 4, "max-concurrency": 8},
+        "twitch": {"requests-per-second": 1, "burst": 2, "max-concurrency": 2},
+    }
+    for upstream_name, default_limits in default_upstream_limits.items():
+        limits = dict(default_limits, **upstream_limits_dict.get(upstream_name, {}))
+        wcwp.configure_upstream(
+            upstream_name,
+            limits["requests-per-second"],
+            limits["burst"],
+            path.join(rate_limit_dir, upstream_name + ".bucket") if rate_limit_dir else None,
+            circuit_breaker_dict.get("failure-threshold", 5),
+            circuit_breaker_dict.get("open-seconds", 30),
+            limits["max-concurrency"]
+        )
 
     # Create uWSGI callable
     app = Flask(__name__)
@@ -109,44 +211,171 @@ def create_app():
     
     # Setup cache info max age
     cache_max_age = 0.0
-    if cache_file:
+    if game_cache_enabled:
         cache_max_age = timedelta(**cache_max_age_dict).total_seconds()
 
+    # Setup how long games IGDB doesn't know are remembered before asking again
+    miss_max_age = 0.0
+    if game_cache_enabled:
+        miss_max_age = timedelta(**miss_max_age_dict).total_seconds()
+
+    # Setup grace period for serving expired cache info while it refreshes
+    cache_stale_grace = 0.0
+    if game_cache_enabled:
+        cache_stale_grace = timedelta(**cache_stale_grace_dict).total_seconds()
+
+    # Setup how often expired and over capacity rows are swept out of the cache file
+    cache_sweep_interval = timedelta(**cache_sweep_interval_dict).total_seconds()
+
+    # Setup owned games cache max age
+    owned_games_max_age = timedelta(**owned_games_max_age_dict).total_seconds()
+
+    # Setup intersection result cache max age
+    intersection_max_age = timedelta(**intersection_max_age_dict).total_seconds()
+
+    # Setup friend list and player summary cache max ages
+    friend_list_max_age = timedelta(**friend_list_max_age_dict).total_seconds()
+    user_summary_max_age = timedelta(**user_summary_max_age_dict).total_seconds()
+
     print("cookies set to expire after %f seconds" % cookie_max_age)
     print("cache set to expire after %f seconds" % cache_max_age)
+    print("owned games set to expire after %f seconds" % owned_games_max_age)
+
+    # Each request gets request-deadline seconds for all of its Steam and IGDB calls.
+    # Deadlines are time.monotonic() values, or None when there isn't one.
+    def request_deadline():
+        if request_deadline_seconds <= 0.0:
+            return None
+        return time.monotonic() + request_deadline_seconds
+
+    # Seconds left before deadline, in the form the rust lib's timeout arguments take
+    def time_left(deadline):
+        if deadline is None:
+            return None
+        return max(0.0, deadline - time.monotonic())
+
+    # Per-process metrics, served at /metrics when enable-metrics is set
+    metrics_registry = MetricsRegistry()
+    request_seconds = metrics_registry.histogram("wcwp_request_seconds", "Time spent handling each request", ("endpoint", "status"))
+    stage_seconds = metrics_registry.histogram("wcwp_stage_seconds", "Time spent in each stage of handling a request", ("stage",))
+    upstream_seconds = metrics_registry.histogram("wcwp_upstream_seconds", "Time until Steam, IGDB or Twitch sent response headers", ("endpoint",))
+    upstream_responses = metrics_registry.counter("wcwp_upstream_responses_total", "Responses from Steam, IGDB and Twitch by status code, 0 if none arrived", ("endpoint", "status"))
+
+    # Times a stage into wcwp_stage_seconds, and into the current request's timings for the slow request log.
+    # Stages can nest, e.g. steam_owned_games is part of intersection.
+    @contextmanager
+    def stage_timer(stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stage_seconds.observe(elapsed, stage=stage)
+            if has_request_context() and "stage_timings" in g:
+                g.stage_timings[stage] = g.stage_timings.get(stage, 0.0) + elapsed
+
+    # Circuit breaker, concurrency limit and rate limiter state for each upstream, as kept by the rust lib
+    circuit_state_values = {"closed": 0, "half_open": 1, "open": 2}
+
+    def upstream_samples(key):
+        return [((state["name"],), state[key]) for state in wcwp.upstream_states() if state[key] is not None]
+
+    metrics_registry.callback(
+        "wcwp_upstream_circuit_state", "Circuit breaker state of each upstream, 0 closed, 1 half open, 2 open", "gauge", ("upstream",),
+        lambda: [((state["name"],), circuit_state_values[state["circuit"]]) for state in wcwp.upstream_states()]
+    )
+    metrics_registry.callback(
+        "wcwp_upstream_circuit_opened_total", "Times each upstream's circuit breaker opened", "counter", ("upstream",),
+        lambda: upstream_samples("circuit_opened")
+    )
+    metrics_registry.callback(
+        "wcwp_upstream_circuit_rejected_total", "Calls failed fast because an upstream's circuit breaker was open", "counter", ("upstream",),
+        lambda: upstream_samples("circuit_rejected")
+    )
+    metrics_registry.callback(
+        "wcwp_upstream_concurrency_limit", "Current adaptive limit on calls in flight to each upstream", "gauge", ("upstream",),
+        lambda: upstream_samples("concurrency_limit")
+    )
+    metrics_registry.callback(
+        "wcwp_upstream_in_flight", "Calls in flight to each upstream", "gauge", ("upstream",),
+        lambda: upstream_samples("in_flight")
+    )
+    metrics_registry.callback(
+        "wcwp_upstream_latency_baseline_seconds", "Moving average latency the concurrency limit adapts against", "gauge", ("upstream",),
+        lambda: upstream_samples("latency_baseline")
+    )
+    metrics_registry.callback(
+        "wcwp_upstream_rate_limit_wait_seconds_total", "Time calls spent waiting on each upstream's rate limiter", "counter", ("upstream",),
+        lambda: upstream_samples("rate_limit_waited")
+    )
+
+    # The rust lib records every upstream call it makes, this moves them into the metrics
+    def collect_upstream_calls():
+        for endpoint, status, seconds in wcwp.take_upstream_calls():
+            upstream_seconds.observe(seconds, endpoint=endpoint)
+            upstream_responses.inc(endpoint=endpoint, status=status)
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+        g.stage_timings = {}
+    
+    @app.after_request
+    def record_response_status(response):
+        g.response_status = response.status_code
+        return response
+
+    # Runs after streamed responses have finished, so their whole duration is counted
+    @app.teardown_request
+    def record_request_time(exception=None):
+        if "request_start" not in g:
+            return
+        
+        elapsed = time.perf_counter() - g.request_start
+        endpoint = request.endpoint or "unknown"
+        request_seconds.observe(elapsed, endpoint=endpoint, status=g.get("response_status", 500))
+        collect_upstream_calls()
+
+        if slow_request_threshold > 0.0 and elapsed >= slow_request_threshold:
+            print("Slow request: %s %s took %.3fs (%s)" % (
+                request.method,
+                endpoint,
+                elapsed,
+                ", ".join("%s %.3fs" % (stage, seconds) for stage, seconds in g.stage_timings.items()) or "no stages timed"
+            ))
+
+    if enable_metrics:
+        @app.route("/metrics")
+        def metrics():
+            collect_upstream_calls()
+            return Response(metrics_registry.render(), mimetype="text/plain; version=0.0.4")
 
     def fetch_and_store_commit_hash():
-        f = open(commit_hash_filename, "w")
         import subprocess
         args = ['--git-dir=' + os.path.join(os.path.abspath(os.path.dirname(__file__)), ".git"), 'rev-parse', '--short', 'HEAD']
-        try:
+        for git in ('git', '/usr/bin/git'):
             try:
-                commit_hash = subprocess.check_output(['git'] + args).decode("utf-8").strip()
-                f.write(commit_hash)
-                f.close()
-                return commit_hash
-            except:
-                commit_hash = subprocess.check_output(['/usr/bin/git'] + args).decode("utf-8").strip()
-                f.write(commit_hash)
-                f.close()
+                commit_hash = subprocess.check_output([git] + args, stderr=subprocess.DEVNULL).decode("utf-8").strip()
+                with open(commit_hash_filename, "w") as f:
+                    f.write(commit_hash)
                 return commit_hash
-        except:
-            return ""
-
-    @app.before_first_request
-    def before_first_request():
-        fetch_and_store_commit_hash()
+            except Exception:
+                pass
+        return ""
 
     def get_commit_hash():
         try:
-            f = open(commit_hash_filename, "r")
-            hash = f.read()
-            return hash
+            with open(commit_hash_filename, "r") as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return ""
         except Exception:
             traceback.print_exc()
             return ""
 
-    def basic_info_dict():
+    # Site info for the page templates. None of it changes while the site runs, so it's worked out once here.
+    # Without a git checkout, the commit hash comes from the file an earlier run left behind.
+    def make_basic_info():
         email_rev = contact_email.split("@")
         basic_info = {
             "contact_email_user_reversed": email_rev[0][::-1],
@@ -155,12 +384,21 @@ def create_app():
             "donate_url": donate_url
         }
 
-        commit = get_commit_hash()
+        commit = fetch_and_store_commit_hash() or get_commit_hash()
         if commit:
             basic_info["commit"] = commit
         
         return basic_info
 
+    basic_info = make_basic_info()
+
+    def basic_info_dict():
+        return basic_info
+
+    # One serializer per kind of signed value, instead of one per request
+    cookie_serializer = URLSafeSerializer(app.secret_key)
+    intersection_token_serializer = URLSafeSerializer(app.secret_key, salt="intersection-token")
+
     # Tries to fetch the Steam info cookie, returns an errcode and a dict
     #
     # Errcodes:
@@ -169,26 +407,70 @@ def create_app():
     #     2: bad cookie JSON format
     #     3: info returned, but out of date (refresh recommended)
     def fetch_steam_cookie(request):
-        cookie_str = request.cookies.get("steam_info")
+        with stage_timer("cookie_decode"):
+            cookie_str = request.cookies.get("steam_info")
 
-        if not cookie_str:
-            return 0, {}
+            if not cookie_str:
+                return 0, {}
         
-        ser = URLSafeSerializer(app.secret_key)
-        loaded, cookie_json = ser.loads_unsafe(cookie_str)
+            loaded, steam_info = cookie_serializer.loads_unsafe(cookie_str)
 
-        if not loaded:
-            return 1, {}
+            if not loaded:
+                return 1, {}
         
-        try:
-            steam_info = json.loads(cookie_json)
-        except json.JSONDecodeError:
-            return 2, {}
+            if isinstance(steam_info, str):
+                # Cookies set before the info was signed as a dict hold it as a JSON string
+                try:
+                    steam_info = json.loads(steam_info)
+                except json.JSONDecodeError:
+                    return 2, {}
+            
+            if not isinstance(steam_info, dict):
+                return 2, {}
         
-        if "expires" not in steam_info.keys() or steam_info["expires"] <= datetime.now(timezone.utc).timestamp():
-            return 3, steam_info
-        else:
-            return 0, steam_info
+            if "expires" not in steam_info.keys() or steam_info["expires"] <= datetime.now(timezone.utc).timestamp():
+                return 3, steam_info
+            else:
+                return 0, steam_info
+
+    # Friend lists and player summaries, kept separately so each friend's summary is shared
+    # between every friend list they're on, and by the sign-in cookie
+    friend_lists = LRUCache(friend_list_cache_size if friend_list_max_age > 0.0 else 0) # steam_id -> array("Q") of friend steam ids
+    user_summaries = LRUCache(user_summary_cache_size if user_summary_max_age > 0.0 else 0) # steam_id -> player summary
+    user_cache_stats = {"friend_list_hits": 0, "friend_list_misses": 0, "summary_hits": 0, "summary_misses": 0}
+    user_cache_stats_lock = threading.Lock()
+
+    # Returns copies of the player summaries of steamids that Steam knows, in the order of steamids.
+    # Only users whose summary is missing or expired are fetched.
+    def get_users_info(steamids, deadline=None):
+        now = datetime.now(timezone.utc).timestamp()
+        summaries = user_summaries.get_many(steamids, now)
+        missing = [steamid for steamid in steamids if steamid not in summaries]
+
+        with user_cache_stats_lock:
+            user_cache_stats["summary_hits"] += len(summaries)
+            user_cache_stats["summary_misses"] += len(missing)
+        
+        if missing:
+            with stage_timer("steam_player_summaries"):
+                fetched = wcwp.steam.get_steam_users_info(steam_key, missing, time_left(deadline))
+            fetched = {user["steam_id"]: user for user in fetched}
+            user_summaries.set_many(fetched, now + user_summary_max_age)
+            summaries.update(fetched)
+        
+        return [dict(summaries[steamid]) for steamid in steamids if steamid in summaries]
+
+    # Same as wcwp.steam.get_friend_list, with the friend list and summaries served from cache where possible
+    def get_friends_info(steam_id, deadline=None):
+        friend_ids = friend_lists.get(steam_id)
+        with user_cache_stats_lock:
+            user_cache_stats["friend_list_hits" if friend_ids is not None else "friend_list_misses"] += 1
+        
+        if friend_ids is None:
+            friend_ids = array("Q", wcwp.steam.get_friend_ids(steam_key, steam_id, time_left(deadline)))
+            friend_lists.set(steam_id, friend_ids, datetime.now(timezone.utc).timestamp() + friend_list_max_age)
+        
+        return get_users_info(list(friend_ids), deadline)
 
     def refresh_steam_cookie(steamid: int, response):
         if steamid <= 0:
@@ -197,7 +479,7 @@ def create_app():
         
         info = {}
         try:
-            info = wcwp.steam.get_steam_users_info(steam_key, [steamid])[0]
+            info = get_users_info([steamid], request_deadline())[0]
         except IndexError:
             response.set_cookie("steam_info", "", secure=True, httponly=True)
             return {}
@@ -206,16 +488,45 @@ def create_app():
             response.set_cookie("steam_info", "", secure=True, httponly=True)
             return {}
 
-        ser = URLSafeSerializer(app.secret_key)
         response.set_cookie(
             "steam_info",
-            ser.dumps(json.dumps(info)),
+            cookie_serializer.dumps(info),
             secure=True,
             httponly=True,
             max_age=cookie_max_age
         )
         return info
 
+    # Pages that are the same for every visitor, rendered once per process. Debug mode renders them
+    # every time so template edits show up.
+    # A page is also rendered again once a static file it links to changes, since the links carry the file's fingerprint.
+    rendered_pages = {} # name -> (rendered html, etag, {static filename: fingerprint linked to})
+
+    def render_shared_page(name, template, **context):
+        page = rendered_pages.get(name)
+        if page is not None and any(static_fingerprint(filename) != fingerprint for filename, fingerprint in page[2].items()):
+            page = None
+        if page is None:
+            g.linked_static_files = {} # Filled in by fingerprint_static_urls
+            with stage_timer("render"):
+                html = render_template(template, **context)
+            page = (html, generate_etag(html.encode()), g.pop("linked_static_files"))
+            if not debug:
+                rendered_pages[name] = page
+        return page
+
+    # Shared pages get a strong ETag and are revalidated on every visit, since signing in or out changes them
+    def shared_page_response(page, response=None):
+        response = response or Response()
+        if request.if_none_match.contains(page[1]):
+            response.status_code = 304
+        else:
+            response.set_data(page[0])
+        response.set_etag(page[1])
+        response.headers["Cache-Control"] = "no-cache"
+        response.vary.add("Cookie")
+        return response
+
     @app.route('/')
     def index():
         errcode, steam_info = fetch_steam_cookie(request)
@@ -227,12 +538,55 @@ def create_app():
             response.set_cookie("steam_info", "", secure=True, httponly=True)
             steam_info = {}
         
-        response.data = render_template("home.html", steam_info=steam_info, **basic_info_dict())
+        if not steam_info:
+            page = render_shared_page("home", "home.html", steam_info={}, max_group_size=max_group_size, **basic_info_dict())
+            return shared_page_response(page, response)
+        
+        with stage_timer("render"):
+            response.set_data(render_template("home.html", steam_info=steam_info, max_group_size=max_group_size, **basic_info_dict()))
+        response.headers["Cache-Control"] = "private, no-cache"
         return response
 
     @app.route("/privacy")
     def privacy():
-        return render_template("privacy.html", privacy_email=privacy_email, **basic_info_dict())
+        return shared_page_response(render_shared_page("privacy", "privacy.html", privacy_email=privacy_email, **basic_info_dict()))
+
+    # Static files are linked with a ?v= fingerprint of their contents, so browsers can keep them
+    # for a year and still pick up changes as soon as a new version is deployed
+    static_fingerprints = {} # filename -> (mtime, fingerprint)
+    STATIC_MAX_AGE = 365 * 24 * 60 * 60
+
+    def static_fingerprint(filename):
+        file_path = path.join(app.static_folder, filename)
+        try:
+            mtime = os.path.getmtime(file_path)
+        except OSError:
+            return None
+        
+        cached = static_fingerprints.get(filename)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        
+        import hashlib
+        with open(file_path, "rb") as static_file:
+            fingerprint = hashlib.sha256(static_file.read()).hexdigest()[:12]
+        static_fingerprints[filename] = (mtime, fingerprint)
+        return fingerprint
+
+    @app.url_defaults
+    def fingerprint_static_urls(endpoint, values):
+        if endpoint == "static" and "filename" in values and "v" not in values:
+            fingerprint = static_fingerprint(values["filename"])
+            if fingerprint:
+                values["v"] = fingerprint
+            if "linked_static_files" in g:
+                g.linked_static_files[values["filename"]] = fingerprint
+
+    @app.after_request
+    def cache_fingerprinted_static(response):
+        if request.endpoint == "static" and "v" in request.args and response.status_code in (200, 304):
+            response.headers["Cache-Control"] = "public, max-age=%d, immutable" % STATIC_MAX_AGE
+        return response
 
     @app.route("/steam_login", methods=["GET", "POST"])
     def steam_login():
@@ -271,7 +625,7 @@ def create_app():
         try:
             steam_login_url = "https://steamcommunity.com/openid/login"
             params["openid.mode"] = "check_authentication"
-            r = requests.post(steam_login_url, data=params)
+            r = requests.post(steam_login_url, data=params, timeout=(connect_timeout, read_timeout))
             if "is_valid:true" in r.text:
                 return True
             return False
@@ -301,10 +655,9 @@ def create_app():
             )
         
         try:
-            friends_info = wcwp.steam.get_friend_list(
-                steam_key,
-                steam_info["steam_id"]
-            )
+            with stage_timer("steam_friend_list"):
+                friends_info = get_friends_info(steam_info["steam_id"], request_deadline())
+            queue_prefetch(steam_info["steam_id"], friends_info)
             
             for user in friends_info:
                 if "steam_id" in user.keys():
@@ -330,6 +683,12 @@ def create_app():
                 "Steam returned an unparseable response. Please try again later.",
                 500
             )
+        except wcwp.steam.DeadlineExceededException:
+            traceback.print_exc()
+            return (
+                "Steam took too long to respond. Please try again later.",
+                500
+            )
         except wcwp.steam.FriendListPrivateException:
             traceback.print_exc()
             return (
@@ -350,153 +709,1059 @@ def create_app():
                     500
                 )
 
+    IGDB_TOKEN_REFRESH_MARGIN = 600.0 # Seconds before expiry that the token gets refreshed in the background
+    IGDB_TOKEN_FAILURE_BACKOFF = 10.0 # Seconds after a failed refresh that Twitch isn't asked again
+    token_path = path.join(path.dirname(path.abspath(config_path)), "bearer-token.json")
+    igdb_token = {"access_token": "", "expiry": 0.0} # Replaced as a whole, never mutated
+    igdb_token_lock = threading.Lock() # Held by whichever thread is refreshing the token
+    igdb_token_failed_at = None # time.monotonic() of the last failed refresh, None once one succeeds
+
+    # Serializes token refreshes across worker processes
+    @contextmanager
+    def token_file_lock():
+        if fcntl is None:
+            yield
+            return
+        
+        lock_file = open(token_path + ".lock", "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+    def read_token_file():
+        try:
+            if path.exists(token_path):
+                with open(token_path) as token_file:
+                    return json.load(token_file)
+        except Exception:
+            traceback.print_exc()
+        return {}
+
+    def igdb_token_backing_off():
+        failed_at = igdb_token_failed_at
+        return failed_at is not None and time.monotonic() < failed_at + IGDB_TOKEN_FAILURE_BACKOFF
+
+    # Must be called while holding igdb_token_lock
     def refresh_igdb_token():
+        nonlocal igdb_token, igdb_token_failed_at
         try:
-            token_path = path.join(root_path, "bearer-token.json")
-            token = wcwp.igdb.fetch_twitch_token(igdb_key, igdb_secret)
-            token["expiry"] = datetime.now(timezone.utc).timestamp() + token.get("expires_in", 0)
-            token.pop("expires_in")
-            json.dump(token, open(token_path, "w"))
-            return token.get("access_token", "")
+            with token_file_lock():
+                # Another worker may have refreshed the token while we waited on the lock
+                token = read_token_file()
+                if datetime.now(timezone.utc).timestamp() >= token.get("expiry", 0) - IGDB_TOKEN_REFRESH_MARGIN:
+                    token = wcwp.igdb.fetch_twitch_token(igdb_key, igdb_secret)
+                    token["expiry"] = datetime.now(timezone.utc).timestamp() + token.get("expires_in", 0)
+                    token.pop("expires_in")
+
+                    temp_path = token_path + ".tmp"
+                    with open(temp_path, "w") as token_file:
+                        json.dump(token, token_file)
+                    os.replace(temp_path, token_path)
+            
+            igdb_token = {"access_token": token.get("access_token", ""), "expiry": token.get("expiry", 0.0)}
+            igdb_token_failed_at = None
+            return igdb_token["access_token"]
         except Exception:
             traceback.print_exc()
+            igdb_token_failed_at = time.monotonic()
             return ""
+    
+    def refresh_igdb_token_in_background():
+        try:
+            refresh_igdb_token()
+        finally:
+            igdb_token_lock.release()
 
     def get_igdb_token():
+        token = igdb_token
+        now = datetime.now(timezone.utc).timestamp()
+
+        if now < token["expiry"] - IGDB_TOKEN_REFRESH_MARGIN:
+            return token["access_token"]
+        
+        if now < token["expiry"]:
+            # Still valid, so refresh ahead of expiry without making this request wait.
+            # If a refresh is already running, or the last one just failed, just use the current token.
+            if not igdb_token_backing_off() and igdb_token_lock.acquire(blocking=False):
+                threading.Thread(target=refresh_igdb_token_in_background, daemon=True).start()
+            return token["access_token"]
+        
+        # While Twitch is failing, fail fast instead of each request asking it again in turn
+        if igdb_token_backing_off():
+            return ""
+        
+        with igdb_token_lock:
+            # Only the first thread through refreshes, the rest pick up its token or its failure
+            token = igdb_token
+            if datetime.now(timezone.utc).timestamp() < token["expiry"]:
+                return token["access_token"]
+            if igdb_token_backing_off():
+                return ""
+            return refresh_igdb_token()
+
+    CACHE_WRITE_MAX_BATCHES = 64 # Most queued writes committed in one transaction
+    CACHE_WRITE_QUEUE_TIMEOUT = 1.0 # Seconds a request waits for room in the write queue
+    CACHE_WRITE_FLUSH_TIMEOUT = 10.0 # Seconds to wait for queued writes at shutdown
+    CACHE_SWEEP_BATCH_PAUSE = 0.05 # Seconds between sweeper deletes, so queued writes get a turn
+    CACHE_SWEEP_VACUUM_PAGES = 2048 # Most free pages handed back to the filesystem per sweep
+    STALE_REFRESH_DELAY = 2.0 # Seconds stale ids are gathered before being refreshed together
+    STALE_REFRESH_MAX_BATCH = 2000 # Most stale ids refreshed in one round of IGDB calls
+    IGDB_CHUNK_SIZE = 500 # Appids per external_games query, same as the rust lib
+    PREFETCH_QUEUE_SIZE = 256 # Most friends waiting to be prefetched, more are dropped
+    PREFETCH_BUDGET_WINDOW = 60.0 # Seconds prefetch-budget-per-minute is counted over
+    COMPRESS_MIN_BYTES = 1024 # Smaller responses aren't worth compressing
+    GZIP_LEVEL = 6
+    BROTLI_QUALITY = 5 # Brotli's higher qualities cost far more CPU for little gain on JSON
+
+    # Each worker thread keeps its own connection open for the life of the process
+    cache_connections = threading.local()
+
+    def get_cache():
+        cache = getattr(cache_connections, "cache", None)
+        if cache is None:
+            import sqlite3
+            cache = sqlite3.connect(cache_file, timeout=10.0, cached_statements=256)
+            cache.row_factory = sqlite3.Row
+            cache.execute("PRAGMA synchronous = NORMAL;") # Safe in WAL mode, and skips an fsync per commit
+            cache.execute("PRAGMA temp_store = MEMORY;")
+            cache.execute("PRAGMA cache_size = -8192;") # 8MiB page cache per connection
+            cache_connections.cache = cache
+        return cache
+    
+    if cache_file:
         try:
-            token_path = path.join(root_path, "bearer-token.json")
-            if path.exists(token_path):
-                token_file = open(token_path)
-                token = json.load(token_file)
-                token_file.close()
-                if datetime.now(timezone.utc).timestamp() >= token.get("expiry", 0):
-                    return refresh_igdb_token()
-                else:
-                    return token.get("access_token", "")
-            else:
-                return refresh_igdb_token()
+            prepare_cache(cache_file)
         except Exception:
+            print("FAILED TO PREPARE CACHE DB, CACHING DISABLED")
             traceback.print_exc()
-            return ""
+            cache_file = None
 
-    cache_init_query = """
-    CREATE TABLE IF NOT EXISTS game (
-        steam_id INTEGER PRIMARY KEY,
-        igdb_id INTEGER,
-        name STRING,
-        supported_players INTEGER DEFAULT(0),
-        cover_id STRING,
-        has_multiplayer BOOLEAN,
-        expiry REAL DEFAULT(0.0)
-    );
-    """
-
-    CACHE_VERSION = 1
-
-    def initialize_cache():
-        import sqlite3
-        cache = sqlite3.connect(cache_file)
-        cache.execute(cache_init_query)
-        #cache.execute("PRAGMA user_version = ?;", [CACHE_VERSION]) # Doesn't work?
-        cache.execute("PRAGMA user_version = %d" % CACHE_VERSION)
-        return cache
+    OWNED_GAMES_INSERT_QUERY = "INSERT OR REPLACE INTO owned_games VALUES (?,?,?);"
+
+    # uWSGI forks after create_app, so background threads are started lazily in each worker process.
+    # state is a dict of {"thread", "pid", "lock"}
+    def ensure_background_thread(state, target, name):
+        with state["lock"]:
+            if not background_thread_running(state):
+                thread = threading.Thread(target=target, name=name, daemon=True)
+                thread.start()
+                state["thread"] = thread
+                state["pid"] = os.getpid()
     
-    def cache_is_correct_version(cache):
-        return cache.execute("PRAGMA user_version;").fetchone()[0] == CACHE_VERSION
+    def background_thread_running(state):
+        thread = state["thread"]
+        return thread is not None and thread.is_alive() and state["pid"] == os.getpid()
 
-    def update_cached_games(game_info):
-        if not cache_file:
+    # Cache writes are handed to a background thread so requests don't wait on SQLite commits.
+    # Queue items are (insert query, rows) tuples, and None tells the writer to exit.
+    cache_write_queue = queue.Queue(maxsize=cache_write_queue_size)
+    cache_writer = {"thread": None, "pid": None, "lock": threading.Lock()}
+
+    def write_cache_rows(query, rows):
+        with stage_timer("cache_write"), get_cache() as cache:
+            cache.executemany(query, rows)
+
+    def cache_writer_loop():
+        running = True
+        while running:
+            batches = [cache_write_queue.get()]
+            # Coalesce whatever else is already waiting into the same transaction
+            while len(batches) < CACHE_WRITE_MAX_BATCHES:
+                try:
+                    batches.append(cache_write_queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            coalesced = {} # query -> {primary key: row}, so the newest row for a key wins
+            for batch in batches:
+                if batch is None:
+                    running = False
+                    continue
+                query, rows = batch
+                coalesced.setdefault(query, {}).update((row[0], row) for row in rows)
+            
+            try:
+                if coalesced:
+                    with stage_timer("cache_write"), get_cache() as cache:
+                        for query, rows in coalesced.items():
+                            cache.executemany(query, list(rows.values()))
+            except Exception:
+                print("FAILED TO UPDATE CACHE DB")
+                traceback.print_exc()
+            finally:
+                for _ in batches:
+                    cache_write_queue.task_done()
+    
+    def queue_cache_write(query, rows):
+        if not rows:
             return
         
+        ensure_background_thread(cache_writer, cache_writer_loop, "wcwp-cache-writer")
+        ensure_cache_sweeper()
         try:
-            import sqlite3
-            cache = None
-
-            if os.path.exists(cache_file):
-                cache = sqlite3.connect(cache_file)
-                # Check if cache is correct version
-                if not cache_is_correct_version(cache):
-                    # Cache is the wrong version, rebuild
-                    print("Cache file is the wrong version! Rebuilding... ")
-                    cache.close()
-                    os.remove(cache_file)
-                    cache = initialize_cache()
-            else:
-                cache = initialize_cache()
-            
-            insert_info = [
-                [
-                    game.get("steam_id"),
-                    game.get("igdb_id"),
-                    game.get("name"),
-                    game.get("supported_players"),
-                    game.get("cover_id"),
-                    game.get("has_multiplayer"),
-                    datetime.now(timezone.utc).timestamp() + cache_max_age
-                ] for game in game_info
-            ]
-            
-            cache.executemany(
-                "INSERT OR REPLACE INTO game VALUES (?,?,?,?,?,?,?);",
-                insert_info
-            )
+            cache_write_queue.put((query, rows), timeout=CACHE_WRITE_QUEUE_TIMEOUT)
+        except queue.Full:
+            # Writer is falling behind, so make this request pay for its own write
+            try:
+                write_cache_rows(query, rows)
+            except Exception:
+                print("FAILED TO UPDATE CACHE DB")
+                traceback.print_exc()
+    
+    @atexit.register
+    def flush_cache_writes():
+        if not background_thread_running(cache_writer):
+            return
+        try:
+            cache_write_queue.put(None, timeout=CACHE_WRITE_QUEUE_TIMEOUT)
+            cache_writer["thread"].join(timeout=CACHE_WRITE_FLUSH_TIMEOUT)
+        except queue.Full:
+            print("Cache write queue is still full at shutdown, some cache writes were dropped")
+
+    # The cache sweeper deletes rows that have expired (game rows once their stale grace is up too),
+    # then the rows closest to expiring while the game table is over igdb-cache-max-entries.
+    # Deletes go in batches of cache-sweep-batch-size, each in its own short transaction,
+    # so requests and the cache writer never wait long on the sweeper.
+    cache_sweeper = {"thread": None, "pid": None, "lock": threading.Lock()}
+    cache_evictions = metrics_registry.counter("wcwp_cache_evictions_total", "Rows deleted from the cache file by the sweeper", ("table", "reason"))
+    cache_file_stats = {"rows": {}, "free_pages": 0, "page_size": 0} # As of the last sweep
+    cache_file_stats_lock = threading.Lock()
+
+    # Deletes up to limit of the rows picked by selection, e.g. "WHERE expiry < ?"
+    def delete_cache_rows(table, selection, params, limit, reason):
+        with get_cache() as cache:
+            deleted = cache.execute(
+                "DELETE FROM %s WHERE rowid IN (SELECT rowid FROM %s %s LIMIT ?);" % (table, table, selection),
+                params + (limit,)
+            ).rowcount
+        cache_evictions.inc(deleted, table=table, reason=reason)
+        return deleted
+
+    def delete_expired_cache_rows(table, cutoff):
+        deleted = 0
+        while True:
+            batch_deleted = delete_cache_rows(table, "WHERE expiry < ?", (cutoff,), cache_sweep_batch_size, "expired")
+            deleted += batch_deleted
+            if batch_deleted < cache_sweep_batch_size:
+                return deleted
+            time.sleep(CACHE_SWEEP_BATCH_PAUSE)
+
+    def delete_excess_game_rows():
+        deleted = 0
+        while True:
+            excess = get_cache().execute("SELECT COUNT(*) FROM game;").fetchone()[0] - cache_max_entries
+            if excess <= 0:
+                return deleted
+            deleted += delete_cache_rows("game", "ORDER BY expiry", (), min(excess, cache_sweep_batch_size), "capacity")
+            time.sleep(CACHE_SWEEP_BATCH_PAUSE)
+
+    # returns {table: rows deleted}
+    def sweep_cache():
+        now = datetime.now(timezone.utc).timestamp()
+        deleted = {}
+        with stage_timer("cache_sweep"):
+            deleted["game"] = delete_expired_cache_rows("game", now - cache_stale_grace)
+            deleted["owned_games"] = delete_expired_cache_rows("owned_games", now)
+            deleted["igdb_miss"] = delete_expired_cache_rows("igdb_miss", now)
+            if cache_max_entries > 0:
+                deleted["game"] += delete_excess_game_rows()
+
+            cache = get_cache()
+            cache.executescript("PRAGMA incremental_vacuum(%d);" % CACHE_SWEEP_VACUUM_PAGES) # execute() only frees one page
+            rows = {table: cache.execute("SELECT COUNT(*) FROM %s;" % table).fetchone()[0] for table in ("game", "owned_games", "igdb_miss")}
+            free_pages = cache.execute("PRAGMA freelist_count;").fetchone()[0]
+            page_size = cache.execute("PRAGMA page_size;").fetchone()[0]
+
+        with cache_file_stats_lock:
+            cache_file_stats.update(rows=rows, free_pages=free_pages, page_size=page_size)
+        return deleted
+
+    # Every worker process runs its own sweeper. Sweeps are idempotent, so overlapping ones only repeat a cheap index scan.
+    def cache_sweep_loop():
+        while True:
+            time.sleep(cache_sweep_interval)
+            try:
+                sweep_cache()
+            except Exception:
+                print("FAILED TO SWEEP CACHE DB")
+                traceback.print_exc()
+
+    def ensure_cache_sweeper():
+        if cache_file and cache_sweep_interval > 0.0:
+            ensure_background_thread(cache_sweeper, cache_sweep_loop, "wcwp-cache-sweeper")
+
+    def cache_file_samples():
+        samples = []
+        for suffix in ("", "-wal"):
+            try:
+                samples.append(((path.basename(cache_file + suffix),), os.path.getsize(cache_file + suffix)))
+            except OSError:
+                pass
+        return samples
+
+    def cache_row_samples():
+        with cache_file_stats_lock:
+            return [((table,), rows) for table, rows in cache_file_stats["rows"].items()]
+
+    def cache_free_bytes_samples():
+        with cache_file_stats_lock:
+            if not cache_file_stats["rows"]:
+                return []
+            return [((), cache_file_stats["free_pages"] * cache_file_stats["page_size"])]
+
+    if cache_file:
+        metrics_registry.callback(
+            "wcwp_cache_file_bytes", "Size of the cache file and its write-ahead log", "gauge", ("file",),
+            cache_file_samples
+        )
+        metrics_registry.callback(
+            "wcwp_cache_file_rows", "Rows in each table of the cache file, as of the last sweep", "gauge", ("table",),
+            cache_row_samples
+        )
+        metrics_registry.callback(
+            "wcwp_cache_file_free_bytes", "Unused space left in the cache file after the last sweep", "gauge", (),
+            cache_free_bytes_samples
+        )
+
+    # Where game info is shared between requests: the SQLite cache file for this node,
+    # or a Redis server shared by every node. None when game info isn't cached.
+    game_cache = None
+    miss_cache = None # Steam ids IGDB doesn't know, in the same place as game_cache
+    if cache_backend == "redis":
+        redis_client = RedisClient(redis_url, redis_timeout)
+        game_cache = RedisCache(redis_client, "wcwp:game:")
+        miss_cache = RedisCache(redis_client, "wcwp:igdb-miss:")
+    elif cache_file:
+        game_cache = SQLiteGameCache(get_cache, queue_cache_write, cache_stale_grace)
+        miss_cache = SQLiteMissCache(get_cache, queue_cache_write)
+
+    # In-process tiers in front of the shared caches
+    game_memory_cache = LRUCache(game_memory_cache_size if cache_max_age > 0.0 else 0) # steam_id -> (expiry, game info)
+    miss_memory_cache = LRUCache(miss_memory_cache_size if miss_max_age > 0.0 else 0) # steam_id -> (expiry, None)
+    owned_games_memory = LRUCache(owned_games_cache_size) # steam_id -> sorted array("Q") of appids
+    cache_stats_lock = threading.Lock()
+    game_cache_stats = {"memory_hits": 0, "disk_hits": 0, "igdb_miss_hits": 0, "misses": 0, "stale_hits": 0}
+    owned_games_stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+    def count_cache_lookup(stats, memory_hits, disk_hits, misses, stale_hits=0, igdb_miss_hits=0):
+        with cache_stats_lock:
+            stats["memory_hits"] += memory_hits
+            stats["disk_hits"] += disk_hits
+            stats["misses"] += misses
+            if stale_hits:
+                stats["stale_hits"] += stale_hits
+            if igdb_miss_hits:
+                stats["igdb_miss_hits"] += igdb_miss_hits
+
+    # Hits over all lookups, 0 before the first lookup
+    def cache_hit_ratio(stats, hit_keys, lock):
+        with lock:
+            hits = sum(stats[key] for key in hit_keys)
+            total = sum(value for key, value in stats.items() if key != "stale_hits") # Stale hits are also counted as hits
+        return hits / total if total else 0.0
 
-            cache.commit()
-            cache.close()
+    def stats_samples(stats, lock):
+        with lock:
+            return [((key,), value) for key, value in stats.items()]
+
+    metrics_registry.callback(
+        "wcwp_game_cache_lookups_total", "Game info cache lookups by result", "counter", ("result",),
+        lambda: stats_samples(game_cache_stats, cache_stats_lock)
+    )
+    metrics_registry.callback(
+        "wcwp_owned_games_cache_lookups_total", "Owned games cache lookups by result", "counter", ("result",),
+        lambda: stats_samples(owned_games_stats, cache_stats_lock)
+    )
+    metrics_registry.callback(
+        "wcwp_cache_entries", "Entries held in each in-memory cache", "gauge", ("cache",),
+        lambda: [
+            (("game",), len(game_memory_cache)),
+            (("igdb_miss",), len(miss_memory_cache)),
+            (("owned_games",), len(owned_games_memory)),
+            (("intersection",), len(intersection_results)),
+            (("friend_list",), len(friend_lists)),
+            (("user_summary",), len(user_summaries))
+        ]
+    )
+    metrics_registry.callback(
+        "wcwp_user_cache_lookups_total", "Friend list and player summary cache lookups by result", "counter", ("result",),
+        lambda: stats_samples(user_cache_stats, user_cache_stats_lock)
+    )
+    metrics_registry.callback(
+        "wcwp_cache_write_queue_length", "Cache write batches waiting for the writer thread", "gauge", (),
+        lambda: [((), cache_write_queue.qsize())]
+    )
+
+    def update_cached_games(game_info):
+        if game_cache is None:
+            return
+        
+        expiry = datetime.now(timezone.utc).timestamp() + cache_max_age
+        entries = {
+            game.get("steam_id"): (expiry, {column: game.get(column) for column in GAME_COLUMNS})
+            for game in game_info
+        }
+
+        game_memory_cache.set_many(entries, expiry + cache_stale_grace)
+        try:
+            with stage_timer("cache_write"):
+                game_cache.set_many(entries, expiry + cache_stale_grace)
         except Exception:
-            print("FAILED TO UPDATE CACHE DB")
+            print("FAILED TO UPDATE GAME CACHE")
             traceback.print_exc()
+    
+    # Remembers steam ids IGDB doesn't know for igdb-cache-miss-max-age, so they aren't asked for again until then
+    def update_cached_misses(steam_ids):
+        if miss_cache is None or miss_max_age <= 0.0 or not steam_ids:
             return
+        
+        expiry = datetime.now(timezone.utc).timestamp() + miss_max_age
+        entries = {steam_id: (expiry, None) for steam_id in steam_ids}
+        miss_memory_cache.set_many(entries, expiry)
+        try:
+            with stage_timer("cache_write"):
+                miss_cache.set_many(entries, expiry)
+        except Exception:
+            print("FAILED TO UPDATE IGDB MISS CACHE")
+            traceback.print_exc()
+    
+    # returns the set of steam_ids that IGDB is known not to have
+    def get_cached_misses(steam_ids, now):
+        if miss_cache is None or miss_max_age <= 0.0:
+            return set()
+        
+        misses = set(miss_memory_cache.get_many(steam_ids, now))
+        unknown = [steam_id for steam_id in steam_ids if steam_id not in misses]
+        if unknown:
+            try:
+                with stage_timer("igdb_miss_lookup"):
+                    shared_misses = miss_cache.get_many(unknown, now)
+            except Exception:
+                print("EXCEPTION THROWN WHILE QUERYING IGDB MISS CACHE!")
+                traceback.print_exc()
+                shared_misses = {}
+            
+            miss_memory_cache.set_many(shared_misses, {steam_id: expiry for steam_id, (expiry, _) in shared_misses.items()})
+            misses.update(shared_misses)
+        return misses
     
     # returns [info of cached games], (set of uncached ids)
-    def get_cached_games(steam_ids):
-        if not cache_file:
+    #
+    # Rows up to cache_stale_grace past their expiry are still returned,
+    # and queued to be refreshed from IGDB in the background.
+    # Games IGDB is known not to have are in neither.
+    # stats=False leaves the lookup out of the cache hit metrics, for lookups no request is waiting on
+    def get_cached_games(steam_ids, stats=True):
+        if game_cache is None:
             return [], set(steam_ids)
 
+        now = datetime.now(timezone.utc).timestamp()
+        found = game_memory_cache.get_many(steam_ids, now)
         game_info = []
-        uncached = set(steam_ids)
+        stale = []
+        for steam_id, (expiry, game) in found.items():
+            game_info.append(game)
+            if now >= expiry:
+                stale.append(steam_id)
+
+        uncached = set(steam_ids).difference(found.keys())
+        shared_hits = {}
         
-        try:
-            import sqlite3
-            cache = sqlite3.connect(cache_file)
-            cache.row_factory = sqlite3.Row
+        if uncached:
+            try:
+                with stage_timer("game_cache_lookup"):
+                    shared_hits = game_cache.get_many(uncached, now)
+            except Exception:
+                print("EXCEPTION THROWN WHILE QUERYING GAME CACHE!")
+                traceback.print_exc()
+                shared_hits = {}
+            
+            for steam_id, (expiry, game) in shared_hits.items():
+                game_info.append(game)
+                if now >= expiry:
+                    # Still within the grace period, expired info gets updated during update_cached_games()
+                    stale.append(steam_id)
+            
+            game_memory_cache.set_many(
+                shared_hits,
+                {steam_id: expiry + cache_stale_grace for steam_id, (expiry, _) in shared_hits.items()}
+            )
+            uncached.difference_update(shared_hits.keys())
+        
+        misses = get_cached_misses(uncached, now) if uncached else set()
+        uncached.difference_update(misses)
+        
+        queue_stale_refresh(stale)
+        if stats:
+            count_cache_lookup(game_cache_stats, len(found), len(shared_hits), len(uncached), len(stale), len(misses))
+        return game_info, uncached
+
+    # Stale game info waiting to be refreshed, gathered into batched IGDB calls
+    stale_refresh_pending = set()
+    stale_refresh_condition = threading.Condition()
+    stale_refresher = {"thread": None, "pid": None, "lock": threading.Lock()}
 
-            if not cache_is_correct_version(cache):
-                return [], set(steam_ids)
+    def queue_stale_refresh(steam_ids):
+        if not steam_ids:
+            return
+        
+        with stale_refresh_condition:
+            stale_refresh_pending.update(steam_ids)
+            stale_refresh_condition.notify()
+        ensure_background_thread(stale_refresher, stale_refresh_loop, "wcwp-stale-refresher")
+    
+    def stale_refresh_loop():
+        while True:
+            with stale_refresh_condition:
+                while not stale_refresh_pending:
+                    stale_refresh_condition.wait()
             
-            query_str = "SELECT * FROM game WHERE steam_id IN (%s)" % ("?" + (",?" * (len(steam_ids) - 1))) # Construct a query with arbitrary parameter length
+            time.sleep(STALE_REFRESH_DELAY) # Let other requests add to this batch
+
+            with stale_refresh_condition:
+                batch = [stale_refresh_pending.pop() for _ in range(min(len(stale_refresh_pending), STALE_REFRESH_MAX_BATCH))]
             
-            cursor = cache.execute(
-                query_str,
-                steam_ids
+            try:
+                fetch_and_cache_game_info(get_igdb_token(), batch)
+                print("Refreshed %d stale cache entries" % len(batch))
+            except Exception:
+                print("FAILED TO REFRESH STALE CACHE ENTRIES")
+                traceback.print_exc()
+
+    # Fetches info for the given steam ids from IGDB and caches it.
+    # Returns the fetched info, and the set of steam ids that weren't fetched before the deadline.
+    # Games IGDB doesn't know go to the miss cache and aren't returned.
+    # max_in_flight is how many IGDB requests the rust lib makes at once for this call.
+    def fetch_and_cache_game_info(token, steam_ids, deadline=None, max_in_flight=igdb_max_in_flight):
+        with stage_timer("igdb_fetch"):
+            fetched_info, not_found = wcwp.igdb.get_steam_game_info(igdb_key, token, list(steam_ids), max_in_flight, time_left(deadline))
+        unfetched = set(steam_ids).difference(game["steam_id"] for game in fetched_info).difference(not_found)
+
+        update_cached_games(fetched_info)
+        update_cached_misses(not_found)
+
+        return fetched_info, unfetched
+
+    # returns {steam_id: sorted array of owned appids}, as they were cached
+    def update_cached_owned_games(owned):
+        owned = {steamid: array("Q", sorted(appids)) for steamid, appids in owned.items()}
+        if not owned or owned_games_max_age <= 0.0:
+            return owned
+        
+        expiry = datetime.now(timezone.utc).timestamp() + owned_games_max_age
+        owned_games_memory.set_many(owned, expiry)
+
+        if cache_file:
+            queue_cache_write(
+                OWNED_GAMES_INSERT_QUERY,
+                [[steamid, appids.tobytes(), expiry] for steamid, appids in owned.items()]
             )
-            for row in cursor.fetchall():
-                game = dict(row)
-                if datetime.now(timezone.utc).timestamp() < game.pop("expiry"):
-                    # Info hasn't expired
-                    game_info.append(game)
-                    uncached.remove(game["steam_id"])
-
-                # Expired info gets updated during update_cached_games()
+        return owned
+    
+    # returns {steam_id: sorted array of owned appids}, [uncached steam ids]
+    def get_cached_owned_games(steamids, stats=True):
+        if owned_games_max_age <= 0.0:
+            return {}, list(steamids)
+        
+        now = datetime.now(timezone.utc).timestamp()
+        owned = owned_games_memory.get_many(steamids, now)
+        memory_hits = len(owned)
+        uncached = [id for id in steamids if id not in owned]
+        disk_hits = {}
+        
+        if uncached and cache_file:
+            try:
+                cache = get_cache()
+                query_str = "SELECT steam_id, appids, expiry FROM owned_games WHERE steam_id IN (%s)" % ("?" + (",?" * (len(uncached) - 1)))
+                disk_expiry = {}
+                with stage_timer("owned_games_cache_lookup"):
+                    rows = cache.execute(query_str, uncached).fetchall()
+                for steamid, appids, expiry in rows:
+                    if now < expiry:
+                        disk_hits[steamid] = array("Q", appids)
+                        disk_expiry[steamid] = expiry
+                
+                owned_games_memory.set_many(disk_hits, disk_expiry)
+                owned.update(disk_hits)
+                uncached = [id for id in uncached if id not in disk_hits]
+            except Exception:
+                print("EXCEPTION THROWN WHILE QUERYING OWNED GAMES CACHE!")
+                traceback.print_exc()
+                disk_hits = {}
+        
+        if stats:
+            count_cache_lookup(owned_games_stats, memory_hits, len(disk_hits), len(uncached))
+        return owned, uncached
+
+    # returns {steam_id: owned appids}, from the owned games cache where possible
+    def get_owned_games(steamids, deadline=None):
+        owned, uncached = get_cached_owned_games(steamids)
+        if not uncached:
+            return owned
+        
+        with stage_timer("steam_owned_games"):
+            with ThreadPoolExecutor(max_workers=min(steam_max_concurrency, len(uncached))) as pool:
+                fetched = dict(zip(uncached, pool.map(
+                    lambda steamid: wcwp.steam.get_owned_steam_games(steam_key, steamid, time_left(deadline)),
+                    uncached
+                )))
+        owned.update(update_cached_owned_games(fetched))
+
+        return owned
+
+    # The owner count of every game anyone in a group owns, so that a follow-up request which adds or removes
+    # users only has to look at their games lists. The games lists the counts were made from are kept with them,
+    # so a removed user is taken out with the same list they were counted with.
+    # Sorted steam ids -> (owner counts as in owner_counts.py, {steam_id: owned appids}, expiry)
+    group_owner_counts = LRUCache(group_cache_size if owned_games_max_age > 0.0 else 0)
+
+    def store_group_counts(key, owned, expiry):
+        with stage_timer("intersection_delta"):
+            counted = (count_owners(owned), owned, expiry)
+        group_owner_counts.set(key, counted, expiry)
+        return counted
+
+    # Returns {appid: owner count} for every game owned by anyone in steamids, and the set of users with no games.
+    #
+    # If base is the sorted steam ids of a group counted recently, only the users added to or removed from it are
+    # looked at. Counts derived from a base keep its expiry, so they can't drift from the users' games lists
+    # for longer than the owned games cache could.
+    def count_group_owners(steamids, deadline=None, base=None):
+        key = tuple(sorted(steamids))
+        counted = group_owner_counts.get(key)
+        if counted is None and base is not None:
+            base_counted = group_owner_counts.get(base)
+            removed = set(base).difference(steamids)
+            if base_counted is not None and removed.issubset(base_counted[1]):
+                base_counts, base_owned, expiry = base_counted
+                added = set(steamids).difference(base)
+                added_owned = get_owned_games(list(added), deadline) if added else {}
+
+                with stage_timer("intersection_delta"):
+                    counts = apply_owner_delta(
+                        base_counts,
+                        added_owned,
+                        {steamid: base_owned[steamid] for steamid in removed}
+                    )
+                owned = {steamid: appids for steamid, appids in base_owned.items() if steamid not in removed}
+                owned.update(added_owned)
+                counted = (counts, owned, expiry)
+                group_owner_counts.set(key, counted, expiry)
+        
+        if counted is None:
+            owned = get_owned_games(steamids, deadline)
+            counted = store_group_counts(key, owned, datetime.now(timezone.utc).timestamp() + owned_games_max_age)
+        
+        (appids, counts, empty_users), _, _ = counted
+        return dict(zip(appids, counts)), empty_users
+
+    def check_games_lists(steamids, min_owners, empty_users):
+        if min_owners >= len(steamids) and empty_users:
+            steamid = min(empty_users)
+            raise wcwp.steam.GamesListEmptyException("The user with the Steam ID %d has no games to intersect" % steamid, steamid)
+
+    # Returns {appid: owner count} for the games owned by at least min_owners of steamids
+    #
+    # Requests from a token are answered from the owner counts of every game, which count_group_owners keeps for
+    # the next token request. Other requests only count the games that qualify, and when everyone has to own a game
+    # the games lists stop being fetched as soon as the intersection is empty or one of them is private. The owner
+    # counts are kept when every games list was fetched anyway, and only then does the response carry a token.
+    def count_game_owners(steamids, min_owners, deadline=None, base=None):
+        key = tuple(sorted(steamids))
+        if base is None and group_owner_counts.get(key) is None:
+            owned, uncached = get_cached_owned_games(steamids)
+            check_games_lists(steamids, min_owners, [steamid for steamid, appids in owned.items() if not appids])
+            with stage_timer("steam_owned_games"):
+                owners, fetched = wcwp.steam.count_game_owners_from(
+                    steam_key,
+                    uncached,
+                    list(owned.values()),
+                    min_owners,
+                    steam_max_concurrency,
+                    time_left(deadline)
+                )
+            owned.update(update_cached_owned_games(fetched))
+            if owned_games_max_age > 0.0 and len(owned) == len(key):
+                store_group_counts(key, owned, datetime.now(timezone.utc).timestamp() + owned_games_max_age)
+            return dict(owners)
+
+        owners, empty_users = count_group_owners(steamids, deadline, base)
+        check_games_lists(steamids, min_owners, empty_users)
+        return {appid: count for appid, count in owners.items() if count >= min_owners}
+
+    # Signed reference to a counted group, which a follow-up request sends back along with the users it adds or removes.
+    # None when the group's owner counts weren't kept, so the follow-up sends its steam ids instead.
+    def intersection_token(steam_id, steamids):
+        if group_owner_counts.get(tuple(sorted(steamids))) is None:
+            return None
+        return intersection_token_serializer.dumps({"user": steam_id, "steamids": sorted(steamids)})
+
+    # Response compression, negotiated from Accept-Encoding. Brotli is used when the brotli package is installed.
+    def response_encoding():
+        if not compress_responses:
+            return None
+        return request.accept_encodings.best_match(["br", "gzip"] if brotli else ["gzip"])
+
+    def compress_response(response):
+        if not compress_responses:
+            return response
+        
+        # Whether or not this one gets compressed, the body depends on Accept-Encoding, so caches must key on it
+        response.vary.add("Accept-Encoding")
+        encoding = response_encoding()
+        if encoding is None or response.content_length is None or response.content_length < COMPRESS_MIN_BYTES:
+            return response
+        
+        with stage_timer("compress"):
+            if encoding == "br":
+                response.set_data(brotli.compress(response.get_data(), quality=BROTLI_QUALITY))
+            else:
+                response.set_data(gzip.compress(response.get_data(), GZIP_LEVEL))
+        response.headers["Content-Encoding"] = encoding
+        return response
+
+    # Compresses a stream of text records, flushing after each one so the client can decode it as it arrives
+    def compress_stream(records, encoding):
+        if encoding == "br":
+            compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+            for record in records:
+                yield compressor.process(record.encode()) + compressor.flush()
+            yield compressor.finish()
+        else:
+            compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31) # 31 writes a gzip header
+            for record in records:
+                yield compressor.compress(record.encode()) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            yield compressor.flush()
+
+    # Friends whose owned games and game info are warmed in the background after their friend list is served,
+    # so the first intersection usually finds them cached
+    prefetch_queue = queue.Queue(maxsize=PREFETCH_QUEUE_SIZE)
+    prefetch_pending = set() # Steam ids queued or being prefetched
+    prefetch_lock = threading.Lock()
+    prefetch_slots = threading.Semaphore(prefetch_concurrency)
+    prefetcher = {"thread": None, "pid": None, "lock": threading.Lock()}
+    prefetch_budget = {"window_start": 0.0, "used": 0}
+    prefetch_results = metrics_registry.counter("wcwp_prefetch_total", "Friends considered for prefetching by what came of it", ("result",))
+    prefetch_igdb_games = metrics_registry.counter("wcwp_prefetch_igdb_games_total", "Games whose info was prefetched from IGDB")
+
+    # Queues the friends most likely to be intersected next: the user themself, then online friends, then the rest.
+    # Private profiles and friends whose games are already in memory are skipped.
+    def queue_prefetch(steam_id, friends_info):
+        if prefetch_friends <= 0 or prefetch_budget_per_minute <= 0:
+            return
+        
+        candidates = [steam_id] + [
+            friend["steam_id"] for friend in sorted(friends_info, key=lambda friend: not friend.get("online"))
+            if friend.get("visibility") == 3
+        ]
+        cached = owned_games_memory.get_many(candidates)
+        candidates = [steamid for steamid in candidates if steamid not in cached][:prefetch_friends]
+
+        with prefetch_lock:
+            for steamid in candidates:
+                if steamid in prefetch_pending:
+                    continue
+                try:
+                    prefetch_queue.put_nowait(steamid)
+                    prefetch_pending.add(steamid)
+                except queue.Full:
+                    prefetch_results.inc(result="dropped")
+        ensure_background_thread(prefetcher, prefetch_loop, "wcwp-prefetcher")
+    
+    # Prefetches run on daemon threads, so one still waiting on Steam never holds up shutdown
+    def prefetch_loop():
+        while True:
+            steamid = prefetch_queue.get()
+            prefetch_slots.acquire() # At most prefetch_concurrency friends in flight
+            threading.Thread(target=prefetch_friend, args=(steamid,), name="wcwp-prefetch", daemon=True).start()
+
+    # Takes up to cost upstream calls from the prefetch budget, returns how many were granted
+    def take_prefetch_budget(cost):
+        with prefetch_lock:
+            now = time.monotonic()
+            if now - prefetch_budget["window_start"] >= PREFETCH_BUDGET_WINDOW:
+                prefetch_budget["window_start"] = now
+                prefetch_budget["used"] = 0
+            
+            granted = max(0, min(cost, prefetch_budget_per_minute - prefetch_budget["used"]))
+            prefetch_budget["used"] += granted
+            return granted
+
+    # Prefetching holds off while any upstream is failing or over half way to its concurrency limit,
+    # leaving the room to live requests
+    def upstreams_busy():
+        return any(
+            state["circuit"] != "closed" or state["in_flight"] * 2 >= state["concurrency_limit"]
+            for state in wcwp.upstream_states()
+        )
+
+    def prefetch_friend(steamid):
+        try:
+            if upstreams_busy():
+                prefetch_results.inc(result="busy")
+                return
+            
+            owned, uncached = get_cached_owned_games([steamid], stats=False)
+            if uncached:
+                if not take_prefetch_budget(1):
+                    prefetch_results.inc(result="over_budget")
+                    return
+                owned[steamid] = wcwp.steam.get_owned_steam_games(steam_key, steamid, None)
+                update_cached_owned_games({steamid: owned[steamid]})
+            
+            _, uncached_games = get_cached_games(owned[steamid], stats=False)
+            if uncached_games:
+                chunks = take_prefetch_budget(-(-len(uncached_games) // IGDB_CHUNK_SIZE))
+                uncached_games = sorted(uncached_games)[:chunks * IGDB_CHUNK_SIZE]
+                if uncached_games:
+                    fetch_and_cache_game_info(get_igdb_token(), uncached_games)
+                    prefetch_igdb_games.inc(len(uncached_games))
+            
+            prefetch_results.inc(result="prefetched")
+        except wcwp.steam.GamesListPrivateException:
+            prefetch_results.inc(result="private")
         except Exception:
-            print("EXCEPTION THROWN WHILE QUERYING GAME CACHE!")
+            prefetch_results.inc(result="failed")
+            print("FAILED TO PREFETCH OWNED GAMES")
             traceback.print_exc()
-            return [], set(steam_ids)
+        finally:
+            with prefetch_lock:
+                prefetch_pending.discard(steamid)
+            prefetch_slots.release()
+
+    # Copies game info with each game's owner count added, when not every game is owned by the whole group
+    def with_owner_counts(game_info, owners, group_size):
+        if all(count == group_size for count in owners.values()):
+            return game_info
+        return [dict(game, owners=owners.get(game["steam_id"], 0)) for game in game_info]
+
+
+    # Runs the whole Steam + cache + IGDB pipeline for one group, keeping games owned by at least min_owners of them
+    #
+    # Returns the game info, and whether it is partial because IGDB ran out of time.
+    # Games that weren't fetched in time are included with only their steam_id.
+    # If some games aren't owned by everyone, every game has an "owners" count.
+    def intersect_owned_games(steamids, min_owners, deadline=None, base=None):
+        token = get_igdb_token()
+        with stage_timer("intersection"):
+            owners = count_game_owners(list(steamids), min_owners, deadline, base)
+        game_ids = list(owners)
+
+        fetched_game_count = 0
+        cached_game_count = 0
+        game_info = []
+        unfetched = set()
+
+        if game_ids:
+            game_info, uncached_ids = get_cached_games(game_ids)
+
+            cached_game_count = len(game_info)
+
+            if uncached_ids:
+                fetched_info, unfetched = fetch_and_cache_game_info(token, uncached_ids, deadline)
+
+                game_info += fetched_info
+                game_info += [{"steam_id": steam_id} for steam_id in unfetched]
+                fetched_game_count = len(fetched_info)
         
-        return game_info, uncached
+        print("Intersection resulted in %d games (%d from cache, %d from IGDB, %d out of time)" % (len(game_info), cached_game_count, fetched_game_count, len(unfetched)))
+
+        return with_owner_counts(game_info, owners, len(steamids)), bool(unfetched)
+
+    # Identical groups (by sorted Steam IDs, min owners and flags) share one computation while it runs,
+    # and its result is kept for a short while after
+    intersection_results = LRUCache(intersection_cache_size if intersection_max_age > 0.0 else 0)
+    inflight_intersections = {} # key -> Future of the running computation
+    inflight_lock = threading.Lock()
+    intersection_stats = {"hits": 0, "misses": 0, "coalesced": 0}
+
+    def count_intersection(stat):
+        with inflight_lock:
+            intersection_stats[stat] += 1
+
+    metrics_registry.callback(
+        "wcwp_intersection_requests_total", "Intersection requests by how they were served", "counter", ("result",),
+        lambda: stats_samples(intersection_stats, inflight_lock)
+    )
+    metrics_registry.callback(
+        "wcwp_cache_hit_ratio", "Share of lookups served without going upstream", "gauge", ("cache",),
+        lambda: [
+            (("game",), cache_hit_ratio(game_cache_stats, ("memory_hits", "disk_hits", "igdb_miss_hits"), cache_stats_lock)),
+            (("owned_games",), cache_hit_ratio(owned_games_stats, ("memory_hits", "disk_hits"), cache_stats_lock)),
+            (("intersection",), cache_hit_ratio(intersection_stats, ("hits", "coalesced"), inflight_lock))
+        ]
+    )
+
+    def intersection_key(steamids, min_owners, include_free_games):
+        return (tuple(sorted(steamids)), min_owners, include_free_games)
+
+    # Returns (Future of the result of key, whether the caller is the leader). The leader computes the result
+    # and must pass it to finish_intersection, everyone else waits on the Future.
+    def claim_intersection(key):
+        with inflight_lock:
+            future = inflight_intersections.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                inflight_intersections[key] = future
+        return future, leader
+
+    # Hands the leader's (game info, partial) result or exception to the requests waiting on it,
+    # and keeps a complete result for later ones. Once one has been handed over, later calls are ignored.
+    def finish_intersection(key, future, result=None, exception=None):
+        if exception is None and not result[1]:
+            intersection_results.set(key, result[0], datetime.now(timezone.utc).timestamp() + intersection_max_age)
+        with inflight_lock:
+            if inflight_intersections.get(key) is future:
+                del inflight_intersections[key]
+            if future.done():
+                return
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+
+    # Returns game info, partial like intersect_owned_games. Partial results aren't kept,
+    # but requests coalesced onto one share its partial result.
+    def intersect_owned_games_coalesced(steamids, min_owners, include_free_games, deadline=None, base=None):
+        key = intersection_key(steamids, min_owners, include_free_games)
+
+        game_info = intersection_results.get(key)
+        if game_info is not None:
+            count_intersection("hits")
+            return game_info, False
+        
+        future, leader = claim_intersection(key)
+        if not leader:
+            count_intersection("coalesced")
+            return future.result() # Re-raises whatever the leader raised
+        
+        count_intersection("misses")
+        try:
+            result = intersect_owned_games(list(steamids), min_owners, deadline, base)
+        except BaseException as e:
+            finish_intersection(key, future, exception=e)
+            raise
+        finish_intersection(key, future, result)
+        return result
+
+    # Checks the signed in user and the request body of an intersection request
+    #
+    # The group is either "steamids", or a "token" from an earlier intersection with the steam ids to "add" and "remove".
+    #
+    # Returns (steamids, min_owners, include_free_games, base, user steam id), None on success,
+    # where base is the sorted steam ids of the token's group, or None without a token.
+    # min_owners defaults to the whole group, for games everyone owns
+    # or None, (error dict, status code) if the request should be rejected
+    def parse_intersection_request(request):
+        bad_request = {"message": "Received a bad request. Please refresh the page and try again.", "errcode": -1}
+
+        errcode, steam_info = fetch_steam_cookie(request)
+        if "steam_id" not in steam_info.keys():
+            return None, ({"message": "Not signed in to Steam. Please refresh the page and try again.", "errcode": -1}, 200)
         
+        body = request.get_json(force=True, silent=True)
+
+        if not isinstance(body, dict):
+            return None, (bad_request, 200)
+
+        if not body or ("steamids" not in body.keys() and "token" not in body.keys()):
+            return None, (bad_request, 200)
+        
+        base = None
+        try:
+            if "token" in body.keys():
+                loaded, token = intersection_token_serializer.loads_unsafe(body["token"])
+                if not loaded or not isinstance(token, dict) or token.get("user") != steam_info["steam_id"]:
+                    return None, (bad_request, 200)
+                
+                base = tuple(sorted(int(id) for id in token["steamids"]))
+                steamids = set(base).union(int(id) for id in body.get("add", [])).difference(int(id) for id in body.get("remove", []))
+            else:
+                steamids = set([int(id) for id in body["steamids"]])
+        except (ValueError, TypeError, KeyError):
+            return None, (bad_request, 200)
+        
+        if len(steamids) < 2:
+            return None, ({"message": "Must have at least 2 users to intersect games.", "errcode": -1}, 200)
+        
+        if len(steamids) > max_group_size:
+            return None, ({"message": "Games intersection is capped at %d users." % max_group_size, "errcode": -1}, 200)
+        
+        try:
+            min_owners = int(body.get("min_owners") or len(steamids))
+        except (ValueError, TypeError):
+            return None, (bad_request, 200)
+        
+        if min_owners < 1 or min_owners > len(steamids):
+            return None, ({"message": "Games can only be required to be owned by 1 to %d of the selected users." % len(steamids), "errcode": -1}, 200)
+        
+        return (steamids, min_owners, bool(body.get("include_free_games", False)), base, steam_info["steam_id"]), None
+
+    cursor_serializer = URLSafeSerializer(app.secret_key, salt="intersection-cursor") # Signs the page cursors of game_view.py
+
+    # Maps an exception raised during an intersection to (error dict, status code)
+    def intersection_error(e):
+        if isinstance(e, wcwp.steam.BadWebkeyException):
+            traceback.print_exc()
+            return {"message": "Site has bad Steam API key. Please contact us about this error at " + contact_email, "errcode": -1}, 500
+        elif isinstance(e, wcwp.steam.ServerErrorException):
+            traceback.print_exc()
+            return {"message": "Steam had an internal server error. Please try again later.", "errcode": -1}, 500
+        elif isinstance(e, wcwp.steam.BadResponseException):
+            traceback.print_exc()
+            return {"message": "Steam returned an unparseable response. Please try again later.", "errcode": -1}, 500
+        elif isinstance(e, wcwp.steam.DeadlineExceededException):
+            traceback.print_exc()
+            return {"message": "Steam took too long to respond. Please try again later.", "errcode": -1}, 500
+        elif isinstance(e, wcwp.steam.GamesListPrivateException):
+            if debug:
+                print(e)
+            else:
+                print("Intersection interrupted due to private games list")
+            return {"errcode": 1, "user": str(e.args[1])}, 500
+        elif isinstance(e, wcwp.steam.GamesListEmptyException):
+            if debug:
+                print(e)
+            else:
+                print("Intersection interrupted due to private games list")
+            return {"errcode": 2, "user": str(e.args[1])}, 500
+        else:
+            traceback.print_exc()
+            if debug:
+                return {"message": traceback.format_exc(), "errcode": -1}, 500
+            else:
+                return {"message": "An unknown error has occurred. Please try again later.", "errcode": -1}, 500
 
     # Errcodes
     # -1: An error occurred with a message. Additional fields: "message"
     # 0: No error
     # 1: User has private games list. Additional fields: "user"
     # 2: User has empty games list. Additional fields: "user"
+    #
+    # Optional request fields, applied after the intersection so every view of a group shares one result:
+    # "sort": "sections" (the same sections as app.js, then by name) or "name"
+    # "multiplayer_only": Only games with multiplayer
+    # "player_buckets": Only games whose supported players are in these of "enough", "unknown" and "too_few"
+    # "limit": Games per page, sorted by sections unless "sort" says otherwise. "next_cursor" is null on the last page.
+    # "cursor": The "next_cursor" of the previous page, sent with the same group, sort and filters
+    # "format": "objects" (default), or "columns" for {"steam_id": [...], "name": [...], ...}
     @app.route("/api/v1/intersect_owned_games", methods=["POST", "GET"] if enable_api_tests else ["POST"])
     def intersect_owned_games_v1():
         if request.method == "GET":
             params = [
                 {"name": "steamids", "type":"csl:string"},
-                {"name": "include_free_games", "type":"bool", "default": False}
+                {"name": "min_owners", "type":"int", "default": 0},
+                {"name": "include_free_games", "type":"bool", "default": False},
+                {"name": "sort", "type":"string", "default": ""},
+                {"name": "multiplayer_only", "type":"bool", "default": False},
+                {"name": "player_buckets", "type":"csl:string", "default": ""},
+                {"name": "limit", "type":"int", "default": 0},
+                {"name": "cursor", "type":"string", "default": ""},
+                {"name": "format", "type":"string", "default": ""}
             ]
             return render_template(
                 "api_test.html",
@@ -507,126 +1772,264 @@ def create_app():
                 **basic_info_dict()
             )
         
-        errcode, steam_info = fetch_steam_cookie(request)
-        if "steam_id" not in steam_info.keys():
-            return (
-                json.dumps({"message": "Not signed in to Steam. Please refresh the page and try again.", "errcode": -1}),
-                200
-            )
-        
-        body = request.get_json(force=True, silent=True)
+        parsed, error = parse_intersection_request(request)
+        if error:
+            return json.dumps(error[0]), error[1]
+        steamids, min_owners, include_free_games, base, steam_id = parsed
+        view = parse_game_view(request.get_json(force=True, silent=True), cursor_serializer)
+        if view is None:
+            return json.dumps({"message": "Received a bad request. Please refresh the page and try again.", "errcode": -1}), 200
 
-        if not isinstance(body, dict):
-            return (
-                json.dumps({"message": "Received a bad request. Please refresh the page and try again.", "errcode": -1}),
-                200
-            )
+        try:
+            game_info, partial = intersect_owned_games_coalesced(steamids, min_owners, include_free_games, request_deadline(), base)
+            games, game_count, next_cursor = apply_game_view(game_info, view, len(steamids), cursor_serializer)
 
-        if not body or "steamids" not in body.keys():
-            return (
-                json.dumps({"message": "Received a bad request. Please refresh the page and try again.", "errcode": -1}),
-                200
-            )
-        
+            return compress_response(jsonify({
+                "message": "Intersected successfully",
+                "games": game_columns(games) if view["format"] == "columns" else games,
+                "game_count": game_count,
+                "next_cursor": next_cursor,
+                "partial": partial,
+                "token": intersection_token(steam_id, steamids),
+                "errcode": 0
+            }))
+        except Exception as e:
+            error, status = intersection_error(e)
+            return json.dumps(error), status
+
+    # Streaming version of intersect_owned_games. Responds with newline-delimited JSON records:
+    #
+    # {"games": [...]}: A batch of games. Cached games come first, then one record per IGDB batch as it completes.
+    #     When min_owners is less than the number of users, every game has an "owners" count.
+    # {"errcode": 0, "message": ..., "game_count": ..., "cached_count": ..., "fetched_count": ..., "partial": ..., "token": ...}: Last record on success.
+    #     partial is true if IGDB ran out of time, and the games it didn't get to were sent with only their steam_id.
+    #     token can be sent instead of steamids in the next request, along with the steam ids to add and remove.
+    #     It's null when the group's games lists weren't all fetched, because the intersection ended early.
+    # {"errcode": ..., ...}: Same errors as v1. If it comes after the first record, the stream ends there.
+    #
+    # Takes v1's "multiplayer_only", "player_buckets" and "format" fields, which apply to each batch.
+    # Batches arrive as IGDB answers, so sorting and paging are v1 only. game_count counts the games that passed the filters.
+    @app.route("/api/v2/intersect_owned_games", methods=["POST"])
+    def intersect_owned_games_v2():
+        parsed, error = parse_intersection_request(request)
+        if error:
+            return Response(json.dumps(error[0]) + "\n", status=error[1], mimetype="application/x-ndjson")
+        steamids, min_owners, include_free_games, base, steam_id = parsed
+        view = parse_game_view(request.get_json(force=True, silent=True), cursor_serializer)
+        if view is None:
+            error = {"message": "Received a bad request. Please refresh the page and try again.", "errcode": -1}
+            return Response(json.dumps(error) + "\n", status=200, mimetype="application/x-ndjson")
+        view = dict(view, sort=None, limit=0, cursor=None)
+        deadline = request_deadline()
+        encoding = response_encoding()
+
+        # Identical requests share the work with v1 and each other. Only the leader streams batches as IGDB answers,
+        # requests coalesced onto it get the whole result in one batch once it's done.
+        key = intersection_key(steamids, min_owners, include_free_games)
+        claimed, leader = None, False
+        owners = {}
+        uncached_ids = set()
+        partial = False
         try:
-            steamids = set([int(id) for id in body["steamids"]])
-        except (ValueError, TypeError):
-            return (
-                json.dumps({"message": "Received a bad request. Please refresh the page and try again.", "errcode": -1}),
-                200
-            )
+            cached_info = intersection_results.get(key)
+            if cached_info is not None:
+                count_intersection("hits")
+            else:
+                claimed, leader = claim_intersection(key)
+                if not leader:
+                    count_intersection("coalesced")
+                    cached_info, partial = claimed.result()
+                else:
+                    count_intersection("misses")
+                    token = get_igdb_token()
+                    with stage_timer("intersection"):
+                        owners = count_game_owners(list(steamids), min_owners, deadline, base)
+                    cached_info, uncached_ids = get_cached_games(list(owners)) if owners else ([], set())
+                    cached_info = with_owner_counts(cached_info, owners, len(steamids))
+        except Exception as e:
+            if leader:
+                finish_intersection(key, claimed, exception=e)
+            error, status = intersection_error(e)
+            return Response(json.dumps(error) + "\n", status=status, mimetype="application/x-ndjson")
         
-        if len(steamids) < 2:
-            return (
-                json.dumps({"message": "Must have at least 2 users to intersect games.", "errcode": -1}),
-                200
-            )
+        sent_count = 0
         
-        if len(steamids) > 10:
-            return (
-                json.dumps({"message": "Games intersection is capped at 10 users.", "errcode": -1}),
-                200
-            )
+        def games_record(games):
+            nonlocal sent_count
+            games = apply_game_view(games, view, len(steamids), cursor_serializer)[0]
+            sent_count += len(games)
+            return json.dumps({"games": game_columns(games) if view["format"] == "columns" else games}) + "\n"
+        
+        def generate():
+            yield games_record(cached_info)
 
+            game_info = list(cached_info)
+            fetched_count = 0
+            partial_result = partial
+            if uncached_ids:
+                uncached = list(uncached_ids)
+                chunks = [uncached[i:i + IGDB_CHUNK_SIZE] for i in range(0, len(uncached), IGDB_CHUNK_SIZE)]
+                try:
+                    # One chunk per call, so this pool alone keeps IGDB at igdb-max-in-flight requests
+                    with ThreadPoolExecutor(max_workers=min(igdb_max_in_flight, len(chunks))) as pool:
+                        for future in as_completed([pool.submit(fetch_and_cache_game_info, token, chunk, deadline, 1) for chunk in chunks]):
+                            fetched_info, unfetched = future.result()
+                            fetched_count += len(fetched_info)
+                            fetched_info += [{"steam_id": steam_id} for steam_id in unfetched]
+                            fetched_info = with_owner_counts(fetched_info, owners, len(steamids))
+                            partial_result = partial_result or bool(unfetched)
+                            game_info += fetched_info
+                            yield games_record(fetched_info)
+                except Exception as e:
+                    finish_intersection(key, claimed, exception=e)
+                    yield json.dumps(intersection_error(e)[0]) + "\n"
+                    return
+            if leader:
+                finish_intersection(key, claimed, (game_info, partial_result))
+            
+            print("Streamed intersection of %d games (%d from cache, %d from IGDB)" % (len(game_info), len(cached_info), fetched_count))
+            yield json.dumps({
+                "message": "Intersected successfully",
+                "errcode": 0,
+                "game_count": sent_count,
+                "cached_count": len(cached_info),
+                "fetched_count": fetched_count,
+                "partial": partial_result,
+                "token": intersection_token(steam_id, steamids)
+            }) + "\n"
+        
+        records = generate()
+        if encoding:
+            records = compress_stream(records, encoding)
+        response = Response(stream_with_context(records), mimetype="application/x-ndjson")
+        response.headers["Cache-Control"] = "no-cache"
+        response.headers["X-Accel-Buffering"] = "no" # Stop nginx from buffering the stream
+        if leader:
+            # If the client goes away before the stream ends, coalesced requests stop waiting with an error
+            response.call_on_close(lambda: finish_intersection(key, claimed, exception=RuntimeError("The streamed intersection was abandoned")))
+        if compress_responses:
+            response.vary.add("Accept-Encoding")
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        return response
+
+    # Cache maintenance commands, run with `flask <command>` and FLASK_APP pointing at this package
+
+    # Reads appids from a file of whitespace/comma separated ids, a JSON list of ids,
+    # or a Steam GetAppList dump ({"applist": {"apps": [{"appid": ...}]}})
+    def read_appid_file(file_path):
+        with open(file_path, "r") as appid_file:
+            contents = appid_file.read()
+        
         try:
-            token = get_igdb_token()
-            game_ids = wcwp.steam.intersect_owned_game_ids(steam_key, list(steamids))
+            parsed = json.loads(contents)
+            if isinstance(parsed, dict):
+                parsed = [app["appid"] for app in parsed.get("applist", {}).get("apps", [])]
+            return [int(appid) for appid in parsed]
+        except json.JSONDecodeError:
+            return [int(appid) for appid in contents.replace(",", " ").split()]
 
-            fetched_game_count = 0
-            cached_game_count = 0
-            game_info = []
+    @app.cli.command("cache-warm")
+    @click.argument("appids", nargs=-1, type=int)
+    @click.option("--file", "appid_file", type=click.Path(exists=True, dir_okay=False), help="File of appids to warm")
+    @click.option("--batch-size", default=2000, show_default=True, help="Appids sent to IGDB per batch")
+    @click.option("--delay", default=0.0, show_default=True, help="Seconds to wait between batches")
+    def cache_warm(appids, appid_file, batch_size, delay):
+        """Fetch game info from IGDB into the cache.
 
-            if game_ids:
-                game_info, uncached_ids = get_cached_games(game_ids)
+        Appids that are already cached are skipped, so an interrupted warmup
+        picks up where it left off when re-run with the same appids.
+        """
+        if game_cache is None:
+            print("No igdb-cache-file or igdb-cache-backend is configured")
+            return
+        
+        appids = list(appids)
+        if appid_file:
+            appids += read_appid_file(appid_file)
+        appids = list(dict.fromkeys(appids)) # Remove duplicates, keep order
+        
+        token = get_igdb_token()
+        total = len(appids)
+        done = 0
+        fetched = 0
+        start = time.perf_counter()
 
-                cached_game_count = len(game_info)
+        for batch_start in range(0, total, batch_size):
+            batch = appids[batch_start:batch_start + batch_size]
+            _, uncached = get_cached_games(batch)
+            if uncached:
+                fetched += len(uncached) - len(fetch_and_cache_game_info(token, uncached)[1])
+                cache_write_queue.join() # Make sure the batch is on disk before moving on
+            done += len(batch)
 
-                if uncached_ids:
-                    fetched_info, not_found = wcwp.igdb.get_steam_game_info(igdb_key, token, list(uncached_ids))
+            elapsed = time.perf_counter() - start
+            print("[%d/%d] %d already cached, %d fetched from IGDB (%.1f appids/sec)" % (
+                done, total, done - fetched, fetched, done / elapsed if elapsed > 0 else 0.0
+            ))
 
-                    cache_info_update = fetched_info
-                    if not_found:
-                        for uncached_id in [id for id in not_found]:
-                            cache_info_update.append({"steam_id": uncached_id}) # Cache empty data to prevent further IGDB fetch attempts
-                    update_cached_games(cache_info_update) # TODO: Spin up separate process for caching?
+            if delay > 0.0 and uncached:
+                time.sleep(delay)
 
-                    game_info += fetched_info
-                    fetched_game_count = len(fetched_info)
-            
-            print("Intersection resulted in %d games (%d from cache, %d from IGDB)" % (len(game_info), cached_game_count, fetched_game_count))
+    @app.cli.command("cache-export")
+    @click.argument("export_path", type=click.Path(dir_okay=False))
+    def cache_export(export_path):
+        """Export the game cache to a gzipped file for cache-import."""
+        if cache_backend != "sqlite":
+            # The cache file's game table isn't where game info goes, so exporting it would hand out stale or no games
+            print("cache-export only exports the SQLite game cache, and igdb-cache-backend is %s" % cache_backend)
+            return
+        
+        if not cache_file:
+            print("No igdb-cache-file is configured")
+            return
+        
+        cache = get_cache()
+        rows = cache.execute("SELECT %s, expiry FROM game" % ", ".join(GAME_COLUMNS)).fetchall()
+        with gzip.open(export_path, "wt") as export_file:
+            json.dump({
+                "version": CACHE_VERSION,
+                "columns": list(GAME_COLUMNS) + ["expiry"],
+                "rows": [list(row) for row in rows]
+            }, export_file, separators=(",", ":"))
+        print("Exported %d games to %s" % (len(rows), export_path))
 
-            return jsonify({
-                "message": "Intersected successfully",
-                "games": game_info,
-                "errcode": 0
-            })
-        except wcwp.steam.BadWebkeyException:
-            traceback.print_exc()
-            return (
-                json.dumps({"message": "Site has bad Steam API key. Please contact us about this error at " + contact_email, "errcode": -1}),
-                500
-            )
-        except wcwp.steam.ServerErrorException:
-            traceback.print_exc()
-            return (
-                json.dumps({"message": "Steam had an internal server error. Please try again later.", "errcode": -1}),
-                500
-            )
-        except wcwp.steam.BadResponseException:
-            traceback.print_exc()
-            return (
-                json.dumps({"message": "Steam returned an unparseable response. Please try again later.", "errcode": -1}),
-                500
-            )
-        except wcwp.steam.GamesListPrivateException as e:
-            if debug:
-                print(e)
-            else:
-                print("Intersection interrupted due to private games list")
-            return (
-                json.dumps({"errcode": 1, "user": str(e.args[1])}),
-                500
-            )
-        except wcwp.steam.GamesListEmptyException as e:
-            if debug:
-                print(e)
-            else:
-                print("Intersection interrupted due to private games list")
-            return (
-                json.dumps({"errcode": 2, "user": str(e.args[1])}),
-                500
-            )
-        except Exception:
-            traceback.print_exc()
-            if debug:
-                return (
-                    json.dumps({"message": traceback.format_exc(), "errcode": -1}),
-                    500
-                )
-            else:
-                return (
-                    json.dumps({"message": "An unknown error has occurred. Please try again later.", "errcode": -1}),
-                    500
-                )
+    @app.cli.command("cache-import")
+    @click.argument("import_path", type=click.Path(exists=True, dir_okay=False))
+    def cache_import(import_path):
+        """Import a game cache file written by cache-export."""
+        with gzip.open(import_path, "rt") as import_file:
+            exported = json.load(import_file)
+        
+        if exported.get("columns") != list(GAME_COLUMNS) + ["expiry"]:
+            print("%s was exported with different columns, refusing to import" % import_path)
+            return
+        
+        if game_cache is None:
+            print("No igdb-cache-file or igdb-cache-backend is configured")
+            return
+        
+        now = datetime.now(timezone.utc).timestamp()
+        entries = {
+            row[0]: (row[-1], dict(zip(GAME_COLUMNS, row)))
+            for row in exported.get("rows", []) if row[-1] > now
+        }
+        game_cache.set_many(entries, {steam_id: expiry + cache_stale_grace for steam_id, (expiry, _) in entries.items()})
+        cache_write_queue.join() # The SQLite backend writes through the cache writer
+        print("Imported %d unexpired games from %s" % (len(entries), import_path))
+
+    @app.cli.command("cache-sweep")
+    def cache_sweep():
+        """Delete expired and over capacity rows from the cache now."""
+        if cache_backend == "redis":
+            print("Redis deletes game info and IGDB misses itself once they expire, only the cache file is swept")
+        
+        if not cache_file:
+            print("No igdb-cache-file is configured")
+            return
+        
+        deleted = sweep_cache()
+        for table, table_deleted in deleted.items():
+            print("%s: deleted %d rows, %d left" % (table, table_deleted, cache_file_stats["rows"][table]))
 
     return app
\ No newline at end of file
@@ -0,0 +1,87 @@
+# This file is a part of WhatCanWePlay
+# Copyright (C) 2020 TGRCDev
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Calls a blocking Rust binding from an increasing number of Python threads
+# and reports the throughput at each thread count. If the binding releases
+# the GIL, calls/sec should grow roughly linearly with the thread count until
+# the upstream's latency stops being the bottleneck.
+#
+# Meant to be run against benchmarks/mock_upstream.py, so results don't depend on Steam.
+# The Steam rate limiter and concurrency limit are raised for the run, otherwise
+# they would be what gets measured.
+#
+# Usage: python benchmarks/gil_release.py [--mock-url http://127.0.0.1:8099] [--calls 64]
+
+import argparse, sys, os, time, threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib", "bin"))
+import whatcanweplay as wcwp
+
+THREAD_COUNTS = [1, 2, 4, 8, 16]
+FIRST_STEAM_ID = 76561197960265729
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="GIL release benchmark for the Rust bindings")
+    parser.add_argument("--mock-url", default="http://127.0.0.1:8099", help="Base URL of mock_upstream.py")
+    parser.add_argument("--calls", type=int, default=64, help="Calls per thread count")
+    parser.add_argument("--steam-key", default="benchmark", help="Steam key sent to the mock")
+    parser.add_argument("--steam-id", type=int, default=FIRST_STEAM_ID)
+    return parser.parse_args(argv)
+
+def run(thread_count, calls, steam_key, steam_id):
+    remaining = [calls]
+    lock = threading.Lock()
+    errors = [0]
+
+    def worker():
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            try:
+                wcwp.steam.get_steam_users_info(steam_key, [steam_id], None)
+            except Exception:
+                with lock:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(thread_count)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, errors[0]
+
+def main():
+    options = parse_args()
+
+    wcwp.set_api_urls(options.mock_url.rstrip("/") + "/", None, None)
+    # name, requests/second, burst, state file, failure threshold, open seconds, max concurrency
+    wcwp.configure_upstream("steam", 1000000.0, 1000000.0, None, 1000000, 0.0, max(THREAD_COUNTS))
+
+    baseline = None
+    print("threads   calls/sec   speedup   errors")
+    for thread_count in THREAD_COUNTS:
+        elapsed, errors = run(thread_count, options.calls, options.steam_key, options.steam_id)
+        throughput = options.calls / elapsed
+        if baseline is None:
+            baseline = throughput
+        print("%7d   %9.2f   %6.2fx   %6d" % (thread_count, throughput, throughput / baseline, errors))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
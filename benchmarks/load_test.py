@@ -0,0 +1,210 @@
+# This file is a part of WhatCanWePlay
+# Copyright (C) 2020 TGRCDev
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Load generator for a running WhatCanWePlay site, meant to be run against
+# benchmarks/mock_upstream.py so results don't depend on Steam or IGDB.
+#
+# Drives /api/v1/intersect_owned_games and /api/v1/get_friend_list from a
+# number of threads, then reports throughput, p50/p95/p99 latency per endpoint,
+# and cache hit rates worked out from the mock's request counts. Results are
+# saved as JSON so runs can be compared with --compare.
+#
+# Usage: python benchmarks/load_test.py --config config.json [--url http://127.0.0.1:5000] ...
+
+import argparse, json, os, random, threading, time
+from datetime import datetime, timezone
+import requests
+from itsdangerous import URLSafeSerializer
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+FIRST_STEAM_ID = 76561197960265729
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="WhatCanWePlay load generator")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="Base URL of the site")
+    parser.add_argument("--mock-url", default="http://127.0.0.1:8099", help="Base URL of mock_upstream.py, for cache hit rates")
+    parser.add_argument("--config", default="config.json", help="Site config, for the cookie secret key")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to run for")
+    parser.add_argument("--users", type=int, default=40, help="Size of the Steam ID pool groups are drawn from")
+    parser.add_argument("--first-steam-id", type=int, default=FIRST_STEAM_ID, help="First Steam ID in the pool")
+    parser.add_argument("--group-min", type=int, default=2)
+    parser.add_argument("--group-max", type=int, default=6)
+    parser.add_argument("--friend-list-ratio", type=float, default=0.2, help="Fraction of requests that fetch the friend list")
+    parser.add_argument("--streaming", action="store_true", help="Use /api/v2/intersect_owned_games")
+    parser.add_argument("--label", default="", help="Name for the saved results")
+    parser.add_argument("--compare", default=None, help="Earlier results file to compare against")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args(argv)
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+def signed_cookie(secret_key, steam_id):
+    info = {
+        "steam_id": steam_id,
+        "screen_name": "load-test",
+        "expires": datetime.now(timezone.utc).timestamp() + 86400
+    }
+    return URLSafeSerializer(secret_key).dumps(json.dumps(info))
+
+def fetch_mock_stats(mock_url):
+    try:
+        return requests.get(mock_url.rstrip("/") + "/_stats", timeout=5).json()
+    except Exception:
+        return None
+
+class LoadTest:
+    def __init__(self, options, secret_key):
+        self.options = options
+        self.secret_key = secret_key
+        self.users = [options.first_steam_id + n for n in range(options.users)]
+        self.results = {} # endpoint -> {"latencies": [...], "statuses": {...}}
+        self.owned_lookups = 0
+        self.lock = threading.Lock()
+        self.intersect_path = "/api/v2/intersect_owned_games" if options.streaming else "/api/v1/intersect_owned_games"
+    
+    def record(self, endpoint, latency, status, owned_lookups=0):
+        with self.lock:
+            result = self.results.setdefault(endpoint, {"latencies": [], "statuses": {}})
+            result["latencies"].append(latency)
+            result["statuses"][str(status)] = result["statuses"].get(str(status), 0) + 1
+            self.owned_lookups += owned_lookups
+    
+    def worker(self, worker_id, deadline):
+        rng = random.Random(self.options.seed * 1000 + worker_id)
+        session = requests.Session()
+        session.cookies.set("steam_info", signed_cookie(self.secret_key, rng.choice(self.users)))
+
+        while time.perf_counter() < deadline:
+            if rng.random() < self.options.friend_list_ratio:
+                endpoint = "/api/v1/get_friend_list"
+                body = None
+                owned_lookups = 0
+            else:
+                endpoint = self.intersect_path
+                group = rng.sample(self.users, rng.randint(self.options.group_min, min(self.options.group_max, len(self.users))))
+                body = json.dumps({"steamids": [str(id) for id in group]})
+                owned_lookups = len(group)
+            
+            start = time.perf_counter()
+            try:
+                response = session.post(self.options.url.rstrip("/") + endpoint, data=body, timeout=60)
+                response.content # Read the whole body, streamed or not
+                status = response.status_code
+            except requests.RequestException:
+                status = "error"
+            self.record(endpoint, time.perf_counter() - start, status, owned_lookups)
+    
+    def run(self):
+        deadline = time.perf_counter() + self.options.duration
+        threads = [threading.Thread(target=self.worker, args=(n, deadline)) for n in range(self.options.threads)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start
+
+def summarize(load_test, elapsed, stats_before, stats_after):
+    summary = {
+        "label": load_test.options.label,
+        "time": datetime.now(timezone.utc).isoformat(),
+        "options": vars(load_test.options),
+        "elapsed": elapsed,
+        "endpoints": {}
+    }
+    total = 0
+    for endpoint, result in load_test.results.items():
+        latencies = result["latencies"]
+        total += len(latencies)
+        summary["endpoints"][endpoint] = {
+            "requests": len(latencies),
+            "throughput": len(latencies) / elapsed,
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p95_ms": percentile(latencies, 0.95) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "statuses": result["statuses"]
+        }
+    summary["throughput"] = total / elapsed
+
+    if stats_before is not None and stats_after is not None:
+        upstream = {key: stats_after.get(key, 0) - stats_before.get(key, 0) for key in stats_after}
+        summary["upstream"] = upstream
+        if load_test.owned_lookups:
+            fetched = upstream.get("steam:GetOwnedGames", 0)
+            summary["owned_games_hit_rate"] = max(0.0, 1.0 - fetched / load_test.owned_lookups)
+        intersections = summary["endpoints"].get(load_test.intersect_path, {}).get("requests", 0)
+        if intersections:
+            summary["igdb_appids_per_intersection"] = upstream.get("igdb:appids", 0) / intersections
+    
+    return summary
+
+def print_summary(summary, previous=None):
+    def delta(key, endpoint=None):
+        if previous is None:
+            return ""
+        old = previous["endpoints"].get(endpoint, {}).get(key) if endpoint else previous.get(key)
+        new = summary["endpoints"][endpoint][key] if endpoint else summary.get(key)
+        if not old or new is None:
+            return ""
+        return " (%+.1f%%)" % ((new - old) / old * 100)
+
+    print("Ran for %.1fs, %.2f requests/sec%s" % (summary["elapsed"], summary["throughput"], delta("throughput")))
+    for endpoint, result in sorted(summary["endpoints"].items()):
+        print("  %s: %d requests, %.2f/sec%s" % (endpoint, result["requests"], result["throughput"], delta("throughput", endpoint)))
+        print("    p50 %.1fms%s, p95 %.1fms%s, p99 %.1fms%s" % (
+            result["p50_ms"], delta("p50_ms", endpoint),
+            result["p95_ms"], delta("p95_ms", endpoint),
+            result["p99_ms"], delta("p99_ms", endpoint)
+        ))
+        print("    statuses: %s" % result["statuses"])
+    if "owned_games_hit_rate" in summary:
+        print("Owned games cache hit rate: %.1f%%%s" % (summary["owned_games_hit_rate"] * 100, delta("owned_games_hit_rate")))
+    if "igdb_appids_per_intersection" in summary:
+        print("IGDB appids fetched per intersection: %.1f%s" % (summary["igdb_appids_per_intersection"], delta("igdb_appids_per_intersection")))
+    if "upstream" in summary:
+        print("Upstream requests: %s" % summary["upstream"])
+
+def main():
+    options = parse_args()
+    with open(options.config) as config_file:
+        secret_key = json.load(config_file)["secret-key"]
+    
+    previous = None
+    if options.compare:
+        with open(options.compare) as previous_file:
+            previous = json.load(previous_file)
+
+    load_test = LoadTest(options, secret_key)
+    stats_before = fetch_mock_stats(options.mock_url)
+    elapsed = load_test.run()
+    stats_after = fetch_mock_stats(options.mock_url)
+
+    summary = summarize(load_test, elapsed, stats_before, stats_after)
+    print_summary(summary, previous)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    name = (options.label + "-" if options.label else "") + datetime.now().strftime("%Y%m%d-%H%M%S") + ".json"
+    with open(os.path.join(RESULTS_DIR, name), "w") as results_file:
+        json.dump(summary, results_file, indent=2)
+    print("Saved results to %s" % os.path.join(RESULTS_DIR, name))
+
+if __name__ == "__main__":
+    main()
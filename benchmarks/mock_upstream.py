@@ -0,0 +1,205 @@
+# This file is a part of WhatCanWePlay
+# Copyright (C) 2020 TGRCDev
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Local stand-in for the Steam Web API, IGDB's external_games endpoint and
+# Twitch's token endpoint, for benchmarking without touching the real APIs.
+#
+# Point the site at it with these config.json keys:
+#     "steam-api-url": "http://127.0.0.1:<port>/"
+#     "igdb-api-url": "http://127.0.0.1:<port>/v4/"
+#     "twitch-token-url": "http://127.0.0.1:<port>/oauth2/token"
+#
+# GET /_stats returns how many requests each endpoint has served, and
+# POST /_reset clears the counts.
+#
+# Usage: python benchmarks/mock_upstream.py [--port 8099] [--latency-ms 80] ...
+
+import argparse, itertools, json, random, re, threading, time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Local Steam/IGDB/Twitch stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency-ms", type=float, default=80.0, help="Base latency added to every response")
+    parser.add_argument("--jitter-ms", type=float, default=40.0, help="Random extra latency, up to this much")
+    parser.add_argument("--igdb-latency-ms", type=float, default=None, help="Base latency for IGDB, defaults to --latency-ms")
+    parser.add_argument("--library-min", type=int, default=50, help="Smallest generated games library")
+    parser.add_argument("--library-max", type=int, default=1500, help="Largest generated games library")
+    parser.add_argument("--catalog-size", type=int, default=5000, help="Number of distinct appids libraries are drawn from")
+    parser.add_argument("--friends", type=int, default=60, help="Friends returned by GetFriendList")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with a 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests answered with a 429")
+    parser.add_argument("--private-rate", type=float, default=0.0, help="Fraction of steam ids with a private games list")
+    parser.add_argument("--igdb-hit-rate", type=float, default=0.9, help="Fraction of appids IGDB knows about")
+    return parser.parse_args(argv)
+
+class MockUpstream:
+    def __init__(self, options):
+        self.options = options
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+        # Popular appids show up in far more libraries, like they do on Steam
+        self.catalog = list(range(10, 10 + options.catalog_size * 10, 10))
+        self.cum_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(len(self.catalog))))
+    
+    def count(self, name, amount=1):
+        with self.stats_lock:
+            self.stats[name] = self.stats.get(name, 0) + amount
+    
+    # Libraries are generated from the steam id, so the same user always owns the same games
+    def library(self, steamid):
+        rng = random.Random(steamid)
+        size = rng.randint(self.options.library_min, min(self.options.library_max, len(self.catalog)))
+        return set(rng.choices(self.catalog, cum_weights=self.cum_weights, k=size))
+    
+    def is_private(self, steamid):
+        return random.Random(steamid * 31).random() < self.options.private_rate
+    
+    def igdb_knows(self, appid):
+        return random.Random(appid * 17).random() < self.options.igdb_hit_rate
+
+    def player(self, steamid):
+        rng = random.Random(steamid * 7)
+        return {
+            "steamid": str(steamid),
+            "personaname": "user%d" % (steamid % 100000),
+            "avatar": "",
+            "avatarmedium": "",
+            "communityvisibilitystate": 1 if self.is_private(steamid) else 3,
+            "personastate": rng.randint(0, 1)
+        }
+    
+    def game(self, appid):
+        rng = random.Random(appid)
+        modes = [1] if rng.random() < 0.4 else [1, 2]
+        return {
+            "uid": str(appid),
+            "game": {
+                "id": appid + 100000,
+                "name": "Game %d" % appid,
+                "game_modes": modes,
+                "multiplayer_modes": [{"onlinemax": rng.randint(2, 16)}] if 2 in modes else [],
+                "cover": {"image_id": "co%x" % appid}
+            }
+        }
+
+def make_handler(upstream):
+    options = upstream.options
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" # Keep-alive, like the real APIs
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        
+        # Sleeps for the configured latency. Returns False if the request was failed on purpose.
+        def simulate(self, name, latency_ms=None):
+            upstream.count(name)
+            latency_ms = options.latency_ms if latency_ms is None else latency_ms
+            time.sleep((latency_ms + random.random() * options.jitter_ms) / 1000.0)
+
+            roll = random.random()
+            if roll < options.error_rate:
+                upstream.count(name + ":500")
+                self.send_json(500, {})
+                return False
+            if roll < options.error_rate + options.throttle_rate:
+                upstream.count(name + ":429")
+                self.send_json(429, {})
+                return False
+            return True
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+            if url.path == "/_stats":
+                with upstream.stats_lock:
+                    self.send_json(200, dict(upstream.stats))
+                return
+            
+            if url.path.startswith("/IPlayerService/GetOwnedGames/"):
+                if not self.simulate("steam:GetOwnedGames"):
+                    return
+                steamid = int(query.get("steamid", 0))
+                if upstream.is_private(steamid):
+                    self.send_json(200, {"response": {}})
+                    return
+                games = upstream.library(steamid)
+                self.send_json(200, {"response": {"game_count": len(games), "games": [{"appid": appid, "playtime_forever": 0} for appid in games]}})
+            elif url.path.startswith("/ISteamUser/GetFriendList/"):
+                if not self.simulate("steam:GetFriendList"):
+                    return
+                steamid = int(query.get("steamid", 0))
+                rng = random.Random(steamid)
+                friends = [{"steamid": str(76561197960265728 + rng.randint(1, 10 ** 6)), "relationship": "friend", "friend_since": 0} for _ in range(options.friends)]
+                self.send_json(200, {"friendslist": {"friends": friends}})
+            elif url.path.startswith("/ISteamUser/GetPlayerSummaries/"):
+                if not self.simulate("steam:GetPlayerSummaries"):
+                    return
+                steamids = [int(id) for id in query.get("steamids", "").split(",") if id]
+                self.send_json(200, {"response": {"players": [upstream.player(id) for id in steamids]}})
+            else:
+                self.send_json(404, {})
+        
+        def do_POST(self):
+            url = urlparse(self.path)
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0) or 0)).decode("utf-8")
+
+            if url.path == "/_reset":
+                with upstream.stats_lock:
+                    upstream.stats.clear()
+                self.send_json(200, {})
+            elif url.path == "/oauth2/token":
+                if not self.simulate("twitch:token"):
+                    return
+                self.send_json(200, {"access_token": "mock-token", "expires_in": 5000000, "token_type": "bearer"})
+            elif url.path == "/v4/external_games":
+                if not self.simulate("igdb:external_games", options.igdb_latency_ms):
+                    return
+                match = re.search(r"uid\s*=\s*\(([^)]*)\)", body)
+                appids = [int(id) for id in match.group(1).split(",")] if match else []
+                upstream.count("igdb:appids", len(appids))
+                self.send_json(200, [upstream.game(appid) for appid in appids if upstream.igdb_knows(appid)])
+            else:
+                self.send_json(404, {})
+    
+    return Handler
+
+def serve(options):
+    upstream = MockUpstream(options)
+    server = ThreadingHTTPServer((options.host, options.port), make_handler(upstream))
+    server.daemon_threads = True
+    return server
+
+if __name__ == "__main__":
+    options = parse_args()
+    server = serve(options)
+    print("Mock upstream listening on http://%s:%d/" % (options.host, options.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,224 @@
+# This file is a part of WhatCanWePlay
+# Copyright (C) 2020 TGRCDev
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Backends for the IGDB game info cache and the IGDB miss cache. Every backend has the same two
+# methods as LRUCache, which is what sits in front of them as the in-process tier:
+#
+#     get_many(steam_ids, now) -> {steam_id: (expiry, game info)}
+#         Every entry that hasn't been dropped yet, including ones past their expiry
+#     set_many({steam_id: (expiry, game info)}, keep_until)
+#         keep_until is when entries can be dropped, one timestamp for every entry or a dict of steam_id -> timestamp
+#
+# Expiry is when the info should be refreshed from IGDB, keep_until is later by the stale grace period.
+# Miss caches hold steam ids IGDB doesn't know, so their game info is always None.
+
+from urllib.parse import urlparse, unquote
+from .memory_cache import now_timestamp
+import json
+import socket
+import threading
+import time
+
+GAME_COLUMNS = ("steam_id", "igdb_id", "name", "supported_players", "cover_id", "has_multiplayer")
+GAME_INSERT_QUERY = "INSERT OR REPLACE INTO game VALUES (?,?,?,?,?,?,?);"
+IGDB_MISS_INSERT_QUERY = "INSERT OR REPLACE INTO igdb_miss VALUES (?,?);"
+
+# The game table of the SQLite cache file, local to one node.
+# connect returns the calling thread's connection, and write(query, rows) queues rows for the cache writer.
+class SQLiteGameCache:
+    def __init__(self, connect, write, stale_grace):
+        self.connect = connect
+        self.write = write
+        self.stale_grace = stale_grace # Rows store their expiry, so keep_until is worked out from it
+
+    def get_many(self, steam_ids, now=None):
+        now = now or now_timestamp()
+        steam_ids = list(steam_ids)
+        if not steam_ids:
+            return {}
+
+        query_str = "SELECT * FROM game WHERE steam_id IN (%s)" % ("?" + (",?" * (len(steam_ids) - 1))) # Construct a query with arbitrary parameter length
+        found = {}
+        for row in self.connect().execute(query_str, steam_ids).fetchall():
+            game = dict(row)
+            expiry = game.pop("expiry")
+            if now < expiry + self.stale_grace:
+                found[game["steam_id"]] = (expiry, game)
+        return found
+
+    # Expired rows are left for the cache sweeper, so keep_until isn't stored
+    def set_many(self, items, keep_until):
+        self.write(GAME_INSERT_QUERY, [
+            [game.get(column) for column in GAME_COLUMNS] + [expiry]
+            for expiry, game in items.values()
+        ])
+
+# The igdb_miss table of the SQLite cache file, with the same connect and write as SQLiteGameCache
+class SQLiteMissCache:
+    def __init__(self, connect, write):
+        self.connect = connect
+        self.write = write
+
+    def get_many(self, steam_ids, now=None):
+        now = now or now_timestamp()
+        steam_ids = list(steam_ids)
+        if not steam_ids:
+            return {}
+
+        query_str = "SELECT steam_id, expiry FROM igdb_miss WHERE steam_id IN (%s)" % ("?" + (",?" * (len(steam_ids) - 1)))
+        return {
+            steam_id: (expiry, None)
+            for steam_id, expiry in self.connect().execute(query_str, steam_ids).fetchall()
+            if now < expiry
+        }
+
+    def set_many(self, items, keep_until):
+        self.write(IGDB_MISS_INSERT_QUERY, [[steam_id, expiry] for steam_id, (expiry, _) in items.items()])
+
+class RedisError(Exception):
+    pass
+
+# A connection to a Redis server, or anything else that speaks its protocol, shared by every worker and node.
+#
+# url is redis://[:password@]host[:port][/db]. Each thread keeps its own connection.
+# After a connection fails, calls fail fast for RETRY_DELAY seconds instead of waiting on timeouts.
+class RedisClient:
+    RETRY_DELAY = 5.0
+
+    def __init__(self, url, timeout=1.0):
+        parsed = urlparse(url)
+        if parsed.scheme != "redis":
+            raise ValueError("Redis cache url must start with redis://, got %s" % url)
+        self.address = (parsed.hostname or "127.0.0.1", parsed.port or 6379)
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.strip("/") or 0)
+        self.timeout = timeout
+        self.connections = threading.local()
+        self.retry_after = 0.0
+
+    def connection(self):
+        conn = getattr(self.connections, "conn", None)
+        if conn is not None:
+            return conn
+
+        if time.monotonic() < self.retry_after:
+            raise RedisError("Redis at %s:%d is down, not retrying yet" % self.address)
+        try:
+            sock = socket.create_connection(self.address, timeout=self.timeout)
+        except OSError:
+            self.retry_after = time.monotonic() + self.RETRY_DELAY
+            raise
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = (sock, sock.makefile("rb"))
+        self.connections.conn = conn
+
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", str(self.db)))
+        if setup:
+            try:
+                self.pipeline(setup)
+            except RedisError:
+                self.close() # Don't leave a connection around that failed AUTH or SELECT
+                raise
+        return conn
+
+    def close(self):
+        conn = getattr(self.connections, "conn", None)
+        self.connections.conn = None
+        if conn is not None:
+            conn[1].close()
+            conn[0].close()
+
+    # Sends every command in one write and returns their replies in order
+    def pipeline(self, commands):
+        sock, reader = self.connection()
+        try:
+            sock.sendall(b"".join(encode_command(command) for command in commands))
+            replies = [read_reply(reader) for _ in commands]
+        except (OSError, RedisError):
+            # The connection is in an unknown state mid-reply, so start over with a new one
+            self.close()
+            raise
+
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+# Entries kept in Redis as JSON [expiry, game info] under key_prefix + steam_id, which Redis drops at keep_until.
+# Caches with different prefixes can share one RedisClient.
+class RedisCache:
+    def __init__(self, client, key_prefix):
+        self.client = client
+        self.key_prefix = key_prefix
+
+    def get_many(self, steam_ids, now=None):
+        steam_ids = list(steam_ids)
+        if not steam_ids:
+            return {}
+
+        values = self.client.pipeline([("MGET", *(self.key_prefix + str(steam_id) for steam_id in steam_ids))])[0]
+        found = {}
+        for steam_id, value in zip(steam_ids, values):
+            if value is not None:
+                expiry, game = json.loads(value)
+                found[steam_id] = (expiry, game)
+        return found
+
+    # MSET can't set expiries, so this is one pipelined SET per entry
+    def set_many(self, items, keep_until):
+        now = now_timestamp()
+        commands = []
+        for steam_id, entry in items.items():
+            ttl_ms = int(((keep_until[steam_id] if isinstance(keep_until, dict) else keep_until) - now) * 1000)
+            if ttl_ms > 0:
+                commands.append(("SET", self.key_prefix + str(steam_id), json.dumps(entry, separators=(",", ":")), "PX", ttl_ms))
+        if commands:
+            self.client.pipeline(commands)
+
+def encode_command(command):
+    parts = [part if isinstance(part, bytes) else str(part).encode() for part in command]
+    return b"*%d\r\n" % len(parts) + b"".join(b"$%d\r\n%s\r\n" % (len(part), part) for part in parts)
+
+# Reads one RESP reply. Error replies are returned rather than raised, so the rest of a pipeline still gets read.
+def read_reply(reader):
+    line = reader.readline()
+    if not line.endswith(b"\r\n"):
+        raise RedisError("Redis connection closed")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest.decode()
+    if kind == b"-":
+        return RedisError(rest.decode())
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        length = int(rest)
+        if length < 0:
+            return None
+        data = reader.read(length + 2)
+        if len(data) != length + 2:
+            raise RedisError("Redis connection closed")
+        return data[:-2]
+    if kind == b"*":
+        length = int(rest)
+        if length < 0:
+            return None
+        return [read_reply(reader) for _ in range(length)]
+    raise RedisError("Unexpected reply from Redis: %r" % line)
@@ -0,0 +1,105 @@
+# This file is a part of WhatCanWePlay
+# Copyright (C) 2020 TGRCDev
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Schema of the SQLite cache file, and the migrations that bring older cache files up to date
+
+import os
+import sqlite3
+
+cache_init_query = """
+CREATE TABLE IF NOT EXISTS game (
+    steam_id INTEGER PRIMARY KEY,
+    igdb_id INTEGER,
+    name STRING,
+    supported_players INTEGER DEFAULT(0),
+    cover_id STRING,
+    has_multiplayer BOOLEAN,
+    expiry REAL DEFAULT(0.0)
+);
+"""
+
+owned_games_init_query = """
+CREATE TABLE IF NOT EXISTS owned_games (
+    steam_id INTEGER PRIMARY KEY,
+    appids BLOB,
+    expiry REAL DEFAULT(0.0)
+);
+"""
+
+# Steam appids IGDB doesn't know, kept for igdb-cache-miss-max-age instead of as empty game rows
+igdb_miss_init_query = """
+CREATE TABLE IF NOT EXISTS igdb_miss (
+    steam_id INTEGER PRIMARY KEY,
+    expiry REAL DEFAULT(0.0)
+);
+"""
+
+# Schema migrations, by the cache version they bring a cache file up to. Caches are upgraded in place
+# by running every migration past the file's PRAGMA user_version in order, so the cached rows survive.
+# Statements must be safe to run twice, in case a migration is interrupted before user_version is set.
+CACHE_MIGRATIONS = {
+    1: [cache_init_query],
+    2: [owned_games_init_query],
+    3: [
+        "CREATE INDEX IF NOT EXISTS game_expiry ON game (expiry);",
+        "CREATE INDEX IF NOT EXISTS owned_games_expiry ON owned_games (expiry);",
+        # Lets the cache sweeper give freed pages back to the filesystem.
+        # Switching an existing file over takes a VACUUM, which rewrites it once.
+        "PRAGMA auto_vacuum = INCREMENTAL;",
+        "VACUUM;",
+    ],
+    4: [
+        igdb_miss_init_query,
+        "CREATE INDEX IF NOT EXISTS igdb_miss_expiry ON igdb_miss (expiry);",
+        # Misses used to be game rows with only a steam_id. They keep the expiry they were cached with.
+        "INSERT OR IGNORE INTO igdb_miss SELECT steam_id, expiry FROM game WHERE igdb_id IS NULL;",
+        "DELETE FROM game WHERE igdb_id IS NULL;",
+    ],
+}
+
+CACHE_VERSION = 4
+
+def cache_version(cache):
+    return cache.execute("PRAGMA user_version;").fetchone()[0]
+
+def migrate_cache(cache):
+    cache.isolation_level = None # Autocommit, VACUUM can't run inside a transaction
+    for version in range(cache_version(cache) + 1, CACHE_VERSION + 1):
+        print("Migrating cache to version %d" % version)
+        for statement in CACHE_MIGRATIONS[version]:
+            cache.execute(statement)
+        #cache.execute("PRAGMA user_version = ?;", [version]) # Doesn't work?
+        cache.execute("PRAGMA user_version = %d" % version)
+
+# Checks the cache version and migrates the cache file. Runs once in create_app,
+# so the request handlers never have to check the version themselves.
+def prepare_cache(cache_file):
+    cache = sqlite3.connect(cache_file)
+    if cache_version(cache) > CACHE_VERSION:
+        # Written by a newer version of the site, there's no migrating back down
+        print("Cache file is from a newer version! Rebuilding... ")
+        cache.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(cache_file + suffix):
+                os.remove(cache_file + suffix)
+        cache = sqlite3.connect(cache_file)
+
+    if cache_version(cache) == 0:
+        # New file, so auto_vacuum can be set before there are any tables
+        cache.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+    cache.execute("PRAGMA journal_mode = WAL;") # Readers no longer block on writers. Stored in the file.
+    migrate_cache(cache)
+    cache.close()
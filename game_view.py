@@ -0,0 +1,104 @@
+# This file is a part of WhatCanWePlay
+# Copyright (C) 2020 TGRCDev
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# Sorting, filtering, paging and formatting of intersection results. A view is read from the optional
+# fields of an intersection request, and applied after the intersection, so every view of a group shares one result.
+#
+# Page cursors are signed with the serializer passed in, so clients can't make up their own.
+
+from .cache_backends import GAME_COLUMNS
+
+# Games are sorted into the same three sections as gameSection in static/scripts/app.js,
+# by supported players against the group size. Games with 0 or no supported players are "unknown".
+PLAYER_BUCKETS = ("enough", "unknown", "too_few")
+GAME_SORTS = ("sections", "name")
+GAME_FORMATS = ("objects", "columns")
+
+def player_bucket(game, group_size):
+    players = int(game.get("supported_players") or 0)
+    if players <= 0:
+        return 1
+    return 2 if players < group_size else 0
+
+# Every game has a different sort key, so a page cursor can be the key of the last game on the page.
+# Games without info go last in their section.
+def game_sort_key(game, sort, group_size):
+    name = game.get("name")
+    key = (name is None, (name or "").casefold(), game["steam_id"])
+    if sort == "sections":
+        return (player_bucket(game, group_size),) + key
+    return key
+
+# Reads the optional sort, filter, paging and format fields of an intersection request body.
+# Returns a dict of them, or None if any are bad.
+def parse_game_view(body, cursor_serializer):
+    try:
+        player_buckets = body.get("player_buckets") or PLAYER_BUCKETS
+        if isinstance(player_buckets, str):
+            player_buckets = player_buckets.split(",")
+        view = {
+            "sort": body.get("sort") or None,
+            "multiplayer_only": bool(body.get("multiplayer_only", False)),
+            "player_buckets": set(player_buckets),
+            "limit": int(body.get("limit") or 0),
+            "cursor": None,
+            "format": body.get("format") or "objects"
+        }
+    except (ValueError, TypeError):
+        return None
+    
+    if view["limit"] and not view["sort"]:
+        view["sort"] = "sections" # Pages need a fixed order
+    if view["sort"] not in GAME_SORTS + (None,) or view["format"] not in GAME_FORMATS or view["limit"] < 0:
+        return None
+    if not view["player_buckets"].issubset(PLAYER_BUCKETS):
+        return None
+    
+    if body.get("cursor"):
+        if not isinstance(body["cursor"], str):
+            return None
+        loaded, cursor = cursor_serializer.loads_unsafe(body["cursor"])
+        if not loaded or not isinstance(cursor, dict) or cursor.get("sort") != view["sort"] or not isinstance(cursor.get("after"), list):
+            return None
+        view["cursor"] = tuple(cursor["after"])
+    
+    return view
+
+# Filters, sorts and pages game info for a view from parse_game_view.
+# Returns the games to send, how many games passed the filters, and the cursor of the next page or None.
+def apply_game_view(game_info, view, group_size, cursor_serializer):
+    games = [
+        game for game in game_info
+        if (game.get("has_multiplayer") or not view["multiplayer_only"])
+        and PLAYER_BUCKETS[player_bucket(game, group_size)] in view["player_buckets"]
+    ]
+    total = len(games)
+    next_cursor = None
+
+    if view["sort"]:
+        keyed = sorted(((game_sort_key(game, view["sort"], group_size), game) for game in games), key=lambda pair: pair[0])
+        if view["cursor"] is not None:
+            keyed = [pair for pair in keyed if pair[0] > view["cursor"]]
+        if view["limit"] and len(keyed) > view["limit"]:
+            keyed = keyed[:view["limit"]]
+            next_cursor = cursor_serializer.dumps({"sort": view["sort"], "after": list(keyed[-1][0])})
+        games = [game for _, game in keyed]
+    
+    return games, total, next_cursor
+
+# Columnar form of game info, one list per field, which is much smaller as JSON than one object per game
+def game_columns(games):
+    columns = list(GAME_COLUMNS) + (["owners"] if any("owners" in game for game in games) else [])
+    return {column: [game.get(column) for game in games] for column in columns}
@@ -0,0 +1,140 @@
+use std::cmp::{Ordering, Reverse};
+use std::collections::BinaryHeap;
+use std::convert::TryFrom;
+use std::iter::FromIterator;
+
+/// Above this size ratio, an intersection binary searches the larger set instead of walking both
+const GALLOP_RATIO : usize = 32;
+
+/// A sorted set of Steam app IDs, used for games lists.
+///
+/// Steam app IDs are 32 bit, so a games list takes 4 bytes per game, and intersecting two lists
+/// walks two sorted arrays instead of hashing every game.
+#[derive(Clone, Debug, Default, PartialEq)]
+pub struct AppIdSet(Vec<u32>);
+
+impl AppIdSet {
+    pub fn len(&self) -> usize {
+        return self.0.len();
+    }
+
+    pub fn is_empty(&self) -> bool {
+        return self.0.is_empty();
+    }
+
+    pub fn iter(&self) -> impl ExactSizeIterator<Item = u64> + '_ {
+        return self.0.iter().map(|&appid| appid as u64);
+    }
+
+    pub fn intersect(&self, other: &AppIdSet) -> AppIdSet {
+        let (smaller, larger) = if self.len() <= other.len() { (&self.0, &other.0) } else { (&other.0, &self.0) };
+        let mut intersected = Vec::with_capacity(smaller.len());
+        if smaller.is_empty() {
+            return AppIdSet(intersected);
+        }
+
+        if larger.len() / smaller.len() >= GALLOP_RATIO {
+            let mut rest = &larger[..];
+            for &appid in smaller.iter() {
+                match rest.binary_search(&appid) {
+                    Ok(index) => {
+                        intersected.push(appid);
+                        rest = &rest[index + 1..];
+                    },
+                    Err(index) => rest = &rest[index..],
+                }
+            }
+        } else {
+            let (mut i, mut j) = (0, 0);
+            while i < smaller.len() && j < larger.len() {
+                match smaller[i].cmp(&larger[j]) {
+                    Ordering::Less => i += 1,
+                    Ordering::Greater => j += 1,
+                    Ordering::Equal => {
+                        intersected.push(smaller[i]);
+                        i += 1;
+                        j += 1;
+                    },
+                }
+            }
+        }
+
+        intersected.shrink_to_fit();
+        return AppIdSet(intersected);
+    }
+
+    /// Counts how many of `sets` contain each app ID, with one merge over all of them.
+    ///
+    /// Returns the app IDs in at least `min_owners` of the sets, in ascending order, with their counts.
+    pub fn count_owners(sets: &[&AppIdSet], min_owners: usize) -> Vec<(u64, usize)> {
+        let mut positions = vec![0; sets.len()];
+        let mut heap : BinaryHeap<Reverse<(u32, usize)>> = sets.iter().enumerate()
+            .filter_map(|(index, set)| set.0.first().map(|&appid| Reverse((appid, index))))
+            .collect();
+        let mut owners = Vec::new();
+
+        while let Some(&Reverse((appid, _))) = heap.peek() {
+            let mut count = 0;
+            while let Some(&Reverse((next, index))) = heap.peek() {
+                if next != appid {
+                    break;
+                }
+
+                heap.pop();
+                count += 1;
+                positions[index] += 1;
+                if let Some(&following) = sets[index].0.get(positions[index]) {
+                    heap.push(Reverse((following, index)));
+                }
+            }
+
+            if count >= min_owners {
+                owners.push((appid as u64, count));
+            }
+        }
+
+        return owners;
+    }
+}
+
+impl FromIterator<u64> for AppIdSet {
+    /// App IDs that don't fit in 32 bits are dropped, Steam doesn't hand those out
+    fn from_iter<I: IntoIterator<Item = u64>>(iter: I) -> AppIdSet {
+        let mut appids : Vec<u32> = iter.into_iter().filter_map(|appid| u32::try_from(appid).ok()).collect();
+        appids.sort_unstable();
+        appids.dedup();
+        appids.shrink_to_fit();
+        return AppIdSet(appids);
+    }
+}
+
+#[cfg(test)]
+fn set(appids: &[u64]) -> AppIdSet {
+    return appids.iter().cloned().collect();
+}
+
+#[test]
+fn intersect_sets() {
+    let a = set(&[5, 4, 3, 2, 1, 1]);
+    let b = set(&[4, 5, 6]);
+
+    assert_eq!(a.intersect(&b), set(&[4, 5]));
+    assert_eq!(b.intersect(&a), set(&[4, 5]));
+    assert!(a.intersect(&AppIdSet::default()).is_empty());
+
+    // Different enough in size to binary search the larger set
+    let large : AppIdSet = (0..1000u64).map(|n| n * 2).collect();
+    assert_eq!(large.intersect(&set(&[3, 4, 998, 1998, 5000])), set(&[4, 998, 1998]));
+}
+
+#[test]
+fn count_owners() {
+    let a = set(&[1, 2, 3]);
+    let b = set(&[2, 3, 4]);
+    let c = set(&[3, 4, 5]);
+
+    assert_eq!(AppIdSet::count_owners(&[&a, &b, &c], 1), vec![(1, 1), (2, 2), (3, 3), (4, 2), (5, 1)]);
+    assert_eq!(AppIdSet::count_owners(&[&a, &b, &c], 2), vec![(2, 2), (3, 3), (4, 2)]);
+    assert_eq!(AppIdSet::count_owners(&[&a, &b, &c], 3), vec![(3, 3)]);
+    assert!(AppIdSet::count_owners(&[], 1).is_empty());
+}
@@ -0,0 +1,197 @@
+use once_cell::sync::{Lazy, OnceCell};
+use reqwest::blocking::{Client, RequestBuilder, Response};
+use reqwest::StatusCode;
+use std::cmp::{max, min};
+use std::collections::hash_map::RandomState;
+use std::hash::{BuildHasher, Hasher};
+use std::thread;
+use std::time::{Duration, Instant};
+
+use crate::metrics::record_response;
+use crate::upstream::{self, Outcome};
+
+/// reqwest's own default for how long a whole request may take
+const DEFAULT_REQUEST_TIMEOUT : Duration = Duration::from_secs(30);
+
+/// Attempts made for one call, including the first, when upstream answers 5xx/429 or can't be reached
+pub const MAX_ATTEMPTS : u32 = 3;
+const BASE_BACKOFF : Duration = Duration::from_millis(250);
+const MAX_BACKOFF : Duration = Duration::from_secs(4);
+
+#[derive(Clone, Copy, Default)]
+struct Timeouts {
+    connect: Option<Duration>,
+    read: Option<Duration>,
+}
+
+static TIMEOUTS: OnceCell<Timeouts> = OnceCell::new();
+
+/// Process-wide HTTP client, so that every Steam and IGDB call shares one connection pool
+/// and TLS sessions are reused between requests.
+static CLIENT: Lazy<Client> = Lazy::new(|| {
+    let timeouts = timeouts();
+    let mut builder = Client::builder()
+        .pool_idle_timeout(Duration::from_secs(90))
+        .timeout(timeouts.read.unwrap_or(DEFAULT_REQUEST_TIMEOUT));
+    if let Some(connect) = timeouts.connect {
+        builder = builder.connect_timeout(connect);
+    }
+
+    return builder
+        .build()
+        .expect("Failed to build the shared HTTP client");
+});
+
+pub fn shared_client() -> &'static Client {
+    return &CLIENT;
+}
+
+fn timeouts() -> Timeouts {
+    return *TIMEOUTS.get_or_init(Timeouts::default);
+}
+
+/// Sets the connect timeout and the timeout for a whole request (reqwest's blocking client has no
+/// separate read timeout). `None` keeps reqwest's defaults.
+///
+/// The shared client is built with these on first use, so this has to be called before any request is made.
+pub fn set_timeouts(connect: Option<Duration>, read: Option<Duration>) -> Result<(), String> {
+    return TIMEOUTS.set(Timeouts { connect, read })
+        .map_err(|_| "Timeouts can only be set once, before any request is made".to_string());
+}
+
+/// Checks that `url` is an absolute URL, and gives it a trailing slash so paths can be joined onto it
+pub fn normalize_base_url(url: &str) -> Result<String, String> {
+    let mut url = url.to_string();
+    if !url.ends_with('/') {
+        url.push('/');
+    }
+
+    match reqwest::Url::parse(&url) {
+        Ok(_) => return Ok(url),
+        Err(e) => return Err(format!("Invalid base URL {}: {}", url, e)),
+    }
+}
+
+/// Point in time that every upstream call made for one site request has to finish by
+#[derive(Clone, Copy, Debug)]
+pub struct Deadline(Option<Instant>);
+
+impl Deadline {
+    /// No deadline, calls are only bound by the client timeouts
+    pub fn none() -> Deadline {
+        return Deadline(None);
+    }
+
+    /// A deadline `seconds` from now, or no deadline if `seconds` is `None`
+    pub fn from_secs(seconds: Option<f64>) -> Deadline {
+        return Deadline(seconds.map(|seconds| Instant::now() + Duration::from_secs_f64(seconds.max(0.0))));
+    }
+
+    /// Time left before the deadline, or `None` if there is no deadline
+    pub fn remaining(&self) -> Option<Duration> {
+        return self.0.map(|deadline| deadline.saturating_duration_since(Instant::now()));
+    }
+
+    pub fn expired(&self) -> bool {
+        return self.remaining().map_or(false, |remaining| remaining == Duration::from_secs(0));
+    }
+}
+
+pub enum SendError {
+    Request(reqwest::Error), // The request failed without a response
+    DeadlineExceeded, // The deadline passed before a response arrived
+    Unavailable, // The upstream's circuit breaker is open, so the request was never sent
+}
+
+/// Sends the request made by `build`, retrying up to `MAX_ATTEMPTS` times with jittered exponential backoff
+/// when upstream can't be reached, times out, or answers with a 5xx or 429.
+///
+/// Each attempt is cut short at `deadline`, and no retry is started that would sleep past it.
+/// Every attempt first goes through the rate limit, concurrency limit and circuit breaker of the
+/// upstream `endpoint` belongs to (see `upstream.rs`).
+/// The last response is returned as-is if it can't be retried, so callers still see the status code.
+pub fn send_with_retries<B>(endpoint: &'static str, deadline: Deadline, build: B) -> Result<Response, SendError>
+where
+    B: Fn() -> RequestBuilder
+{
+    let upstream = upstream::upstream(endpoint);
+    let mut attempt = 0;
+    loop {
+        let request = build();
+        let permit = upstream.acquire(deadline)?; // May block on the upstream's limits, so the deadline is checked after
+        let request = match deadline.remaining() {
+            None => request,
+            Some(remaining) if remaining == Duration::from_secs(0) => return Err(SendError::DeadlineExceeded),
+            Some(remaining) => request.timeout(min(remaining, timeouts().read.unwrap_or(DEFAULT_REQUEST_TIMEOUT))),
+        };
+
+        let started = Instant::now();
+        let result = request.send();
+        record_response(endpoint, &result, started);
+        attempt += 1;
+
+        let (retryable, retry_after) = match &result {
+            Ok(response) => (
+                response.status().is_server_error() || response.status() == StatusCode::TOO_MANY_REQUESTS,
+                retry_after(response)
+            ),
+            Err(_) if deadline.expired() => {
+                permit.finish(Outcome::Cancelled);
+                return Err(SendError::DeadlineExceeded);
+            },
+            Err(e) => (e.is_timeout() || e.is_connect(), None),
+        };
+
+        if let Ok(response) = &result {
+            if response.status() == StatusCode::TOO_MANY_REQUESTS {
+                upstream.throttle(retry_after);
+            }
+        }
+        permit.finish(match &result {
+            _ if retryable => Outcome::Failure,
+            Ok(_) => Outcome::Success(started.elapsed()),
+            Err(_) => Outcome::Cancelled, // Broke on our side rather than the upstream's
+        });
+
+        if !retryable || attempt >= MAX_ATTEMPTS {
+            return result.map_err(SendError::Request);
+        }
+
+        let delay = max(backoff(attempt), retry_after.unwrap_or_default());
+        if deadline.remaining().map_or(false, |remaining| delay >= remaining) {
+            return result.map_err(SendError::Request); // Not enough budget left to try again
+        }
+        thread::sleep(delay);
+    }
+}
+
+/// Delay before retry number `attempt`, picked at random from the upper half of the exponential backoff
+fn backoff(attempt: u32) -> Duration {
+    let ceiling = min(BASE_BACKOFF * 2u32.saturating_pow(attempt - 1), MAX_BACKOFF);
+    let random = RandomState::new().build_hasher().finish(); // RandomState is randomly keyed, so this is a random u64
+    return ceiling / 2 + Duration::from_nanos(random % (ceiling.as_nanos() as u64 / 2 + 1));
+}
+
+/// The delay asked for by a Retry-After header in seconds, capped at `MAX_BACKOFF`
+fn retry_after(response: &Response) -> Option<Duration> {
+    return response.headers().get(reqwest::header::RETRY_AFTER)
+        .and_then(|value| value.to_str().ok())
+        .and_then(|value| value.trim().parse::<u64>().ok())
+        .map(|seconds| min(Duration::from_secs(seconds), MAX_BACKOFF));
+}
+
+#[test]
+fn backoff_grows_and_caps() {
+    for attempt in 1..10 {
+        let ceiling = min(BASE_BACKOFF * 2u32.pow(attempt - 1), MAX_BACKOFF);
+        let delay = backoff(attempt);
+        assert!(delay >= ceiling / 2 && delay <= ceiling);
+    }
+}
+
+#[test]
+fn expired_deadline() {
+    assert!(Deadline::from_secs(Some(0.0)).expired());
+    assert!(!Deadline::from_secs(Some(60.0)).expired());
+    assert!(!Deadline::none().expired());
+}
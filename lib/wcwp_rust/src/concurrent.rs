@@ -0,0 +1,247 @@
+use std::cmp::{max, min};
+use std::collections::VecDeque;
+use std::panic::{self, AssertUnwindSafe};
+use std::sync::{Arc, Condvar, Mutex, mpsc};
+use std::sync::atomic::{AtomicBool, Ordering};
+use std::thread;
+
+type Job = Box<dyn FnOnce() + Send + 'static>;
+
+/// Threads shared by every call that runs work for one upstream.
+///
+/// Threads are started as jobs need them and kept for later calls, so however many requests are being
+/// answered at once, no more than `max_threads` of them run in the process.
+pub struct WorkerPool {
+    name: &'static str,
+    state: Mutex<PoolState>,
+    job_ready: Condvar,
+}
+
+struct PoolState {
+    jobs: VecDeque<Job>,
+    max_threads: usize,
+    threads: usize,
+    /// Threads not running a job, including ones that were just started
+    idle: usize,
+}
+
+impl WorkerPool {
+    pub fn new(name: &'static str, max_threads: usize) -> WorkerPool {
+        return WorkerPool {
+            name,
+            state: Mutex::new(PoolState { jobs: VecDeque::new(), max_threads: max(1, max_threads), threads: 0, idle: 0 }),
+            job_ready: Condvar::new(),
+        };
+    }
+
+    /// Threads over a lowered limit exit once they finish their current job. A raised one starts more threads
+    /// as new jobs come in.
+    pub fn set_max_threads(&self, max_threads: usize) {
+        self.state.lock().unwrap().max_threads = max(1, max_threads);
+        self.job_ready.notify_all();
+    }
+
+    #[cfg(test)]
+    fn threads(&self) -> usize {
+        return self.state.lock().unwrap().threads;
+    }
+
+    fn execute(&'static self, job: Job) {
+        let mut state = self.state.lock().unwrap();
+        state.jobs.push_back(job);
+        self.start_threads(&mut state);
+        self.job_ready.notify_one();
+    }
+
+    fn start_threads(&'static self, state: &mut PoolState) {
+        while state.idle < state.jobs.len() && state.threads < state.max_threads {
+            thread::Builder::new()
+                .name(format!("wcwp-{}", self.name))
+                .spawn(move || self.work())
+                .expect("Failed to start a worker thread");
+            state.threads += 1;
+            state.idle += 1;
+        }
+    }
+
+    fn work(&self) {
+        let mut state = self.state.lock().unwrap();
+        loop {
+            if state.threads > state.max_threads {
+                state.threads -= 1;
+                state.idle -= 1;
+                return;
+            }
+
+            match state.jobs.pop_front() {
+                Some(job) => {
+                    state.idle -= 1;
+                    drop(state);
+                    // A panicking job drops its result sender, which run_concurrently reports. The thread carries on.
+                    let _ = panic::catch_unwind(AssertUnwindSafe(job));
+                    state = self.state.lock().unwrap();
+                    state.idle += 1;
+                },
+                None => state = self.job_ready.wait(state).unwrap(),
+            }
+        }
+    }
+}
+
+/// Runs `work` over every item on at most `max_concurrency` of the `workers` threads at once.
+///
+/// `on_result` is called on the calling thread as each result arrives. Returning `Ok(false)` or an error
+/// stops early: items that have not been started yet are skipped, and work already in flight is left to
+/// finish in the background with its result discarded.
+///
+/// Returns `Ok(true)` if every item's result was passed to `on_result`, or `Ok(false)` if it stopped early
+/// or `work` panicked.
+pub fn run_concurrently<T, R, E, W, F>(workers: &'static WorkerPool, items: Vec<T>, max_concurrency: usize, work: W, mut on_result: F) -> Result<bool, E>
+where
+    T: Send + 'static,
+    R: Send + 'static,
+    W: Fn(T) -> R + Send + Sync + 'static,
+    F: FnMut(R) -> Result<bool, E>
+{
+    let total = items.len();
+    if total == 0 {
+        return Ok(true);
+    }
+
+    let queue = Arc::new(Mutex::new(items.into_iter()));
+    let cancelled = Arc::new(AtomicBool::new(false));
+    let work = Arc::new(work);
+    let (sender, receiver) = mpsc::channel();
+
+    for _ in 0..max(1, min(max_concurrency, total)) {
+        let queue = Arc::clone(&queue);
+        let cancelled = Arc::clone(&cancelled);
+        let work = Arc::clone(&work);
+        let sender = sender.clone();
+
+        workers.execute(Box::new(move || {
+            while !cancelled.load(Ordering::Relaxed) {
+                let item = match queue.lock().unwrap().next() {
+                    Some(item) => item,
+                    None => break,
+                };
+
+                if sender.send(work(item)).is_err() {
+                    break; // The receiver has already stopped listening
+                }
+            }
+        }));
+    }
+    drop(sender);
+
+    let mut received = 0;
+    for result in receiver.iter() {
+        received += 1;
+        match on_result(result) {
+            Ok(true) => {},
+            Ok(false) => {
+                cancelled.store(true, Ordering::Relaxed);
+                return Ok(false);
+            },
+            Err(e) => {
+                cancelled.store(true, Ordering::Relaxed);
+                return Err(e);
+            }
+        }
+    }
+
+    return Ok(received == total);
+}
+
+#[cfg(test)]
+fn test_workers(max_threads: usize) -> &'static WorkerPool {
+    return Box::leak(Box::new(WorkerPool::new("test", max_threads)));
+}
+
+#[test]
+fn run_all_items() {
+    let mut total = 0;
+    let completed = run_concurrently(test_workers(3), (1..=10u64).collect(), 3, |n| n * 2, |n| -> Result<bool, ()> {
+        total += n;
+        return Ok(true);
+    }).unwrap();
+
+    assert!(completed);
+    assert_eq!(total, 110);
+}
+
+#[test]
+fn stop_early() {
+    let mut seen = 0;
+    let completed = run_concurrently(test_workers(1), (1..=100u64).collect(), 1, |n| n, |_| -> Result<bool, ()> {
+        seen += 1;
+        return Ok(seen < 5);
+    }).unwrap();
+
+    assert!(!completed);
+    assert_eq!(seen, 5);
+}
+
+#[test]
+fn threads_are_shared_and_bounded() {
+    use std::sync::atomic::AtomicUsize;
+    use std::time::Duration;
+
+    let workers = test_workers(2);
+    let running = Arc::new(AtomicUsize::new(0));
+    let most_running = Arc::new(AtomicUsize::new(0));
+
+    let calls : Vec<_> = (0..3).map(|_| {
+        let running = Arc::clone(&running);
+        let most_running = Arc::clone(&most_running);
+        return thread::spawn(move || {
+            return run_concurrently(workers, (1..=6u64).collect(), 4, move |n| {
+                most_running.fetch_max(running.fetch_add(1, Ordering::SeqCst) + 1, Ordering::SeqCst);
+                thread::sleep(Duration::from_millis(5));
+                running.fetch_sub(1, Ordering::SeqCst);
+                return n;
+            }, |_| -> Result<bool, ()> { Ok(true) }).unwrap();
+        });
+    }).collect();
+
+    for call in calls {
+        assert!(call.join().unwrap());
+    }
+    assert!(most_running.load(Ordering::SeqCst) <= 2);
+    assert_eq!(workers.threads(), 2);
+}
+
+#[test]
+fn panicking_work_is_reported_and_the_thread_kept() {
+    let workers = test_workers(1);
+    let completed = run_concurrently(workers, vec![1u64, 2, 3], 1, |n| {
+        if n == 2 {
+            panic!("work failed");
+        }
+        return n;
+    }, |_| -> Result<bool, ()> { Ok(true) }).unwrap();
+    assert!(!completed);
+
+    let completed = run_concurrently(workers, vec![1u64, 3], 1, |n| n, |_| -> Result<bool, ()> { Ok(true) }).unwrap();
+    assert!(completed);
+    assert_eq!(workers.threads(), 1);
+}
+
+#[test]
+fn lowering_the_limit_stops_extra_threads() {
+    use std::time::{Duration, Instant};
+
+    let workers = test_workers(4);
+    run_concurrently(workers, (1..=8u64).collect(), 4, |n| {
+        thread::sleep(Duration::from_millis(5));
+        return n;
+    }, |_| -> Result<bool, ()> { Ok(true) }).unwrap();
+    assert_eq!(workers.threads(), 4);
+
+    workers.set_max_threads(1);
+    let started = Instant::now();
+    while workers.threads() > 1 && started.elapsed() < Duration::from_secs(5) {
+        thread::sleep(Duration::from_millis(1));
+    }
+    assert_eq!(workers.threads(), 1);
+}
@@ -7,6 +7,8 @@ pub enum IGDBError {
     BadSecret, // The supplied client secret is wrong
     BadToken, // The supplied bearer token is wrong
     BadAuth, // Some part of the supplied authentication is wrong
+    DeadlineExceeded, // The request's deadline passed before IGDB responded
+    Unavailable, // IGDB has been failing, so the request was not sent
 }
 
 use std::fmt;
@@ -20,6 +22,8 @@ impl fmt::Display for IGDBError {
             IGDBError::BadSecret => return write!(f, "IGDB rejected the provided client secret"),
             IGDBError::BadToken => return write!(f, "IGDB rejected the provided bearer token"),
             IGDBError::BadAuth => return write!(f, "IGDB rejected some part of the provided authentication"),
+            IGDBError::DeadlineExceeded => return write!(f, "IGDB did not respond before the deadline"),
+            IGDBError::Unavailable => return write!(f, "IGDB has been failing, so the request was not sent"),
             IGDBError::UnknownError(err_string) => return write!(f, "{}", &err_string),
             _ => return write!(f, "IGDB API had an unknown error")
         }
@@ -35,6 +39,7 @@ pub enum SteamError {
     GamesListPrivate(u64), // The games list of the given steam id is unretrievable, probably due to game list privacy settings
     GamesListEmpty(u64), // Intersection failed, the user with the given steam id had no games
     FriendListPrivate, // The steam id passed to get_friend_list() has their friend list set to private
+    DeadlineExceeded, // The request's deadline passed before Steam responded
 }
 
 impl fmt::Display for SteamError {
@@ -47,6 +52,7 @@ impl fmt::Display for SteamError {
             SteamError::GamesListPrivate(steamid) => return write!(f, "The user with Steam ID {} has their games list set to private", steamid),
             SteamError::GamesListEmpty(steamid) => return write!(f, "The user with the Steam ID {} has no games to intersect", steamid),
             SteamError::FriendListPrivate => return write!(f, "The given user has their friend list set to private"),
+            SteamError::DeadlineExceeded => return write!(f, "Steam did not respond before the deadline"),
             _ => return write!(f, "Steam had an unknown error")
         }
     }
@@ -77,4 +83,26 @@ impl From<IGDBError> for WCWPError {
     fn from(e: IGDBError) -> Self {
         return WCWPError::IGDBError(e);
     }
+}
+
+use crate::client::SendError;
+
+impl From<SendError> for SteamError {
+    fn from(e: SendError) -> Self {
+        match e {
+            SendError::Request(e) => return SteamError::UnknownError(e.to_string()),
+            SendError::DeadlineExceeded => return SteamError::DeadlineExceeded,
+            SendError::Unavailable => return SteamError::ServerError,
+        }
+    }
+}
+
+impl From<SendError> for IGDBError {
+    fn from(e: SendError) -> Self {
+        match e {
+            SendError::Request(e) => return IGDBError::UnknownError(e.to_string()),
+            SendError::DeadlineExceeded => return IGDBError::DeadlineExceeded,
+            SendError::Unavailable => return IGDBError::Unavailable,
+        }
+    }
 }
\ No newline at end of file
@@ -8,9 +8,24 @@ use reqwest::StatusCode;
 use serde_json::Value;
 use std::convert::{TryFrom, TryInto};
 use std::cmp::{max, min};
+use once_cell::sync::Lazy;
+use crate::client::{shared_client, normalize_base_url, send_with_retries, Deadline};
+use std::sync::RwLock;
+use crate::concurrent::run_concurrently;
+use crate::upstream;
 
-const API_URL : &str = "https://api.igdb.com/v4/";
-const TOKEN_URL : &str = "https://id.twitch.tv/oauth2/token";
+const DEFAULT_API_URL : &str = "https://api.igdb.com/v4/";
+const DEFAULT_TOKEN_URL : &str = "https://id.twitch.tv/oauth2/token";
+
+static API_URL : Lazy<RwLock<String>> = Lazy::new(|| RwLock::new(DEFAULT_API_URL.to_string()));
+static TOKEN_URL : Lazy<RwLock<String>> = Lazy::new(|| RwLock::new(DEFAULT_TOKEN_URL.to_string()));
+
+/// IGDB rejects clients that send more than this many requests a second.
+/// This is the default rate for the "igdb" upstream in `upstream.rs`, which every IGDB request goes through.
+pub const REQUESTS_PER_SECOND : u32 = 4;
+
+/// Default number of `external_games` requests kept in flight at once (IGDB allows up to 8 open requests)
+pub const DEFAULT_MAX_IN_FLIGHT : usize = 4;
 
 #[derive(Serialize, Deserialize, Debug)]
 /// Struct for retrieving a bearer token from the Twitch Developer API
@@ -147,6 +162,21 @@ impl TryFrom<&Value> for GameInfo {
     }
 }
 
+/// Points every IGDB API call at `url` instead of api.igdb.com/v4, e.g. a local stand-in for benchmarks
+pub fn set_api_url(url: &str) -> Result<(), String> {
+    *API_URL.write().unwrap() = normalize_base_url(url)?;
+    return Ok(());
+}
+
+/// Points Twitch token requests at `url` instead of id.twitch.tv
+pub fn set_token_url(url: &str) -> Result<(), String> {
+    if let Err(e) = reqwest::Url::parse(url) {
+        return Err(format!("Invalid token URL {}: {}", url, e));
+    }
+    *TOKEN_URL.write().unwrap() = url.to_string();
+    return Ok(());
+}
+
 /// Fetches a Twitch app bearer token for use with the IGDB API.
 ///
 /// # Errors
@@ -159,17 +189,20 @@ impl TryFrom<&Value> for GameInfo {
 ///
 /// `IGDBError::UnknownError` is returned for any unexpected status codes, or if Twitch was unreachable.
 pub fn get_twitch_token(client_id: &str, secret: &str) -> Result<Token, IGDBError> {
-    let client = reqwest::blocking::Client::new();
-
-    let res = client.post(TOKEN_URL)
-        .query(&[
-            ("client_id", client_id),
-            ("client_secret", secret),
-            ("grant_type", "client_credentials")
-        ]).send();
+    let client = shared_client();
+
+    let token_url = TOKEN_URL.read().unwrap().clone();
+    let res = send_with_retries("twitch:token", Deadline::none(), || {
+        client.post(&token_url)
+            .query(&[
+                ("client_id", client_id),
+                ("client_secret", secret),
+                ("grant_type", "client_credentials")
+            ])
+    });
     
     if let Err(e) = res {
-        return Err(IGDBError::UnknownError(e.to_string()));
+        return Err(e.into());
     }
 
     let res = res.unwrap();
@@ -193,11 +226,81 @@ pub fn get_twitch_token(client_id: &str, secret: &str) -> Result<Token, IGDBErro
     return Ok(t);
 }
 
+/// Fetch the info for one `external_games` query worth of steam app IDs
+fn get_steam_game_info_chunk(client_id: &str, bearer_token: &str, appids: &[u64], deadline: Deadline) -> Result<(Vec<GameInfo>, HashSet<u64>), IGDBError> {
+    let client = shared_client();
+    let mut games_info : Vec<GameInfo> = Vec::new();
+    let mut not_found : HashSet<u64> = appids.iter().cloned().collect();
+
+    let mut id_str = appids[0].to_string();
+
+    for n in appids[1..].iter()
+    {
+        write!(&mut id_str, ",{}", n).unwrap();
+    }
+
+    let api_url = API_URL.read().unwrap().clone();
+    let response = send_with_retries("igdb:external_games", deadline, || {
+        client.post(&format!("{}{}", api_url, "external_games"))
+            .header("Client-ID", client_id)
+            .header("Authorization", format!("Bearer {}", bearer_token))
+            .header("Accept", "application/json")
+            .body(format!(
+                "fields uid,game.name,game.game_modes,game.multiplayer_modes.onlinemax,
+                game.multiplayer_modes.onlinecoopmax,game.cover.image_id; 
+                where uid = ({}) & category = 1; limit {};",
+                id_str, appids.len()
+            ))
+    });
+
+    if let Err(e) = response {
+        return Err(e.into());
+    }
+
+    let response = response.unwrap();
+
+    if !response.status().is_success() {
+        match response.status() {
+            StatusCode::UNAUTHORIZED => {
+                return Err(IGDBError::BadClient);
+            },
+            StatusCode::FORBIDDEN => {
+                return Err(IGDBError::BadAuth);
+            },
+            StatusCode::INTERNAL_SERVER_ERROR | StatusCode::BAD_GATEWAY =>
+                return Err(IGDBError::ServerError),
+            _ =>
+                return Err(IGDBError::UnknownError(
+                        response.text().unwrap_or("Unknown error".to_string()))
+                ),
+        }
+    }
+
+    if let Ok(games_json) = response.json::<Value>() {
+        if let Some(games) = games_json.as_array() {
+            for game in games.iter() {
+                if let Ok(game_info) = GameInfo::try_from(game) {
+                    not_found.remove(&game_info.steam_id);
+                    games_info.push(game_info);
+                }
+            }
+        }
+    }
+
+    return Ok((games_info, not_found));
+}
+
 /// Fetch the info for the provided set of steam app IDs
 ///
 /// Returns a tuple of two `Vec`s, a `Vec` containing the info of found games, and a `Vec` of app IDs not found.
 /// If `appids` is empty, returns two empty `Vec`s.
 ///
+/// App IDs are queried in chunks of 500, with up to `max_in_flight` chunks requested at once.
+/// Every request goes through the IGDB upstream's rate limit and circuit breaker.
+///
+/// If `deadline` passes, or the circuit breaker turns requests away, the chunks that didn't finish are left out
+/// of both `Vec`s rather than failing the whole call, so callers can tell which app IDs are still unknown.
+///
 /// # Errors
 ///
 /// `IGDBError::BadAuth` is returned if either the `client_id` or `bearer_token` are invalid.
@@ -205,75 +308,41 @@ pub fn get_twitch_token(client_id: &str, secret: &str) -> Result<Token, IGDBErro
 /// `IGDBError::ServerError` is returned if IGDB was unable to process the request.
 /// 
 ///`IGDBError::UnknownError` is returned for any unexpected status codes, or if IGDB was unreachable.
-pub fn get_steam_game_info(client_id: &str, bearer_token: &str, appids: &[u64]) -> Result<(Vec<GameInfo>, HashSet<u64>), IGDBError> {
+pub fn get_steam_game_info(client_id: &str, bearer_token: &str, appids: &[u64], max_in_flight: usize, deadline: Deadline) -> Result<(Vec<GameInfo>, HashSet<u64>), IGDBError> {
     if appids.is_empty()
     {
         return Ok((Vec::new(), HashSet::new()));
     }
 
-    let client = reqwest::blocking::Client::new();
     let mut games_info : Vec<GameInfo> = Vec::new();
     let mut not_found : HashSet<u64> = HashSet::with_capacity(appids.len());
 
-    for current_slice in appids.chunks(500)
-    {
-        let mut id_str = current_slice[0].to_string();
-
-        for n in current_slice[1..].iter()
-        {
-            write!(&mut id_str, ",{}", n).unwrap();
+    let chunks : Vec<Vec<u64>> = appids.chunks(500).map(|chunk| chunk.to_vec()).collect();
+    let client_id = client_id.to_string();
+    let bearer_token = bearer_token.to_string();
+
+    let completed = run_concurrently(
+        upstream::upstream("igdb").workers(),
+        chunks,
+        max_in_flight,
+        move |chunk| get_steam_game_info_chunk(&client_id, &bearer_token, &chunk, deadline),
+        |result| -> Result<bool, IGDBError> {
+            let (chunk_info, chunk_not_found) = match result {
+                Err(IGDBError::DeadlineExceeded) => return Ok(true), // Leave this chunk out, the rest will time out soon too
+                Err(IGDBError::Unavailable) => return Ok(true), // Same for chunks turned away while IGDB is failing
+                result => result?,
+            };
+            games_info.extend(chunk_info);
+            not_found.extend(chunk_not_found);
+            return Ok(true);
         }
+    )?;
 
-        let response = client.post(&format!("{}{}", API_URL, "external_games"))
-            .header("Client-ID", client_id)
-            .header("Authorization", format!("Bearer {}", bearer_token))
-            .header("Accept", "application/json")
-            .body(format!(
-                "fields uid,game.name,game.game_modes,game.multiplayer_modes.onlinemax,
-                game.multiplayer_modes.onlinecoopmax,game.cover.image_id; 
-                where uid = ({}) & category = 1; limit {};",
-                id_str, current_slice.len()
-            )).send();
-
-            if let Err(e) = response {
-                return Err(IGDBError::UnknownError(e.to_string()));
-            }
-
-            let response = response.unwrap();
-        
-            if !response.status().is_success() {
-                match response.status() {
-                    StatusCode::UNAUTHORIZED => {
-                        return Err(IGDBError::BadClient);
-                    },
-                    StatusCode::FORBIDDEN => {
-                        return Err(IGDBError::BadAuth);
-                    },
-                    StatusCode::INTERNAL_SERVER_ERROR | StatusCode::BAD_GATEWAY =>
-                        return Err(IGDBError::ServerError),
-                    _ =>
-                        return Err(IGDBError::UnknownError(
-                                response.text().unwrap_or("Unknown error".to_string()))
-                        ),
-                }
-            }
-
-            for id in current_slice.iter() 
-                { not_found.insert(*id); }
-
-            if let Ok(games_json) = response.json::<Value>() {
-                if let Some(games) = games_json.as_array() {
-                    for game in games.iter() {
-                        if let Ok(game_info) = GameInfo::try_from(game) {
-                            not_found.remove(&game_info.steam_id);
-                            games_info.push(game_info);
-                        }
-                    }
-                }
-            }
-        }
+    if !completed {
+        return Err(IGDBError::UnknownError("An IGDB fetch thread exited unexpectedly".to_string()));
+    }
 
-        return Ok((games_info, not_found));
+    return Ok((games_info, not_found));
 }
 
 #[test]
@@ -2,4 +2,9 @@ pub mod igdb;
 pub mod wcwp;
 pub mod steam;
 pub mod errors;
+mod appid_set;
+mod client;
+mod concurrent;
+mod metrics;
+mod upstream;
 mod python;
\ No newline at end of file
@@ -0,0 +1,53 @@
+use std::collections::VecDeque;
+use std::sync::Mutex;
+use std::time::Instant;
+use once_cell::sync::Lazy;
+
+/// Calls past this are dropped oldest first, if nothing is collecting them
+const MAX_RECORDED_CALLS : usize = 10000;
+
+/// One request made to Steam, IGDB or Twitch
+pub struct UpstreamCall {
+    /// Which API was called, e.g. "steam:GetOwnedGames"
+    pub endpoint: &'static str,
+    /// HTTP status code, or 0 if no response was received
+    pub status: u16,
+    /// Seconds from sending the request until the response headers arrived
+    pub seconds: f64,
+}
+
+static CALLS : Lazy<Mutex<VecDeque<UpstreamCall>>> = Lazy::new(|| Mutex::new(VecDeque::new()));
+
+/// Records how a request to `endpoint` started at `started` turned out
+pub fn record_response(endpoint: &'static str, response: &reqwest::Result<reqwest::blocking::Response>, started: Instant) {
+    let status = match response {
+        Ok(response) => response.status().as_u16(),
+        Err(e) => e.status().map_or(0, |status| status.as_u16()),
+    };
+
+    let mut calls = CALLS.lock().unwrap();
+    if calls.len() >= MAX_RECORDED_CALLS {
+        calls.pop_front();
+    }
+    calls.push_back(UpstreamCall {
+        endpoint,
+        status,
+        seconds: started.elapsed().as_secs_f64(),
+    });
+}
+
+/// Removes and returns every call recorded since the last time this was called
+pub fn take_calls() -> Vec<UpstreamCall> {
+    return CALLS.lock().unwrap().drain(..).collect();
+}
+
+#[test]
+fn take_drains_calls() {
+    let response = reqwest::blocking::Client::new().get("http://invalid host/").send(); // Fails before touching the network
+    record_response("test:take_drains_calls", &response, Instant::now());
+
+    let calls : Vec<UpstreamCall> = take_calls().into_iter().filter(|call| call.endpoint == "test:take_drains_calls").collect();
+    assert_eq!(calls.len(), 1);
+    assert_eq!(calls[0].status, 0);
+    assert!(take_calls().iter().all(|call| call.endpoint != "test:take_drains_calls"));
+}
@@ -1,6 +1,17 @@
+// Every binding does its network and set work inside `py.allow_threads()`, so threaded
+// workers can keep serving other requests while one waits on Steam or IGDB.
+// Python objects are only built once the GIL has been reacquired.
+//
+// Bindings that take a `timeout` give up on upstream calls after that many seconds, counted from when
+// they're called. `None` means no deadline beyond the client timeouts.
+
 use pyo3::prelude::*;
 use pyo3::wrap_pyfunction;
-use pyo3::types::{PyTuple, PyList};
+use pyo3::types::{PyTuple, PyList, PyDict};
+
+use crate::client::Deadline;
+use crate::appid_set::AppIdSet;
+use std::collections::HashMap;
 
 pub mod conversions {
     use pyo3::prelude::*;
@@ -93,6 +104,7 @@ pub mod igdb_exceptions {
     create_exception!(igdb, BadSecretException, IGDBException);
     create_exception!(igdb, BadTokenException, IGDBException);
     create_exception!(igdb, BadAuthException, IGDBException);
+    create_exception!(igdb, DeadlineExceededException, IGDBException);
 
     impl From<IGDBError> for PyErr {
         fn from(e: IGDBError) -> PyErr {
@@ -103,6 +115,8 @@ pub mod igdb_exceptions {
                 IGDBError::BadSecret => BadSecretException::new_err(e.to_string()),
                 IGDBError::BadToken => BadTokenException::new_err(e.to_string()),
                 IGDBError::BadAuth => BadAuthException::new_err(e.to_string()),
+                IGDBError::DeadlineExceeded => DeadlineExceededException::new_err(e.to_string()),
+                IGDBError::Unavailable => ServerErrorException::new_err(e.to_string()),
                 _ => UnknownErrorException::new_err(e.to_string()),
             }
         }
@@ -111,7 +125,7 @@ pub mod igdb_exceptions {
 
 #[pyfunction]
 pub fn fetch_twitch_token(_py: Python, client_id: &str, secret: &str) -> PyResult<igdb::Token> {
-    let token = igdb::get_twitch_token(client_id, secret);
+    let token = _py.allow_threads(|| igdb::get_twitch_token(client_id, secret));
     match token {
         Ok(token) => return Ok(token),
         Err(e) => return Err(e.into())
@@ -119,8 +133,9 @@ pub fn fetch_twitch_token(_py: Python, client_id: &str, secret: &str) -> PyResul
 }
 
 #[pyfunction]
-pub fn get_steam_game_info(_py: Python, client_id: &str, bearer_token: &str, appids: Vec<u64>) -> PyResult<PyObject> {
-    let result = igdb::get_steam_game_info(client_id, bearer_token, &appids);
+pub fn get_steam_game_info(_py: Python, client_id: &str, bearer_token: &str, appids: Vec<u64>, max_in_flight: usize, timeout: Option<f64>) -> PyResult<PyObject> {
+    let deadline = Deadline::from_secs(timeout);
+    let result = _py.allow_threads(|| igdb::get_steam_game_info(client_id, bearer_token, &appids, max_in_flight, deadline));
     
     match result {
         Err(e) => {
@@ -156,6 +171,7 @@ fn igdb_mod(py: &Python, m: &PyModule) -> PyResult<()> {
     expose_exception!(py, m, BadSecretException)?;
     expose_exception!(py, m, BadTokenException)?;
     expose_exception!(py, m, BadAuthException)?;
+    expose_exception!(py, m, DeadlineExceededException)?;
 
     return Ok(());
 }
@@ -178,6 +194,7 @@ pub mod steam_exceptions {
     create_exception!(steam, GamesListPrivateException, SteamException);
     create_exception!(steam, GamesListEmptyException, SteamException);
     create_exception!(steam, FriendListPrivateException, SteamException);
+    create_exception!(steam, DeadlineExceededException, SteamException);
 
     impl From<SteamError> for PyErr {
         fn from(e: SteamError) -> PyErr {
@@ -186,6 +203,7 @@ pub mod steam_exceptions {
                 SteamError::BadResponse => BadResponseException::new_err(e.to_string()),
                 SteamError::BadWebkey => BadWebkeyException::new_err(e.to_string()),
                 SteamError::FriendListPrivate => FriendListPrivateException::new_err(e.to_string()),
+                SteamError::DeadlineExceeded => DeadlineExceededException::new_err(e.to_string()),
                 SteamError::GamesListPrivate(steamid) => GamesListPrivateException::new_err((e.to_string(), steamid)),
                 SteamError::GamesListEmpty(steamid) => GamesListEmptyException::new_err((e.to_string(), steamid)),
                 _ => UnknownErrorException::new_err(e.to_string()),
@@ -195,8 +213,9 @@ pub mod steam_exceptions {
 }
 
 #[pyfunction]
-pub fn get_steam_users_info(_py: Python, webkey: &str, steamids: Vec<u64>) -> PyResult<PyObject> {
-    let result = steam::get_steam_users_info(webkey, &steamids);
+pub fn get_steam_users_info(_py: Python, webkey: &str, steamids: Vec<u64>, timeout: Option<f64>) -> PyResult<PyObject> {
+    let deadline = Deadline::from_secs(timeout);
+    let result = _py.allow_threads(|| steam::get_steam_users_info(webkey, &steamids, deadline));
 
     match result {
         Err(e) => {
@@ -209,22 +228,24 @@ pub fn get_steam_users_info(_py: Python, webkey: &str, steamids: Vec<u64>) -> Py
 }
 
 #[pyfunction]
-pub fn get_owned_steam_games(_py: Python, webkey: &str, steamid: u64) -> PyResult<PyObject> {
-    let result = steam::get_owned_steam_games(webkey, steamid);
+pub fn get_owned_steam_games(_py: Python, webkey: &str, steamid: u64, timeout: Option<f64>) -> PyResult<PyObject> {
+    let deadline = Deadline::from_secs(timeout);
+    let result = _py.allow_threads(|| steam::get_owned_steam_games(webkey, steamid, deadline));
 
     match result {
         Err(e) => {
             return Err(e.into());
         },
         Ok(game_ids) => {
-            return Ok(PyList::new(_py, game_ids).into());
+            return Ok(PyList::new(_py, game_ids.iter()).into());
         }
     }
 }
 
 #[pyfunction]
-pub fn get_friend_list(_py: Python, webkey: &str, steamid: u64) -> PyResult<PyObject> {
-    let result = steam::get_friend_list(webkey, steamid);
+pub fn get_friend_list(_py: Python, webkey: &str, steamid: u64, timeout: Option<f64>) -> PyResult<PyObject> {
+    let deadline = Deadline::from_secs(timeout);
+    let result = _py.allow_threads(|| steam::get_friend_list(webkey, steamid, deadline));
 
     match result {
         Err(e) => {
@@ -237,24 +258,93 @@ pub fn get_friend_list(_py: Python, webkey: &str, steamid: u64) -> PyResult<PyOb
 }
 
 #[pyfunction]
-pub fn intersect_owned_game_ids(_py: Python, webkey: &str, steamids: Vec<u64>) -> PyResult<PyObject> {
-    let result = steam::intersect_owned_game_ids(webkey, &steamids);
+pub fn get_friend_ids(_py: Python, webkey: &str, steamid: u64, timeout: Option<f64>) -> PyResult<PyObject> {
+    let deadline = Deadline::from_secs(timeout);
+    let result = _py.allow_threads(|| steam::get_friend_ids(webkey, steamid, deadline));
+
+    match result {
+        Err(e) => {
+            return Err(e.into());
+        },
+        Ok(friend_ids) => {
+            return Ok(PyList::new(_py, friend_ids).into());
+        }
+    }
+}
+
+#[pyfunction]
+pub fn intersect_owned_game_ids(_py: Python, webkey: &str, steamids: Vec<u64>, max_concurrency: usize, timeout: Option<f64>) -> PyResult<PyObject> {
+    let deadline = Deadline::from_secs(timeout);
+    let result = _py.allow_threads(|| steam::intersect_owned_game_ids(webkey, &steamids, max_concurrency, deadline));
 
     match result {
         Err(e) => {
             return Err(e.into());
         },
         Ok(appids) => {
-            return Ok(PyList::new(_py, appids).into());
+            return Ok(PyList::new(_py, appids.iter()).into());
         }
     }
 }
 
+#[pyfunction]
+pub fn intersect_owned_game_ids_from(_py: Python, webkey: &str, steamids: Vec<u64>, seed: Option<Vec<u64>>, max_concurrency: usize, timeout: Option<f64>) -> PyResult<PyObject> {
+    let deadline = Deadline::from_secs(timeout);
+    let result = _py.allow_threads(|| {
+        let seed = seed.map(|appids| appids.into_iter().collect());
+        return steam::intersect_owned_game_ids_from(webkey, &steamids, seed, max_concurrency, deadline);
+    });
+
+    match result {
+        Err(e) => {
+            return Err(e.into());
+        },
+        Ok((appids, fetched)) => {
+            let tuple : Vec<PyObject> = vec!(PyList::new(_py, appids.iter()).into(), fetched_games_dict(_py, fetched)?);
+            return Ok(PyTuple::new(_py, tuple).into());
+        }
+    }
+}
+
+/// Counts the owners of each game between the `known` games lists and the games lists of `steamids`,
+/// keeping games owned by at least `min_owners` users.
+///
+/// Returns a list of (appid, owner count) tuples, and a dict of the games list of each fetched steamid.
+#[pyfunction]
+pub fn count_game_owners_from(_py: Python, webkey: &str, steamids: Vec<u64>, known: Vec<Vec<u64>>, min_owners: usize, max_concurrency: usize, timeout: Option<f64>) -> PyResult<PyObject> {
+    let deadline = Deadline::from_secs(timeout);
+    let result = _py.allow_threads(|| {
+        let known = known.into_iter().map(|appids| appids.into_iter().collect()).collect();
+        return steam::count_game_owners_from(webkey, &steamids, known, min_owners, max_concurrency, deadline);
+    });
+
+    match result {
+        Err(e) => {
+            return Err(e.into());
+        },
+        Ok((owners, fetched)) => {
+            let tuple : Vec<PyObject> = vec!(PyList::new(_py, owners).into(), fetched_games_dict(_py, fetched)?);
+            return Ok(PyTuple::new(_py, tuple).into());
+        }
+    }
+}
+
+fn fetched_games_dict(_py: Python, fetched: HashMap<u64, AppIdSet>) -> PyResult<PyObject> {
+    let fetched_dict = PyDict::new(_py);
+    for (steamid, games) in fetched {
+        fetched_dict.set_item(steamid, PyList::new(_py, games.iter()))?;
+    }
+    return Ok(fetched_dict.into());
+}
+
 fn steam_mod(py: &Python, m: &PyModule) -> PyResult<()> {
     m.add_function(wrap_pyfunction!(get_steam_users_info, m)?)?;
     m.add_function(wrap_pyfunction!(get_owned_steam_games, m)?)?;
     m.add_function(wrap_pyfunction!(get_friend_list, m)?)?;
+    m.add_function(wrap_pyfunction!(get_friend_ids, m)?)?;
     m.add_function(wrap_pyfunction!(intersect_owned_game_ids, m)?)?;
+    m.add_function(wrap_pyfunction!(intersect_owned_game_ids_from, m)?)?;
+    m.add_function(wrap_pyfunction!(count_game_owners_from, m)?)?;
 
     use steam_exceptions::*;
 
@@ -267,6 +357,7 @@ fn steam_mod(py: &Python, m: &PyModule) -> PyResult<()> {
     expose_exception!(py, m, FriendListPrivateException)?;
     expose_exception!(py, m, GamesListEmptyException)?;
     expose_exception!(py, m, GamesListPrivateException)?;
+    expose_exception!(py, m, DeadlineExceededException)?;
 
     return Ok(());
 }
@@ -289,12 +380,109 @@ pub mod wcwp_exceptions {
 }
 
 #[pyfunction]
-pub fn intersect_owned_games(_py: Python, webkey: &str, igdb_id: &str, igdb_token: &str, steamids: Vec<u64>) -> PyResult<PyObject> {
-    let result = wcwp::intersect_owned_games(webkey, igdb_id, igdb_token, &steamids)?;
+pub fn intersect_owned_games(_py: Python, webkey: &str, igdb_id: &str, igdb_token: &str, steamids: Vec<u64>, max_concurrency: usize, timeout: Option<f64>) -> PyResult<PyObject> {
+    let deadline = Deadline::from_secs(timeout);
+    let result = _py.allow_threads(|| wcwp::intersect_owned_games(webkey, igdb_id, igdb_token, &steamids, max_concurrency, deadline))?;
 
     return Ok(PyList::new(_py, result).into());
 }
 
+/// Overrides the base URLs of the upstream APIs. Any argument left as None keeps its current URL.
+#[pyfunction]
+pub fn set_api_urls(steam_api_url: Option<&str>, igdb_api_url: Option<&str>, twitch_token_url: Option<&str>) -> PyResult<()> {
+    use pyo3::exceptions::PyValueError;
+
+    if let Some(url) = steam_api_url {
+        steam::set_api_url(url).map_err(PyValueError::new_err)?;
+    }
+    if let Some(url) = igdb_api_url {
+        igdb::set_api_url(url).map_err(PyValueError::new_err)?;
+    }
+    if let Some(url) = twitch_token_url {
+        igdb::set_token_url(url).map_err(PyValueError::new_err)?;
+    }
+
+    return Ok(());
+}
+
+use crate::metrics;
+
+/// Sets the connect timeout and whole-request timeout of every upstream call, in seconds.
+/// Has to be called before any other function in this module, None keeps the defaults.
+#[pyfunction]
+pub fn set_timeouts(connect_timeout: Option<f64>, read_timeout: Option<f64>) -> PyResult<()> {
+    use pyo3::exceptions::PyRuntimeError;
+    use std::time::Duration;
+
+    return crate::client::set_timeouts(
+        connect_timeout.map(Duration::from_secs_f64),
+        read_timeout.map(Duration::from_secs_f64)
+    ).map_err(PyRuntimeError::new_err);
+}
+
+/// Returns every upstream call made since the last call to this, as a list of (endpoint, status, seconds) tuples.
+/// A status of 0 means no response was received.
+#[pyfunction]
+pub fn take_upstream_calls(_py: Python) -> PyObject {
+    let calls : Vec<(&str, u16, f64)> = metrics::take_calls().into_iter()
+        .map(|call| (call.endpoint, call.status, call.seconds))
+        .collect();
+    return PyList::new(_py, calls).into();
+}
+
+use crate::upstream;
+
+/// Sets the limits for one upstream ("steam", "igdb" or "twitch").
+///
+/// With a `state_file`, every process that passes the same file shares one rate limit.
+/// The circuit breaker and concurrency limit are kept per process, and `max_concurrency` also caps the
+/// threads the process makes the upstream's concurrent calls on.
+#[pyfunction]
+pub fn configure_upstream(
+    name: &str,
+    requests_per_second: f64,
+    burst: f64,
+    state_file: Option<String>,
+    failure_threshold: u32,
+    open_seconds: f64,
+    max_concurrency: usize
+) -> PyResult<()> {
+    use pyo3::exceptions::PyValueError;
+    use std::time::Duration;
+
+    let target = upstream::upstream_by_name(name)
+        .ok_or_else(|| PyValueError::new_err(format!("Unknown upstream {}", name)))?;
+
+    return target.configure(upstream::Settings {
+        requests_per_second,
+        burst,
+        state_file,
+        failure_threshold: failure_threshold.max(1),
+        open_duration: Duration::from_secs_f64(open_seconds.max(0.0)),
+        max_concurrency: max_concurrency.max(1),
+    }).map_err(|e| PyValueError::new_err(format!("Couldn't open the rate limit state file for {}: {}", name, e)));
+}
+
+/// Returns the circuit breaker, concurrency limit and rate limiter state of every upstream, as a list of dicts
+#[pyfunction]
+pub fn upstream_states(_py: Python) -> PyResult<PyObject> {
+    let states = PyList::empty(_py);
+    for state in upstream::states() {
+        let obj = PyDict::new(_py);
+        obj.set_item("name", state.name)?;
+        obj.set_item("circuit", state.circuit)?;
+        obj.set_item("consecutive_failures", state.consecutive_failures)?;
+        obj.set_item("circuit_opened", state.circuit_opened)?;
+        obj.set_item("circuit_rejected", state.circuit_rejected)?;
+        obj.set_item("concurrency_limit", state.concurrency_limit)?;
+        obj.set_item("in_flight", state.in_flight)?;
+        obj.set_item("latency_baseline", state.latency_baseline)?;
+        obj.set_item("rate_limit_waited", state.rate_limit_waited)?;
+        states.append(obj)?;
+    }
+    return Ok(states.into());
+}
+
 #[pymodule]
 fn whatcanweplay(py: Python, m: &PyModule) -> PyResult<()> {
     let submod = PyModule::new(py, "igdb")?;
@@ -306,6 +494,11 @@ fn whatcanweplay(py: Python, m: &PyModule) -> PyResult<()> {
     m.add_submodule(submod)?;
 
     m.add_function(wrap_pyfunction!(intersect_owned_games, m)?)?;
+    m.add_function(wrap_pyfunction!(set_api_urls, m)?)?;
+    m.add_function(wrap_pyfunction!(take_upstream_calls, m)?)?;
+    m.add_function(wrap_pyfunction!(set_timeouts, m)?)?;
+    m.add_function(wrap_pyfunction!(configure_upstream, m)?)?;
+    m.add_function(wrap_pyfunction!(upstream_states, m)?)?;
 
     return Ok(());
 }
\ No newline at end of file
@@ -1,6 +1,14 @@
 use serde::{Serialize, Deserialize};
 
-const API_URL: &str = "https://api.steampowered.com/";
+const DEFAULT_API_URL: &str = "https://api.steampowered.com/";
+
+static API_URL: Lazy<RwLock<String>> = Lazy::new(|| RwLock::new(DEFAULT_API_URL.to_string()));
+
+/// Default number of owned games lists fetched from Steam at the same time
+pub const DEFAULT_MAX_CONCURRENCY: usize = 4;
+
+/// Most steamids GetPlayerSummaries accepts in one request
+pub const MAX_SUMMARIES_PER_REQUEST: usize = 100;
 
 #[derive(Debug, Serialize, Deserialize)]
 pub struct SteamUser {
@@ -26,15 +34,31 @@ pub struct SteamUser {
 }
 
 use crate::errors::SteamError;
+use crate::client::{shared_client, normalize_base_url, send_with_retries, Deadline};
+use crate::concurrent::run_concurrently;
+use crate::upstream;
+use crate::appid_set::AppIdSet;
 
 use reqwest;
 use reqwest::{StatusCode, Url};
 
 use std::fmt::Write;
-use std::collections::HashSet;
+use std::collections::HashMap;
+use std::sync::RwLock;
+use once_cell::sync::Lazy;
 
 use serde::de::{self, Deserializer};
 
+/// Points every Steam Web API call at `url` instead of api.steampowered.com, e.g. a local stand-in for benchmarks
+pub fn set_api_url(url: &str) -> Result<(), String> {
+    *API_URL.write().unwrap() = normalize_base_url(url)?;
+    return Ok(());
+}
+
+fn api_url() -> Url {
+    return Url::parse(&API_URL.read().unwrap()).unwrap(); // Validated by set_api_url()
+}
+
 fn bool_from_int<'de, D>(deserializer: D) -> Result<bool, D::Error>
 where
     D: Deserializer<'de>,
@@ -67,11 +91,41 @@ where
     return Err(de::Error::custom(&"expected u64 or stringified u64"));
 }
 
-pub fn get_steam_users_info(webkey: &str, steamids: &[u64]) -> Result<Vec<SteamUser>, SteamError> {
+/// Fetches the player summaries of `steamids`, in chunks of `MAX_SUMMARIES_PER_REQUEST` with up to
+/// `DEFAULT_MAX_CONCURRENCY` chunks requested at once.
+///
+/// Users Steam doesn't know are left out, and the order of the returned users isn't guaranteed.
+pub fn get_steam_users_info(webkey: &str, steamids: &[u64], deadline: Deadline) -> Result<Vec<SteamUser>, SteamError> {
+    if steamids.len() <= MAX_SUMMARIES_PER_REQUEST {
+        return get_steam_users_info_chunk(webkey, steamids, deadline);
+    }
+
+    let mut users = Vec::with_capacity(steamids.len());
+    let chunks : Vec<Vec<u64>> = steamids.chunks(MAX_SUMMARIES_PER_REQUEST).map(|chunk| chunk.to_vec()).collect();
+    let webkey_owned = webkey.to_string();
+    let completed = run_concurrently(
+        upstream::upstream("steam").workers(),
+        chunks,
+        DEFAULT_MAX_CONCURRENCY,
+        move |chunk| get_steam_users_info_chunk(&webkey_owned, &chunk, deadline),
+        |result| -> Result<bool, SteamError> {
+            users.extend(result?);
+            return Ok(true);
+        }
+    )?;
+
+    if !completed {
+        return Err(SteamError::UnknownError("A player summaries fetch thread exited unexpectedly".to_string()));
+    }
+
+    return Ok(users);
+}
+
+fn get_steam_users_info_chunk(webkey: &str, steamids: &[u64], deadline: Deadline) -> Result<Vec<SteamUser>, SteamError> {
     if steamids.is_empty() {
         return Ok(Vec::new());
     }
-    let client = reqwest::blocking::Client::new();
+    let client = shared_client();
     
     let mut id_str = steamids[0].to_string();
 
@@ -80,18 +134,19 @@ pub fn get_steam_users_info(webkey: &str, steamids: &[u64]) -> Result<Vec<SteamU
         write!(&mut id_str, ",{}", n).unwrap();
     }
 
-    let base_url = Url::parse(API_URL).unwrap();
+    let base_url = api_url();
 
-    let response = client.get(base_url.join("ISteamUser/GetPlayerSummaries/v2/").unwrap())
-        .query(&[
-            ("key", webkey),
-            ("format", "json"),
-            ("steamids", &id_str)
-        ])
-        .send();
+    let response = send_with_retries("steam:GetPlayerSummaries", deadline, || {
+        client.get(base_url.join("ISteamUser/GetPlayerSummaries/v2/").unwrap())
+            .query(&[
+                ("key", webkey),
+                ("format", "json"),
+                ("steamids", &id_str)
+            ])
+    });
     
     if let Err(e) = response {
-        return Err(SteamError::UnknownError(e.to_string()));
+        return Err(e.into());
     }
 
     let response = response.unwrap();
@@ -136,21 +191,27 @@ pub fn get_steam_users_info(webkey: &str, steamids: &[u64]) -> Result<Vec<SteamU
 ///
 /// `SteamError::ServerError` is returned if the given steamid does not exist, or if the server had an error processing the request.
 /// (We can't differentiate between the two, they're both returned as 500 status code)
-pub fn get_owned_steam_games(webkey: &str, steamid: u64) -> Result<HashSet<u64>, SteamError> {
-    let base_url = Url::parse(API_URL).unwrap();
-    let client = reqwest::blocking::Client::new();
-
-    let response = client.get(base_url.join("IPlayerService/GetOwnedGames/v0001/").unwrap())
-        .query(&[
-            ("key", webkey),
-            ("steamid", &steamid.to_string()),
-            ("include_appinfo", "false"),
-            ("include_played_free_games", "true"),
-            ("format", "json")
-        ]).send();
+///
+/// `SteamError::GamesListPrivate` is returned if Steam omits the games list entirely, which it does for private profiles.
+///
+/// `SteamError::DeadlineExceeded` is returned if `deadline` passes before Steam responds.
+pub fn get_owned_steam_games(webkey: &str, steamid: u64, deadline: Deadline) -> Result<AppIdSet, SteamError> {
+    let base_url = api_url();
+    let client = shared_client();
+
+    let response = send_with_retries("steam:GetOwnedGames", deadline, || {
+        client.get(base_url.join("IPlayerService/GetOwnedGames/v0001/").unwrap())
+            .query(&[
+                ("key", webkey),
+                ("steamid", &steamid.to_string()),
+                ("include_appinfo", "false"),
+                ("include_played_free_games", "true"),
+                ("format", "json")
+            ])
+    });
     
     if let Err(e) = response {
-        return Err(SteamError::UnknownError(e.to_string()));
+        return Err(e.into());
     }
 
     let response = response.unwrap();
@@ -173,35 +234,54 @@ pub fn get_owned_steam_games(webkey: &str, steamid: u64) -> Result<HashSet<u64>,
 
     let response_json: serde_json::Value = response_json.unwrap();
 
-    let mut app_ids = HashSet::new();
+    if response_json["response"]["game_count"].is_null()
+    { // Public but empty libraries still report a game_count of 0
+        return Err(SteamError::GamesListPrivate(steamid));
+    }
 
     let games_arr = &response_json["response"]["games"];
-    if let Some(games) = games_arr.as_array() {
-        for game in games {
-            let id = &game["appid"];
-            if let Some(id) = id.as_u64() {
-                app_ids.insert(id);
-            }
-        }
-    }
+    let app_ids = match games_arr.as_array() {
+        Some(games) => games.iter().filter_map(|game| game["appid"].as_u64()).collect(),
+        None => AppIdSet::default(),
+    };
 
     return Ok(app_ids);
 }
 
-pub fn get_friend_list(webkey: &str, steamid: u64) -> Result<Vec<SteamUser>, SteamError>
+pub fn get_friend_list(webkey: &str, steamid: u64, deadline: Deadline) -> Result<Vec<SteamUser>, SteamError>
+{
+    let user_ids = get_friend_ids(webkey, steamid, deadline)?;
+
+    if user_ids.is_empty() {
+        return Ok(Vec::new())
+    }
+
+    let friends_info = get_steam_users_info(webkey, &user_ids, deadline)?;
+
+    return Ok(friends_info);
+}
+
+/// Fetches the steamids on the friend list of `steamid`, without their player summaries
+///
+/// # Errors
+///
+/// `SteamError::FriendListPrivate` is returned if the friend list isn't visible.
+pub fn get_friend_ids(webkey: &str, steamid: u64, deadline: Deadline) -> Result<Vec<u64>, SteamError>
 {
-    let base_url = Url::parse(API_URL).unwrap();
-    let client = reqwest::blocking::Client::new();
-    let response = client.get(base_url.join("ISteamUser/GetFriendList/v0001/").unwrap())
-        .query(&[
-            ("key", webkey),
-            ("steamid", &steamid.to_string()),
-            ("relationship", "friend"),
-            ("format", "json")
-        ]).send();
+    let base_url = api_url();
+    let client = shared_client();
+    let response = send_with_retries("steam:GetFriendList", deadline, || {
+        client.get(base_url.join("ISteamUser/GetFriendList/v0001/").unwrap())
+            .query(&[
+                ("key", webkey),
+                ("steamid", &steamid.to_string()),
+                ("relationship", "friend"),
+                ("format", "json")
+            ])
+    });
     
     if let Err(e) = response {
-        return Err(SteamError::UnknownError(e.to_string()));
+        return Err(e.into());
     }
 
     let response = response.unwrap();
@@ -260,44 +340,118 @@ pub fn get_friend_list(webkey: &str, steamid: u64) -> Result<Vec<SteamUser>, Ste
         return Err(SteamError::FriendListPrivate);
     }
 
-    if user_ids.is_empty() {
-        return Ok(Vec::new())
-    }
-
-    let friends_info = get_steam_users_info(webkey, &user_ids)?;
-
-    return Ok(friends_info);
+    return Ok(user_ids);
 }
 
-pub fn intersect_owned_game_ids(webkey: &str, steamids: &[u64])-> Result<HashSet<u64>, SteamError>
+/// Intersects the owned games of the given steamids, starting from `seed` if it is provided.
+///
+/// Games lists are fetched concurrently, with at most `max_concurrency` requests in flight. Each list is
+/// intersected into the result as it arrives, and any outstanding fetches are cancelled as soon as the
+/// result becomes empty.
+///
+/// Returns the intersected app IDs, and the games list of every steamid that was fetched before the
+/// intersection finished.
+///
+/// # Errors
+///
+/// `SteamError::GamesListPrivate` and `SteamError::GamesListEmpty` are returned for the first private
+/// or empty games list that arrives, along with any error from `get_owned_steam_games`.
+pub fn intersect_owned_game_ids_from(webkey: &str, steamids: &[u64], seed: Option<AppIdSet>, max_concurrency: usize, deadline: Deadline) -> Result<(AppIdSet, HashMap<u64, AppIdSet>), SteamError>
 {
-    if steamids.is_empty()
-    {
-        return Ok(HashSet::new());
+    let mut games_set = seed;
+    let mut fetched = HashMap::with_capacity(steamids.len());
+
+    if let Some(games_set) = &games_set {
+        if games_set.is_empty() || steamids.is_empty()
+        {
+            return Ok((games_set.clone(), fetched));
+        }
     }
 
-    let mut games_set = get_owned_steam_games(webkey, steamids[0])?;
+    let webkey_owned = webkey.to_string();
+    let completed = run_concurrently(
+        upstream::upstream("steam").workers(),
+        steamids.to_vec(),
+        max_concurrency,
+        move |steamid| (steamid, get_owned_steam_games(&webkey_owned, steamid, deadline)),
+        |(steamid, result)| -> Result<bool, SteamError> {
+            let next_set = result?;
+            if next_set.is_empty()
+            {
+                return Err(SteamError::GamesListEmpty(steamid));
+            }
+
+            let intersected = match &games_set {
+                Some(games_set) => games_set.intersect(&next_set),
+                None => next_set.clone(),
+            };
+            fetched.insert(steamid, next_set);
+
+            let keep_going = !intersected.is_empty(); // Stop once there are no common owned games
+            games_set = Some(intersected);
+            return Ok(keep_going);
+        }
+    )?;
 
-    if games_set.is_empty()
+    if !completed && games_set.as_ref().map_or(true, |games_set| !games_set.is_empty())
     {
-        return Err(SteamError::GamesListEmpty(steamids[0]));
+        return Err(SteamError::UnknownError("An owned games fetch thread exited unexpectedly".to_string()));
     }
 
-    for &id in steamids[1..].iter() {
-        let next_set = get_owned_steam_games(webkey, id)?;
+    return Ok((games_set.unwrap_or_default(), fetched));
+}
 
-        if next_set.is_empty()
-        {
-            return Err(SteamError::GamesListEmpty(id));
-        }
+pub fn intersect_owned_game_ids(webkey: &str, steamids: &[u64], max_concurrency: usize, deadline: Deadline)-> Result<AppIdSet, SteamError>
+{
+    let (games_set, _) = intersect_owned_game_ids_from(webkey, steamids, None, max_concurrency, deadline)?;
 
-        games_set = &games_set & &next_set; // Intersect the two sets
+    return Ok(games_set);
+}
+
+/// Counts how many users own each game, between the games lists in `known` and those of `steamids`,
+/// and keeps the games owned by at least `min_owners` of them.
+///
+/// If every user has to own a game, this is `intersect_owned_game_ids_from` with `known` as the seed, and stops
+/// fetching as early. Otherwise every games list is fetched, and an empty one just adds no owners.
+///
+/// Returns the `(app ID, owner count)` of every kept game in ascending app ID order, and the games list of
+/// every steamid that was fetched.
+///
+/// # Errors
+///
+/// Same as `intersect_owned_game_ids_from`, except that `SteamError::GamesListEmpty` is only returned
+/// when every user has to own a game.
+pub fn count_game_owners_from(webkey: &str, steamids: &[u64], known: Vec<AppIdSet>, min_owners: usize, max_concurrency: usize, deadline: Deadline) -> Result<(Vec<(u64, usize)>, HashMap<u64, AppIdSet>), SteamError>
+{
+    let total = known.len() + steamids.len();
+    let min_owners = min_owners.max(1);
+
+    if min_owners >= total {
+        let mut known = known.into_iter();
+        let seed = known.next().map(|first| known.fold(first, |games_set, next_set| games_set.intersect(&next_set)));
+        let (games_set, fetched) = intersect_owned_game_ids_from(webkey, steamids, seed, max_concurrency, deadline)?;
+        return Ok((games_set.iter().map(|appid| (appid, total)).collect(), fetched));
+    }
 
-        if games_set.is_empty()
-        { // No common owned games
-            return Ok(HashSet::new());
+    let mut fetched = HashMap::with_capacity(steamids.len());
+    let webkey_owned = webkey.to_string();
+    let completed = run_concurrently(
+        upstream::upstream("steam").workers(),
+        steamids.to_vec(),
+        max_concurrency,
+        move |steamid| (steamid, get_owned_steam_games(&webkey_owned, steamid, deadline)),
+        |(steamid, result)| -> Result<bool, SteamError> {
+            fetched.insert(steamid, result?);
+            return Ok(true);
         }
+    )?;
+
+    if !completed
+    {
+        return Err(SteamError::UnknownError("An owned games fetch thread exited unexpectedly".to_string()));
     }
 
-    return Ok(games_set);
+    let sets : Vec<&AppIdSet> = known.iter().chain(fetched.values()).collect();
+    let owners = AppIdSet::count_owners(&sets, min_owners);
+    return Ok((owners, fetched));
 }
\ No newline at end of file
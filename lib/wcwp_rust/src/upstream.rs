@@ -0,0 +1,506 @@
+use fs2::FileExt;
+use once_cell::sync::Lazy;
+use std::fs::{File, OpenOptions};
+use std::io::{self, Read, Seek, SeekFrom, Write};
+use std::sync::{Condvar, Mutex, RwLock};
+use std::thread;
+use std::time::{Duration, Instant, SystemTime, UNIX_EPOCH};
+
+use crate::client::{Deadline, SendError};
+use crate::concurrent::WorkerPool;
+use crate::igdb;
+
+// Every call to Steam, IGDB or Twitch passes through its upstream's limits here:
+//
+// - A token bucket rate limiter. With a state file, every process that uses the same file shares one bucket.
+// - A circuit breaker, which fails calls fast for a while after too many consecutive failures,
+//   then lets one probe call through to see if the upstream has recovered.
+// - An adaptive concurrency limit, raised slowly while latency stays near its baseline
+//   and cut when latency climbs or the upstream pushes back.
+//
+// The circuit breaker and concurrency limit are per process, and so are the threads that make an upstream's
+// concurrent calls: at most max_concurrency of them, shared by every request.
+
+/// How far above the latency baseline a call can be before the concurrency limit backs off
+const LATENCY_TOLERANCE : f64 = 2.0;
+/// Weight of each new sample in the latency baseline
+const BASELINE_WEIGHT : f64 = 0.05;
+/// Concurrency limit multiplier when latency climbs past the tolerance
+const LATENCY_BACKOFF : f64 = 0.9;
+/// Concurrency limit multiplier when the upstream fails or throttles a call
+const FAILURE_BACKOFF : f64 = 0.5;
+/// Pause for every process sharing a bucket after a 429 without a usable Retry-After
+const DEFAULT_THROTTLE : Duration = Duration::from_secs(1);
+
+#[derive(Clone, Debug)]
+pub struct Settings {
+    /// Sustained request rate, 0 for no limit
+    pub requests_per_second: f64,
+    /// Requests that can be made at once after a quiet period
+    pub burst: f64,
+    /// File the token bucket is kept in, so worker processes share it
+    pub state_file: Option<String>,
+    /// Consecutive failures that open the circuit
+    pub failure_threshold: u32,
+    /// How long the circuit stays open before a probe call is let through
+    pub open_duration: Duration,
+    /// Most calls in flight at once, the adaptive limit stays between 1 and this
+    pub max_concurrency: usize,
+}
+
+/// How a call turned out, as far as the upstream's health is concerned
+pub enum Outcome {
+    /// A response came back that wasn't a 5xx or 429
+    Success(Duration),
+    /// The upstream failed, timed out, or throttled the call
+    Failure,
+    /// The call couldn't tell us anything, e.g. it was cut short by the request's deadline
+    Cancelled,
+}
+
+#[derive(Clone, Copy, PartialEq, Debug)]
+enum CircuitState {
+    Closed,
+    Open(Instant),
+    HalfOpen { probing: bool },
+}
+
+struct Breaker {
+    state: CircuitState,
+    consecutive_failures: u32,
+    opened: u64,
+    rejected: u64,
+}
+
+struct Concurrency {
+    limit: f64,
+    in_flight: usize,
+    latency_baseline: Option<f64>,
+}
+
+struct Bucket {
+    file: Option<File>,
+    tokens: f64,
+    updated: f64,
+    blocked_until: f64,
+    waited: f64,
+}
+
+pub struct Upstream {
+    name: &'static str,
+    settings: RwLock<Settings>,
+    bucket: Mutex<Bucket>,
+    breaker: Mutex<Breaker>,
+    concurrency: Mutex<Concurrency>,
+    slot_freed: Condvar,
+    workers: WorkerPool,
+}
+
+/// A call's place under its upstream's concurrency limit, released when dropped
+pub struct Permit<'a> {
+    upstream: &'a Upstream,
+    finished: bool,
+    holds_slot: bool,
+}
+
+/// Monitoring snapshot of one upstream
+pub struct UpstreamState {
+    pub name: &'static str,
+    pub circuit: &'static str,
+    pub consecutive_failures: u32,
+    pub circuit_opened: u64,
+    pub circuit_rejected: u64,
+    pub concurrency_limit: usize,
+    pub in_flight: usize,
+    pub latency_baseline: Option<f64>,
+    pub rate_limit_waited: f64,
+}
+
+fn unix_now() -> f64 {
+    return SystemTime::now().duration_since(UNIX_EPOCH).map_or(0.0, |now| now.as_secs_f64());
+}
+
+impl Upstream {
+    fn new(name: &'static str, requests_per_second: f64, burst: f64, max_concurrency: usize) -> Upstream {
+        return Upstream {
+            name,
+            settings: RwLock::new(Settings {
+                requests_per_second,
+                burst,
+                state_file: None,
+                failure_threshold: 5,
+                open_duration: Duration::from_secs(30),
+                max_concurrency,
+            }),
+            bucket: Mutex::new(Bucket { file: None, tokens: burst, updated: 0.0, blocked_until: 0.0, waited: 0.0 }),
+            breaker: Mutex::new(Breaker { state: CircuitState::Closed, consecutive_failures: 0, opened: 0, rejected: 0 }),
+            concurrency: Mutex::new(Concurrency { limit: max_concurrency as f64, in_flight: 0, latency_baseline: None }),
+            slot_freed: Condvar::new(),
+            workers: WorkerPool::new(name, max_concurrency),
+        };
+    }
+
+    pub fn configure(&self, settings: Settings) -> io::Result<()> {
+        let file = match &settings.state_file {
+            Some(path) => Some(OpenOptions::new().read(true).write(true).create(true).open(path)?),
+            None => None,
+        };
+
+        {
+            let mut bucket = self.bucket.lock().unwrap();
+            bucket.file = file;
+            bucket.tokens = settings.burst;
+            bucket.updated = 0.0;
+        }
+        self.concurrency.lock().unwrap().limit = settings.max_concurrency.max(1) as f64;
+        self.workers.set_max_threads(settings.max_concurrency);
+        *self.settings.write().unwrap() = settings;
+        return Ok(());
+    }
+
+    /// Waits for this upstream's rate and concurrency limits, and checks its circuit breaker.
+    ///
+    /// Returns `SendError::Unavailable` if the circuit is open, or `SendError::DeadlineExceeded` if
+    /// the deadline would pass before the call could be made.
+    pub fn acquire(&self, deadline: Deadline) -> Result<Permit, SendError> {
+        let settings = self.settings.read().unwrap().clone();
+
+        if !self.breaker.lock().unwrap().allow(Instant::now()) {
+            return Err(SendError::Unavailable);
+        }
+        // From here on, an early return drops the permit, which hands back a half-open probe
+        let mut permit = Permit { upstream: self, finished: false, holds_slot: false };
+
+        self.wait_for_token(&settings, deadline)?;
+
+        let mut concurrency = self.concurrency.lock().unwrap();
+        while concurrency.in_flight >= concurrency.limit as usize {
+            concurrency = match deadline.remaining() {
+                None => self.slot_freed.wait(concurrency).unwrap(),
+                Some(remaining) if remaining == Duration::from_secs(0) => return Err(SendError::DeadlineExceeded),
+                Some(remaining) => self.slot_freed.wait_timeout(concurrency, remaining).unwrap().0,
+            };
+        }
+        concurrency.in_flight += 1;
+        permit.holds_slot = true;
+        return Ok(permit);
+    }
+
+    fn wait_for_token(&self, settings: &Settings, deadline: Deadline) -> Result<(), SendError> {
+        if settings.requests_per_second <= 0.0 {
+            return Ok(());
+        }
+
+        loop {
+            let wait = {
+                let mut bucket = self.bucket.lock().unwrap();
+                let wait = match bucket.take(settings, unix_now()) {
+                    Ok(wait) => wait,
+                    Err(_) => {
+                        bucket.file = None; // Keep limiting within this process rather than not at all
+                        bucket.take(settings, unix_now()).unwrap_or(0.0)
+                    }
+                };
+                if wait > 0.0 {
+                    bucket.waited += wait;
+                }
+                wait
+            };
+
+            if wait <= 0.0 {
+                return Ok(());
+            }
+
+            let wait = Duration::from_secs_f64(wait);
+            if deadline.remaining().map_or(false, |remaining| wait >= remaining) {
+                return Err(SendError::DeadlineExceeded);
+            }
+            thread::sleep(wait);
+        }
+    }
+
+    /// Stops every process sharing this upstream's bucket from sending anything for `duration`
+    pub fn throttle(&self, duration: Option<Duration>) {
+        let until = unix_now() + duration.unwrap_or(DEFAULT_THROTTLE).as_secs_f64();
+        let settings = self.settings.read().unwrap().clone();
+        let mut bucket = self.bucket.lock().unwrap();
+        if bucket.block_until(&settings, until).is_err() {
+            bucket.file = None;
+            let _ = bucket.block_until(&settings, until);
+        }
+    }
+
+    /// Threads for running several of this upstream's calls at once, with `concurrent::run_concurrently`
+    pub fn workers(&self) -> &WorkerPool {
+        return &self.workers;
+    }
+
+    pub fn state(&self) -> UpstreamState {
+        let (circuit, consecutive_failures, circuit_opened, circuit_rejected) = {
+            let breaker = self.breaker.lock().unwrap();
+            let circuit = match breaker.state {
+                CircuitState::Closed => "closed",
+                CircuitState::Open(_) => "open",
+                CircuitState::HalfOpen { .. } => "half_open",
+            };
+            (circuit, breaker.consecutive_failures, breaker.opened, breaker.rejected)
+        };
+        let (concurrency_limit, in_flight, latency_baseline) = {
+            let concurrency = self.concurrency.lock().unwrap();
+            (concurrency.limit as usize, concurrency.in_flight, concurrency.latency_baseline)
+        };
+        let rate_limit_waited = self.bucket.lock().unwrap().waited;
+
+        return UpstreamState {
+            name: self.name,
+            circuit,
+            consecutive_failures,
+            circuit_opened,
+            circuit_rejected,
+            concurrency_limit,
+            in_flight,
+            latency_baseline,
+            rate_limit_waited,
+        };
+    }
+}
+
+impl<'a> Permit<'a> {
+    /// Feeds how the call went into the circuit breaker and concurrency limit
+    pub fn finish(mut self, outcome: Outcome) {
+        self.finished = true;
+        let settings = self.upstream.settings.read().unwrap().clone();
+        let max_concurrency = settings.max_concurrency.max(1) as f64;
+
+        // Locks are taken one at a time, never nested, so state() can't deadlock against this
+        match outcome {
+            Outcome::Success(latency) => {
+                let latency = latency.as_secs_f64();
+                {
+                    let mut concurrency = self.upstream.concurrency.lock().unwrap();
+                    let baseline = concurrency.latency_baseline.unwrap_or(latency);
+                    if latency > baseline * LATENCY_TOLERANCE {
+                        concurrency.limit = (concurrency.limit * LATENCY_BACKOFF).max(1.0);
+                    } else {
+                        // Additive increase, about one more slot for every `limit` calls that go well
+                        concurrency.limit = (concurrency.limit + 1.0 / concurrency.limit).min(max_concurrency);
+                    }
+                    concurrency.latency_baseline = Some(baseline + (latency - baseline) * BASELINE_WEIGHT);
+                }
+                self.upstream.breaker.lock().unwrap().record(false, &settings);
+            },
+            Outcome::Failure => {
+                {
+                    let mut concurrency = self.upstream.concurrency.lock().unwrap();
+                    concurrency.limit = (concurrency.limit * FAILURE_BACKOFF).max(1.0);
+                }
+                self.upstream.breaker.lock().unwrap().record(true, &settings);
+            },
+            Outcome::Cancelled => {
+                self.upstream.breaker.lock().unwrap().cancel_probe();
+            },
+        }
+    }
+}
+
+impl<'a> Drop for Permit<'a> {
+    fn drop(&mut self) {
+        if !self.finished {
+            self.upstream.breaker.lock().unwrap().cancel_probe();
+        }
+
+        if self.holds_slot {
+            let mut concurrency = self.upstream.concurrency.lock().unwrap();
+            concurrency.in_flight = concurrency.in_flight.saturating_sub(1);
+            self.upstream.slot_freed.notify_one();
+        }
+    }
+}
+
+impl Breaker {
+    fn allow(&mut self, now: Instant) -> bool {
+        match self.state {
+            CircuitState::Closed => return true,
+            CircuitState::Open(until) if now >= until => {
+                self.state = CircuitState::HalfOpen { probing: true };
+                return true;
+            },
+            CircuitState::HalfOpen { probing: false } => {
+                self.state = CircuitState::HalfOpen { probing: true };
+                return true;
+            },
+            _ => {
+                self.rejected += 1;
+                return false;
+            },
+        }
+    }
+
+    fn record(&mut self, failed: bool, settings: &Settings) {
+        if !failed {
+            self.consecutive_failures = 0;
+            self.state = CircuitState::Closed;
+            return;
+        }
+
+        self.consecutive_failures += 1;
+        let probe_failed = match self.state { CircuitState::HalfOpen { .. } => true, _ => false };
+        if probe_failed || (self.state == CircuitState::Closed && self.consecutive_failures >= settings.failure_threshold) {
+            self.state = CircuitState::Open(Instant::now() + settings.open_duration);
+            self.opened += 1;
+        }
+    }
+
+    /// Lets another call probe a half-open circuit, when the last probe ended without telling us anything
+    fn cancel_probe(&mut self) {
+        if self.state == (CircuitState::HalfOpen { probing: true }) {
+            self.state = CircuitState::HalfOpen { probing: false };
+        }
+    }
+}
+
+impl Bucket {
+    /// Takes a token if one is available. Returns 0, or how many seconds to wait before trying again.
+    fn take(&mut self, settings: &Settings, now: f64) -> io::Result<f64> {
+        return self.update(settings, |bucket| {
+            if now < bucket.blocked_until {
+                return bucket.blocked_until - now;
+            }
+
+            let elapsed = if bucket.updated > 0.0 { (now - bucket.updated).max(0.0) } else { f64::INFINITY };
+            bucket.tokens = (bucket.tokens + elapsed * settings.requests_per_second).min(settings.burst.max(1.0));
+            bucket.updated = now;
+
+            if bucket.tokens >= 1.0 {
+                bucket.tokens -= 1.0;
+                return 0.0;
+            }
+            return (1.0 - bucket.tokens) / settings.requests_per_second;
+        });
+    }
+
+    fn block_until(&mut self, settings: &Settings, until: f64) -> io::Result<f64> {
+        return self.update(settings, |bucket| {
+            bucket.blocked_until = bucket.blocked_until.max(until);
+            return 0.0;
+        });
+    }
+
+    /// Runs `change` on the bucket's state, reading it from and writing it back to the state file
+    /// under an exclusive lock if there is one
+    fn update<F>(&mut self, settings: &Settings, change: F) -> io::Result<f64>
+    where
+        F: FnOnce(&mut Bucket) -> f64
+    {
+        let file = match self.file.take() {
+            Some(file) => file,
+            None => return Ok(change(self)),
+        };
+
+        file.lock_exclusive()?;
+        let result = (|| -> io::Result<f64> {
+            let mut state = [0u8; 24];
+            (&file).seek(SeekFrom::Start(0))?;
+            let read = (&file).read(&mut state)?;
+            if read == state.len() {
+                self.tokens = f64::from_le_bytes([state[0], state[1], state[2], state[3], state[4], state[5], state[6], state[7]]);
+                self.updated = f64::from_le_bytes([state[8], state[9], state[10], state[11], state[12], state[13], state[14], state[15]]);
+                self.blocked_until = f64::from_le_bytes([state[16], state[17], state[18], state[19], state[20], state[21], state[22], state[23]]);
+            } else {
+                // New file, start full
+                self.tokens = settings.burst;
+                self.updated = 0.0;
+                self.blocked_until = 0.0;
+            }
+
+            let wait = change(self);
+
+            state[0..8].copy_from_slice(&self.tokens.to_le_bytes());
+            state[8..16].copy_from_slice(&self.updated.to_le_bytes());
+            state[16..24].copy_from_slice(&self.blocked_until.to_le_bytes());
+            (&file).seek(SeekFrom::Start(0))?;
+            (&file).write_all(&state)?;
+            return Ok(wait);
+        })();
+        let unlocked = file.unlock();
+        self.file = Some(file);
+
+        let wait = result?;
+        unlocked?;
+        return Ok(wait);
+    }
+}
+
+static STEAM : Lazy<Upstream> = Lazy::new(|| Upstream::new("steam", 10.0, 20.0, 16));
+static IGDB : Lazy<Upstream> = Lazy::new(|| {
+    let per_second = igdb::REQUESTS_PER_SECOND as f64;
+    return Upstream::new("igdb", per_second, per_second, 8); // IGDB also allows up to 8 open requests
+});
+static TWITCH : Lazy<Upstream> = Lazy::new(|| Upstream::new("twitch", 1.0, 2.0, 2));
+
+/// The upstream an endpoint name like "steam:GetOwnedGames" belongs to
+pub fn upstream(endpoint: &str) -> &'static Upstream {
+    match endpoint.split(':').next() {
+        Some("igdb") => return &IGDB,
+        Some("twitch") => return &TWITCH,
+        _ => return &STEAM,
+    }
+}
+
+pub fn upstream_by_name(name: &str) -> Option<&'static Upstream> {
+    match name {
+        "steam" => return Some(&STEAM),
+        "igdb" => return Some(&IGDB),
+        "twitch" => return Some(&TWITCH),
+        _ => return None,
+    }
+}
+
+pub fn states() -> Vec<UpstreamState> {
+    return vec![STEAM.state(), IGDB.state(), TWITCH.state()];
+}
+
+#[cfg(test)]
+fn test_settings() -> Settings {
+    return Settings {
+        requests_per_second: 2.0,
+        burst: 2.0,
+        state_file: None,
+        failure_threshold: 2,
+        open_duration: Duration::from_secs(60),
+        max_concurrency: 4,
+    };
+}
+
+#[test]
+fn bucket_refills() {
+    let settings = test_settings();
+    let mut bucket = Bucket { file: None, tokens: 2.0, updated: 0.0, blocked_until: 0.0, waited: 0.0 };
+
+    assert_eq!(bucket.take(&settings, 100.0).unwrap(), 0.0);
+    assert_eq!(bucket.take(&settings, 100.0).unwrap(), 0.0);
+    assert!((bucket.take(&settings, 100.0).unwrap() - 0.5).abs() < 1e-9);
+    assert_eq!(bucket.take(&settings, 100.5).unwrap(), 0.0);
+
+    bucket.block_until(&settings, 200.0).unwrap();
+    assert!((bucket.take(&settings, 150.0).unwrap() - 50.0).abs() < 1e-9);
+}
+
+#[test]
+fn breaker_opens_and_probes() {
+    let settings = test_settings();
+    let mut breaker = Breaker { state: CircuitState::Closed, consecutive_failures: 0, opened: 0, rejected: 0 };
+
+    breaker.record(true, &settings);
+    assert!(breaker.allow(Instant::now()));
+    breaker.record(true, &settings);
+    assert!(!breaker.allow(Instant::now()));
+
+    // Once the open period is over, exactly one probe goes through
+    let later = Instant::now() + settings.open_duration;
+    assert!(breaker.allow(later));
+    assert!(!breaker.allow(later));
+    breaker.record(false, &settings);
+    assert!(breaker.allow(Instant::now()));
+    assert_eq!(breaker.opened, 1);
+}
@@ -0,0 +1,86 @@
+# This file is a part of WhatCanWePlay
+# Copyright (C) 2020 TGRCDev
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from collections import OrderedDict
+from datetime import timezone, datetime
+import threading
+
+def now_timestamp():
+    return datetime.now(timezone.utc).timestamp()
+
+# Thread-safe, size-bounded LRU where every entry carries its own expiry timestamp.
+# Values are handed out as-is, so callers must not mutate them.
+class LRUCache:
+    def __init__(self, max_entries):
+        self.max_entries = max(0, max_entries)
+        self.entries = OrderedDict() # key -> (expiry, value)
+        self.lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    # Returns the value for key, or default if it is missing or expired
+    def get(self, key, default=None, now=None):
+        now = now or now_timestamp()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            if now >= entry[0]:
+                del self.entries[key]
+                return default
+            self.entries.move_to_end(key)
+            return entry[1]
+    
+    # returns {key: value} for every key that is cached and unexpired
+    def get_many(self, keys, now=None):
+        now = now or now_timestamp()
+        found = {}
+        with self.lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is None:
+                    continue
+                if now >= entry[0]:
+                    del self.entries[key]
+                    continue
+                self.entries.move_to_end(key)
+                found[key] = entry[1]
+        return found
+    
+    def set(self, key, value, expiry):
+        self.set_many({key: value}, expiry)
+    
+    # expiry is either one timestamp for every item, or a dict of key -> timestamp
+    def set_many(self, items, expiry):
+        if self.max_entries <= 0:
+            return
+        
+        with self.lock:
+            for key, value in items.items():
+                self.entries[key] = (expiry[key] if isinstance(expiry, dict) else expiry, value)
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False) # Evict the least recently used entry
+    
+    def pop(self, key, default=None):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            return default if entry is None else entry[1]
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
@@ -0,0 +1,137 @@
+# This file is a part of WhatCanWePlay
+# Copyright (C) 2020 TGRCDev
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from contextlib import contextmanager
+import threading, time
+
+# Minimal Prometheus text exposition, so the site doesn't need prometheus_client.
+# Metrics are per process, so each uWSGI worker reports its own numbers.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"' % (name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for name, value in pairs
+    )
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+class Counter:
+    type_name = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {} # label values -> count
+        self.lock = threading.Lock()
+    
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+    
+    def samples(self):
+        with self.lock:
+            return [(self.name, format_labels(self.labelnames, key), value) for key, value in sorted(self.values.items())]
+
+class Histogram:
+    type_name = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self.values = {} # label values -> [bucket counts..., sum]
+        self.lock = threading.Lock()
+    
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * len(self.buckets) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-1] += value
+    
+    # Observes how long the with block takes, in seconds
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+    
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, counts in sorted(self.values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    samples.append((self.name + "_bucket", format_labels(self.labelnames, key, [("le", format_value(bound))]), count))
+                samples.append((self.name + "_count", format_labels(self.labelnames, key), counts[len(self.buckets) - 1]))
+                samples.append((self.name + "_sum", format_labels(self.labelnames, key), counts[-1]))
+        return samples
+
+# Reports values that are kept somewhere else, read when the metrics are rendered.
+# collect() returns [(label values, value)]
+class CallbackMetric:
+    def __init__(self, name, help_text, type_name, labelnames, collect):
+        self.name = name
+        self.help_text = help_text
+        self.type_name = type_name
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+    
+    def samples(self):
+        return [(self.name, format_labels(self.labelnames, key), value) for key, value in self.collect()]
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+    
+    def counter(self, name, help_text, labelnames=()):
+        return self.register(Counter(name, help_text, labelnames))
+    
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+    
+    def callback(self, name, help_text, type_name, labelnames, collect):
+        return self.register(CallbackMetric(name, help_text, type_name, labelnames, collect))
+    
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+    
+    # Renders every metric in the Prometheus text format
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append("# HELP %s %s" % (metric.name, metric.help_text))
+            lines.append("# TYPE %s %s" % (metric.name, metric.type_name))
+            for name, labels, value in metric.samples():
+                lines.append("%s%s %s" % (name, labels, format_value(value)))
+        return "\n".join(lines) + "\n"
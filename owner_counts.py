@@ -0,0 +1,46 @@
+# This file is a part of WhatCanWePlay
+# Copyright (C) 2020 TGRCDev
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Owner counts of a group of users: how many of them own each game that any of them owns.
+# They're kept as (array of appids in ascending order, array of owner counts, frozenset of users with no games),
+# so a group that adds or removes a few users can be counted from an earlier one without refetching everyone.
+
+from array import array
+from collections import Counter
+from itertools import chain
+
+# Counts for a group from the counts of its base group, and the owned appids of the users added and removed
+def apply_owner_delta(counted, added, removed):
+    appids, counts, empty_users = counted
+    owners = dict(zip(appids, counts))
+    for owned in added.values():
+        for appid in owned:
+            owners[appid] = owners.get(appid, 0) + 1
+    for owned in removed.values():
+        for appid in owned:
+            owners[appid] = owners.get(appid, 0) - 1
+
+    empty_users = empty_users.difference(removed).union(steamid for steamid, owned in added.items() if not owned)
+    return owner_arrays({appid: count for appid, count in owners.items() if count > 0}, empty_users)
+
+# Counts for a group from scratch, from {steam_id: owned appids} for every user in it
+def count_owners(owned):
+    owners = Counter(chain.from_iterable(owned.values()))
+    return owner_arrays(owners, frozenset(steamid for steamid, appids in owned.items() if not appids))
+
+def owner_arrays(owners, empty_users):
+    appids = array("Q", sorted(owners))
+    return appids, array("H", [owners[appid] for appid in appids]), empty_users
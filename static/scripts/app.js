@@ -38,6 +38,11 @@ var fetching = false;
 
 var main_user_id = 0;
 
+var max_group_size = 10;
+
+// Token and selection of the last intersection, so the next one can send only the users added and removed
+var last_intersection = null;
+
 window.addEventListener("load", function() {
     submit = document.getElementById("submit-button");
     submit.addEventListener("click", submitButtonClicked);
@@ -50,6 +55,7 @@ window.addEventListener("load", function() {
     error_div = document.getElementById("error-div")
     error_info = document.getElementById("error-info")
     default_avatar_url = friends.dataset.defaultAvatar;
+    max_group_size = parseInt(friends.dataset.maxGroupSize) || max_group_size;
     main_user = document.getElementById("main-user");
     user_template = main_user.cloneNode(true);
     this.user_template.id = "";
@@ -155,9 +161,8 @@ function submitButtonClicked()
         600);
     }
 
-    body = {
-        steamids: Array.from(selected_users)
-    }
+    var sent_users = new Set(selected_users);
+    body = intersectBody(sent_users);
 
     Array.from(games.children).forEach(function(child) { // Clear old results
         if(child.id != "error-div")
@@ -167,14 +172,13 @@ function submitButtonClicked()
     });
 
     games_fetch = timeout(fetch(
-        "/api/v1/intersect_owned_games", {
+        "/api/v2/intersect_owned_games", {
             method: "post",
             body: JSON.stringify(body)
         }
     ), 30000)
 
-    games_fetch.then((response) => response.json())
-    .then(intersectResponse)
+    games_fetch.then((response) => readIntersectStream(response, sent_users))
     .catch(apiError)
     .finally(function() {
         submit.disabled = false;
@@ -186,7 +190,103 @@ function submitButtonClicked()
     })
 }
 
-function intersectResponse(data) {
+// Builds an intersection request for users, sending only the changes
+// from the last intersection if there was one
+function intersectBody(users)
+{
+    if(last_intersection)
+    {
+        var added = Array.from(users).filter((steamid) => !last_intersection.users.has(steamid));
+        var removed = Array.from(last_intersection.users).filter((steamid) => !users.has(steamid));
+        return {
+            token: last_intersection.token,
+            add: added,
+            remove: removed
+        }
+    }
+
+    return {
+        steamids: Array.from(users)
+    }
+}
+
+// Reads the newline-delimited JSON records of /api/v2/intersect_owned_games,
+// rendering each batch of games as soon as it arrives
+function readIntersectStream(response, users)
+{
+    var state = {received: 0, finished: false, users: users};
+    var buffered = "";
+
+    function handleText(text, final)
+    {
+        buffered += text;
+        var lines = buffered.split("\n");
+        buffered = final ? "" : lines.pop(); // Keep any partial record for the next read
+
+        lines.forEach(function(line) {
+            if(line.trim() == "" || state.finished)
+            {
+                return;
+            }
+            intersectRecord(JSON.parse(line), state);
+        });
+    }
+
+    if(!response.body || !window.TextDecoder)
+    { // No streaming support, handle the whole body at once
+        return response.text().then((text) => handleText(text, true));
+    }
+
+    var reader = response.body.getReader();
+    var decoder = new TextDecoder();
+
+    function pump()
+    {
+        return reader.read().then(function(result) {
+            if(result.done)
+            {
+                handleText(decoder.decode(), true);
+                return;
+            }
+            handleText(decoder.decode(result.value, {stream: true}), false);
+            return pump();
+        });
+    }
+
+    return pump();
+}
+
+function intersectRecord(data, state)
+{
+    if("games" in data)
+    {
+        state.received += data["games"].length;
+        renderGames(data["games"]);
+        return;
+    }
+
+    // Anything else is the last record
+    state.finished = true;
+
+    if(intersectError(data))
+    {
+        last_intersection = null; // Start over next time, in case the token was the problem
+        return;
+    }
+
+    if(data["token"])
+    {
+        last_intersection = {token: data["token"], users: state.users};
+    }
+
+    if(state.received == 0)
+    {
+        displayError("Looks like these users don't have any games shared between all of them.")
+    }
+}
+
+// Displays the error in an intersection response, if there is one
+function intersectError(data) {
     if(data["errcode"] == 1)
     { // User has non-visible games list
         displayError("WhatCanWePlay cannot access the games list of <span class='err-user-name'>" + user_info[data["user"]]["screen_name"] + "</span>. This either means that their Game details visibility is not Public, or they are being rate-limited by Steam for having too many requests. You can try one of the following fixes:\
@@ -194,142 +294,108 @@ function intersectResponse(data) {
         <br>- Remove <span class='err-user-name'>" + user_info[data["user"]]["screen_name"] + "</span> from your selected users\
         <br>- Try again later\
         ");
-        return;
+        return true;
     }
     else if(data["errcode"] == 2)
     { // User has empty games list
         displayError("<span class='err-user-name'>" + user_info[data["user"]]["screen_name"] + "</span> has an empty games list, and cannot possibly share any common games with the selected users. Please deselect <span class='err-user-name'>" + user_info[data["user"]]["screen_name"] + "</span> and try again.")
-        return;
+        return true;
     }
     else if(data["errcode"] != 0)
     {
         displayError(data["message"]);
-        return;
+        return true;
     }
-    else
+
+    return false;
+}
+
+// This is intentionally a weak sort. It sorts games into three sections in descending order:
+//
+// 0 (Top): Games with supported user counts above the selected user count (intentionally unordered)
+// 1 (Middle): Games with unknown supported user counts, sent as 0 (Could be above, could be below?)
+// 2 (Bottom): Games below the selected user count
+//
+// The Top section is intentionally unsorted because we aren't looking for games with the highest
+// player count, we're looking for a game to play with friends.
+//
+// The server sorts and filters by the same sections in player_bucket (game_view.py), so keep them in step.
+function gameSection(game)
+{
+    var players = parseInt(game["supported_players"]) || 0;
+
+    if(players <= 0)
+    {
+        return 1;
+    }
+    else if(players < selected_users.size)
     {
-        gameinfo = Array.from(data["games"])
+        return 2;
+    }
+    return 0;
+}
 
-        if(gameinfo.length == 0)
+// Renders a batch of games, slotting each one in at the end of its section
+// so the list stays sorted as batches arrive
+function renderGames(gameinfo)
+{
+    gameinfo.forEach(function(game) {
+        if(!game["name"])
         {
-            displayError("Looks like these users don't have any games shared between all of them.")
+            return;
         }
 
-        // Sort data
-        // TODO: Filter options
-        gameinfo.sort(function(a, b) {
-            // This is intentionally a weak sort. It sorts games into three sections in descending order:
-            //
-            // Top: Games with supported user counts above the selected user count (intentionally unordered)
-            // Middle: Games with unknown supported user counts (Could be above, could be below?)
-            // Bottom: Games below the selected user count
-            //
-            // The Top section is intentionally unsorted because we aren't looking for games with the highest
-            // player count, we're looking for a game to play with friends.
-            a_val = a["supported_players"]
-            b_val = b["supported_players"]
-
-            a_compval = (a_val == "?" ? selected_users.size : parseInt(a_val))
-            b_compval = (b_val == "?" ? selected_users.size : parseInt(b_val))
-
-            if(a_val == "?")
-            {
-                if(b_val == "?")
-                {
-                    return 0;
-                }
-                else if(b_compval < selected_users.size)
-                {
-                    return -1;
-                }
-                else
-                {
-                    return 1;
-                }
-            }
-            else if(b_val == "?")
-            {
-                if(a_compval < selected_users.size)
-                {
-                    return 1;
-                }
-                else
-                {
-                    return -1;
-                }
-            }
-            else
+        gamediv = game_template.cloneNode(true);
+        Array.from(gamediv.children).forEach(function(child) {
+            switch(child.className)
             {
-                if(a_compval < selected_users.size)
-                {
-                    if(b_compval < selected_users.size)
+                case "game-cover":
+                    if(game["cover_id"])
                     {
-                        return 0;
+                        child.src = "https://images.igdb.com/igdb/image/upload/t_cover_small/" + game["cover_id"] + ".jpg"
                     }
-                    else
+                    break;
+                case "game-title":
+                    child.innerText = game["name"]
+                    if("owners" in game)
                     {
-                        return 1;
+                        child.title = "Owned by " + game["owners"] + " of the selected users"
                     }
-                }
-                else if(b_compval < selected_users.size)
-                {
-                    return -1;
-                }
-                else
-                {
-                    return 0;
-                }
-            }
-        })
-
-        gameinfo.forEach(function(game) { // Render new results
-            if(!game["name"])
-            {
-                return;
-            }
-
-            gamediv = game_template.cloneNode(true);
-            Array.from(gamediv.children).forEach(function(child) {
-                switch(child.className)
-                {
-                    case "game-cover":
-                        if(game["cover_id"])
+                    break;
+                case "user-count":
+                    Array.from(child.children).forEach(function(child) {
+                        if(child.className == "user-number")
                         {
-                            child.src = "https://images.igdb.com/igdb/image/upload/t_cover_small/" + game["cover_id"] + ".jpg"
-                        }
-                        break;
-                    case "game-title":
-                        child.innerText = game["name"]
-                        break;
-                    case "user-count":
-                        Array.from(child.children).forEach(function(child) {
-                            if(child.className == "user-number")
+                            child.innerText = game["supported_players"]
+                            if(game["supported_players"] == "0")
                             {
-                                child.innerText = game["supported_players"]
-                                if(game["supported_players"] == "0")
-                                {
-                                    child.innerText = "?"
-                                    child.classList.add("short")
-                                    child.title = "WhatCanWePlay was unable to retrieve the player count for this game from the IGDB"
-                                }
-                                else if(game["supported_players"] == "1")
-                                {
-                                    child.classList.add("short")
-                                    child.title = "This game is singleplayer"
-                                }
-                                else if(game["supported_players"] < selected_users.size)
-                                {
-                                    child.classList.add("short")
-                                    child.title = "This game has less supported users than the number of selected users"
-                                }
+                                child.innerText = "?"
+                                child.classList.add("short")
+                                child.title = "WhatCanWePlay was unable to retrieve the player count for this game from the IGDB"
                             }
-                        });
-                        break;
-                }
-            });
-            games.appendChild(gamediv)
+                            else if(game["supported_players"] == "1")
+                            {
+                                child.classList.add("short")
+                                child.title = "This game is singleplayer"
+                            }
+                            else if(game["supported_players"] < selected_users.size)
+                            {
+                                child.classList.add("short")
+                                child.title = "This game has less supported users than the number of selected users"
+                            }
+                        }
+                    });
+                    break;
+            }
         });
-    }
+
+        var section = gameSection(game);
+        gamediv.dataset.section = section;
+        var next_section = section == 0 ? games.querySelector("[data-section='1'], [data-section='2']")
+            : section == 1 ? games.querySelector("[data-section='2']")
+            : null;
+        games.insertBefore(gamediv, next_section);
+    });
 }
 
 function displayError(message) {
@@ -473,14 +539,14 @@ function userCheckboxClicked(box)
             }
             else
             {
-                if(selected_users.size < 10)
+                if(selected_users.size < max_group_size)
                 {
                     fill.style.display = "block"
                     selected_users.add(steamid)
                 }
                 else
                 {
-                    alert("Only 10 users can be intersected at a time.")
+                    alert("Only " + max_group_size + " users can be intersected at a time.")
                 }
             }
 
@@ -0,0 +1,98 @@
+# This file is a part of WhatCanWePlay
+# Copyright (C) 2020 TGRCDev
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Tests for the site's modules that don't need the rust library. Run with `python -m pytest tests`.
+#
+# Importing the package runs __init__.py, which loads the rust library, so the modules are imported
+# from a bare "whatcanweplay" package pointing at the repository instead.
+# pytest also imports the package the tests are in before running them, by the name of its directory,
+# so that name gets the bare package too.
+#
+# Tests of the routes get the whole site from the `site` fixture instead, loaded under its own name
+# with tests/fake_rust_lib.py in place of the rust library, and an app from `make_app`.
+
+import importlib.util, json, os, sys, threading, types
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+package = types.ModuleType("whatcanweplay")
+package.__path__ = [ROOT]
+sys.modules.setdefault("whatcanweplay", package)
+sys.modules.setdefault(os.path.basename(ROOT), package)
+
+@pytest.fixture(scope="session")
+def site():
+    import fake_rust_lib
+
+    name = "wcwp_site"
+    for module_name in (name + ".lib", name + ".lib.bin"):
+        module = types.ModuleType(module_name)
+        module.__path__ = []
+        sys.modules[module_name] = module
+    sys.modules[name + ".lib.bin"].whatcanweplay = fake_rust_lib
+    sys.modules[name + ".lib.bin.whatcanweplay"] = fake_rust_lib
+
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, "__init__.py"), submodule_search_locations=[ROOT])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+# make_app(**config) creates an app from the few config keys it needs, plus any given, with its files in tmp_path
+@pytest.fixture
+def make_app(site, tmp_path):
+    import fake_rust_lib
+    fake_rust_lib.calls.clear()
+    fake_rust_lib.fetched.clear()
+    fake_rust_lib.game_info_requests.clear()
+    fake_rust_lib.twitch_down = False
+    fake_rust_lib.token_requests = 0
+
+    def make(**config):
+        config = dict({
+            "steam-key": "steam",
+            "igdb-client-id": "igdb",
+            "igdb-secret": "igdb",
+            "contact-email": "contact@example.com",
+            "secret-key": "secret",
+            "cookie-max-age": {"days": 1},
+            "commit-hash-file": str(tmp_path / "commit-hash"),
+        }, **config)
+        config_path = tmp_path / "config.json"
+        config_path.write_text(json.dumps(config))
+        return site.create_app(str(config_path))
+
+    return make
+
+# redis_server(*args) starts tests/mock_redis.py on a free port, taking its command line arguments.
+# The server's MockRedis is its .redis, and its url is .url
+@pytest.fixture
+def redis_server():
+    import mock_redis
+    servers = []
+
+    def start(*args):
+        server = mock_redis.serve(mock_redis.parse_args(["--port", "0", *args]))
+        server.url = "redis://127.0.0.1:%d/0" % server.server_address[1]
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
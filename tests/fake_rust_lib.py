@@ -0,0 +1,112 @@
+# This file is a part of WhatCanWePlay
+# Copyright (C) 2020 TGRCDev
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Stand-in for the rust library, for tests that run the site's routes.
+#
+# Steam answers from `libraries` ({steam_id: owned appids}) and every call is recorded in `calls`,
+# so tests can check what a request had to fetch. IGDB knows every game.
+
+import time, types
+
+__file__ = "fake_rust_lib"
+
+libraries = {}
+calls = [] # (function name, steam ids it was asked for)
+fetched = [] # Steam ids whose games lists were fetched, in order
+game_info_requests = [] # appids of each IGDB request
+twitch_down = False # Token requests fail after a moment while set
+token_requests = 0
+
+def exceptions(module, base, names):
+    base_class = type(base, (Exception,), {})
+    setattr(module, base, base_class)
+    for name in names:
+        setattr(module, name, type(name, (base_class,), {}))
+
+steam = types.ModuleType("steam")
+exceptions(steam, "SteamException", [
+    "UnknownErrorException", "ServerErrorException", "BadResponseException", "BadWebkeyException", "DeadlineExceededException",
+    "GamesListPrivateException", "GamesListEmptyException", "FriendListPrivateException"
+])
+igdb = types.ModuleType("igdb")
+exceptions(igdb, "IGDBException", [
+    "UnknownErrorException", "ServerErrorException", "BadClientException", "BadResponseException", "BadSecretException",
+    "BadTokenException", "BadAuthException", "DeadlineExceededException"
+])
+
+def set_timeouts(connect_timeout, read_timeout):
+    pass
+
+def set_api_urls(steam_url, igdb_url, twitch_url):
+    pass
+
+def configure_upstream(name, requests_per_second, burst, state_file, failure_threshold, open_seconds, max_concurrency):
+    pass
+
+def upstream_states():
+    return []
+
+def take_upstream_calls():
+    return []
+
+def owned_games(steamid):
+    fetched.append(steamid)
+    if steamid not in libraries:
+        raise steam.GamesListPrivateException("The user with the Steam ID %d has a private games list" % steamid, steamid)
+    return list(libraries[steamid])
+
+def get_owned_steam_games(webkey, steamid, timeout=None):
+    calls.append(("get_owned_steam_games", [steamid]))
+    return owned_games(steamid)
+
+# Stops at the first games list that empties the intersection when everyone has to own a game, like the real one
+def count_game_owners_from(webkey, steamids, known, min_owners, max_concurrency, timeout=None):
+    calls.append(("count_game_owners_from", list(steamids)))
+    owners = {}
+    for appids in known:
+        for appid in set(appids):
+            owners[appid] = owners.get(appid, 0) + 1
+
+    owned = {}
+    total = len(steamids) + len(known)
+    for steamid in steamids:
+        owned[steamid] = owned_games(steamid)
+        for appid in set(owned[steamid]):
+            owners[appid] = owners.get(appid, 0) + 1
+        if min_owners >= total and not any(count == len(known) + len(owned) for count in owners.values()):
+            break
+
+    return sorted((appid, count) for appid, count in owners.items() if count >= min_owners), owned
+
+def get_steam_game_info(client_id, token, appids, max_in_flight, timeout=None):
+    game_info_requests.append(sorted(appids))
+    return [
+        {"steam_id": appid, "igdb_id": appid, "name": "Game %d" % appid, "supported_players": 4, "cover_id": "", "has_multiplayer": True}
+        for appid in appids
+    ], []
+
+def fetch_twitch_token(client_id, secret, timeout=None):
+    global token_requests
+    token_requests += 1
+    if twitch_down:
+        time.sleep(0.1)
+        raise igdb.ServerErrorException("Twitch had an internal server error")
+    return {"access_token": "token", "expires_in": 3600}
+
+steam.get_owned_steam_games = get_owned_steam_games
+steam.count_game_owners_from = count_game_owners_from
+igdb.get_steam_game_info = get_steam_game_info
+igdb.fetch_twitch_token = fetch_twitch_token
@@ -0,0 +1,167 @@
+# This file is a part of WhatCanWePlay
+# Copyright (C) 2020 TGRCDev
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Local stand-in for a Redis server, speaking just enough of its protocol for the
+# shared game cache, so several site processes can share one cache without a real Redis.
+# The tests run it through the redis_server fixture in conftest.py.
+#
+# Point the site at it with these config.json keys:
+#     "igdb-cache-backend": "redis"
+#     "igdb-cache-redis-url": "redis://127.0.0.1:<port>/0"
+#
+# Supports PING, AUTH, SELECT, GET, MGET, SET (with EX/PX), DEL, DBSIZE, FLUSHDB and INFO.
+# INFO reports how many commands and keys were served, for cache hit rates.
+#
+# Usage: python tests/mock_redis.py [--port 6399] [--latency-ms 0.5]
+
+import argparse, socket, threading, time
+from socketserver import ThreadingTCPServer, StreamRequestHandler
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Local Redis stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6399)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Latency added to every command")
+    parser.add_argument("--password", default=None, help="Require AUTH with this password")
+    return parser.parse_args(argv)
+
+class MockRedis:
+    def __init__(self, options):
+        self.options = options
+        self.databases = {} # db -> {key: (expires at monotonic time or None, value)}
+        self.stats = {"commands": 0, "keyspace_hits": 0, "keyspace_misses": 0}
+        self.lock = threading.Lock()
+        self.connections = set() # Open client sockets
+
+    # Closes every client's connection, like a restarting server
+    def drop_connections(self):
+        with self.lock:
+            for connection in self.connections:
+                connection.shutdown(socket.SHUT_RDWR)
+
+    def lookup(self, db, key):
+        entry = self.databases.get(db, {}).get(key)
+        if entry is not None and entry[0] is not None and time.monotonic() >= entry[0]:
+            del self.databases[db][key]
+            entry = None
+        self.stats["keyspace_hits" if entry is not None else "keyspace_misses"] += 1
+        return None if entry is None else entry[1]
+
+    # Runs one command for a connection. session is {"db", "authed"}.
+    # Returns the reply, where an Exception is sent as an error reply.
+    def execute(self, session, args):
+        name = args[0].decode().upper()
+        with self.lock:
+            self.stats["commands"] += 1
+            if name == "AUTH":
+                if args[-1].decode() != self.options.password:
+                    return Exception("WRONGPASS invalid password")
+                session["authed"] = True
+                return "OK"
+            if self.options.password and not session["authed"]:
+                return Exception("NOAUTH Authentication required.")
+            if name == "PING":
+                return "PONG"
+            if name == "SELECT":
+                session["db"] = int(args[1])
+                return "OK"
+
+            db = self.databases.setdefault(session["db"], {})
+            if name == "GET":
+                return self.lookup(session["db"], args[1])
+            if name == "MGET":
+                return [self.lookup(session["db"], key) for key in args[1:]]
+            if name == "SET":
+                expires = None
+                options = [arg.decode().upper() for arg in args[3:]]
+                if "PX" in options:
+                    expires = time.monotonic() + int(options[options.index("PX") + 1]) / 1000.0
+                elif "EX" in options:
+                    expires = time.monotonic() + int(options[options.index("EX") + 1])
+                db[args[1]] = (expires, args[2])
+                return "OK"
+            if name == "DEL":
+                return sum(1 for key in args[1:] if db.pop(key, None) is not None)
+            if name == "DBSIZE":
+                return len(db)
+            if name == "FLUSHDB":
+                db.clear()
+                return "OK"
+            if name == "INFO":
+                return "".join("%s:%d\r\n" % item for item in self.stats.items()).encode()
+            return Exception("ERR unknown command '%s'" % name)
+
+def encode_reply(reply):
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, Exception):
+        return b"-%s\r\n" % str(reply).encode()
+    if isinstance(reply, str):
+        return b"+%s\r\n" % reply.encode()
+    if isinstance(reply, int):
+        return b":%d\r\n" % reply
+    if isinstance(reply, bytes):
+        return b"$%d\r\n%s\r\n" % (len(reply), reply)
+    return b"*%d\r\n" % len(reply) + b"".join(encode_reply(item) for item in reply)
+
+def make_handler(redis):
+    class Handler(StreamRequestHandler):
+        def read_command(self):
+            line = self.rfile.readline()
+            if not line.startswith(b"*"):
+                return None
+            args = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2])
+            return args
+
+        def handle(self):
+            session = {"db": 0, "authed": False}
+            with redis.lock:
+                redis.connections.add(self.connection)
+            try:
+                while True:
+                    args = self.read_command()
+                    if not args:
+                        return
+                    if redis.options.latency_ms > 0.0:
+                        time.sleep(redis.options.latency_ms / 1000.0)
+                    self.wfile.write(encode_reply(redis.execute(session, args)))
+            except OSError:
+                pass # Dropped
+            finally:
+                with redis.lock:
+                    redis.connections.discard(self.connection)
+
+    return Handler
+
+def serve(options):
+    ThreadingTCPServer.allow_reuse_address = True
+    redis = MockRedis(options)
+    server = ThreadingTCPServer((options.host, options.port), make_handler(redis))
+    server.daemon_threads = True
+    server.redis = redis
+    return server
+
+if __name__ == "__main__":
+    options = parse_args()
+    server = serve(options)
+    print("Mock Redis listening on redis://%s:%d/0" % (options.host, options.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
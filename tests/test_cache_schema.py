@@ -0,0 +1,79 @@
+# This file is a part of WhatCanWePlay
+# Copyright (C) 2020 TGRCDev
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import sqlite3
+from whatcanweplay.cache_schema import CACHE_MIGRATIONS, CACHE_VERSION, cache_version, migrate_cache, prepare_cache
+
+# A cache file as an older version of the site left it, with a game and an IGDB miss in the game table
+def old_cache_file(path, version):
+    cache = sqlite3.connect(str(path))
+    cache.isolation_level = None
+    for migration in range(1, version + 1):
+        for statement in CACHE_MIGRATIONS[migration]:
+            cache.execute(statement)
+    cache.execute("PRAGMA user_version = %d" % version)
+    cache.execute("INSERT INTO game VALUES (10, 100, 'Game', 4, 'cover', 1, 1000.0);")
+    cache.execute("INSERT INTO game VALUES (20, NULL, NULL, NULL, NULL, NULL, 2000.0);")
+    cache.close()
+
+def table_names(cache):
+    return {row[0] for row in cache.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+def test_new_file_is_created_at_the_current_version(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    prepare_cache(path)
+
+    cache = sqlite3.connect(path)
+    assert cache_version(cache) == CACHE_VERSION
+    assert {"game", "owned_games", "igdb_miss"} <= table_names(cache)
+    assert cache.execute("PRAGMA auto_vacuum;").fetchone()[0] == 2 # INCREMENTAL
+    assert cache.execute("PRAGMA journal_mode;").fetchone()[0] == "wal"
+
+def test_old_file_is_migrated_in_place(tmp_path):
+    path = tmp_path / "cache.sqlite"
+    old_cache_file(path, 1)
+    prepare_cache(str(path))
+
+    cache = sqlite3.connect(str(path))
+    assert cache_version(cache) == CACHE_VERSION
+    assert cache.execute("SELECT steam_id, name, expiry FROM game").fetchall() == [(10, "Game", 1000.0)]
+    assert cache.execute("SELECT steam_id, expiry FROM igdb_miss").fetchall() == [(20, 2000.0)]
+    indexes = {row[0] for row in cache.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {"game_expiry", "owned_games_expiry", "igdb_miss_expiry"} <= indexes
+    assert cache.execute("PRAGMA auto_vacuum;").fetchone()[0] == 2
+
+def test_interrupted_migration_can_run_again(tmp_path):
+    path = tmp_path / "cache.sqlite"
+    old_cache_file(path, 3)
+    cache = sqlite3.connect(str(path))
+    migrate_cache(cache)
+    cache.execute("PRAGMA user_version = 3") # As if the process died before user_version was set
+    migrate_cache(cache)
+
+    assert cache_version(cache) == CACHE_VERSION
+    assert cache.execute("SELECT steam_id FROM game").fetchall() == [(10,)]
+    assert cache.execute("SELECT steam_id FROM igdb_miss").fetchall() == [(20,)]
+
+def test_file_from_a_newer_version_is_rebuilt(tmp_path):
+    path = tmp_path / "cache.sqlite"
+    old_cache_file(path, CACHE_VERSION)
+    cache = sqlite3.connect(str(path))
+    cache.execute("PRAGMA user_version = %d" % (CACHE_VERSION + 1))
+    cache.close()
+    prepare_cache(str(path))
+
+    cache = sqlite3.connect(str(path))
+    assert cache_version(cache) == CACHE_VERSION
+    assert cache.execute("SELECT COUNT(*) FROM game").fetchone()[0] == 0
@@ -0,0 +1,56 @@
+# This file is a part of WhatCanWePlay
+# Copyright (C) 2020 TGRCDev
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import gzip, json
+import pytest
+from itsdangerous import URLSafeSerializer
+import fake_rust_lib
+
+def post(app, version, steamids, accept_encoding=None):
+    cookie = URLSafeSerializer("secret").dumps({"steam_id": 1, "expires": 9e12})
+    headers = {"Cookie": "steam_info=" + cookie}
+    if accept_encoding:
+        headers["Accept-Encoding"] = accept_encoding
+    return app.test_client(use_cookies=False).post("/api/%s/intersect_owned_games" % version, json={"steamids": steamids}, headers=headers)
+
+@pytest.fixture
+def app(make_app):
+    fake_rust_lib.libraries = {1: list(range(1000)), 2: list(range(1000)), 3: [10], 4: [10]}
+    return make_app()
+
+@pytest.mark.parametrize("version", ["v1", "v2"])
+def test_uncompressed_responses_still_vary_on_accept_encoding(app, version):
+    response = post(app, version, [1, 2])
+    assert "Content-Encoding" not in response.headers
+    assert "Accept-Encoding" in response.vary
+
+def test_responses_too_small_to_compress_still_vary_on_accept_encoding(app):
+    response = post(app, "v1", [3, 4], "gzip")
+    assert "Content-Encoding" not in response.headers
+    assert "Accept-Encoding" in response.vary
+
+@pytest.mark.parametrize("version", ["v1", "v2"])
+def test_compressed_responses_vary_on_accept_encoding(app, version):
+    response = post(app, version, [1, 2], "gzip")
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.vary
+    assert json.loads(gzip.decompress(response.get_data()).splitlines()[-1])["errcode"] == 0
+
+@pytest.mark.parametrize("version", ["v1", "v2"])
+def test_no_vary_without_compression(make_app, version):
+    fake_rust_lib.libraries = {1: [10], 2: [10]}
+    response = post(make_app(**{"compress-responses": False}), version, [1, 2], "gzip")
+    assert "Content-Encoding" not in response.headers
+    assert "Accept-Encoding" not in response.vary
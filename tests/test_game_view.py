@@ -0,0 +1,111 @@
+# This file is a part of WhatCanWePlay
+# Copyright (C) 2020 TGRCDev
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import pytest
+from itsdangerous import URLSafeSerializer
+from whatcanweplay.game_view import PLAYER_BUCKETS, player_bucket, parse_game_view, apply_game_view, game_columns
+
+GROUP_SIZE = 4
+serializer = URLSafeSerializer("test", salt="intersection-cursor")
+
+def game(steam_id, name, players, multiplayer=True):
+    return {"steam_id": steam_id, "igdb_id": steam_id, "name": name, "supported_players": players, "cover_id": None, "has_multiplayer": multiplayer}
+
+GAMES = [
+    game(1, "Zeta", 8),
+    game(2, "alpha", 2),
+    game(3, "Beta", 0),
+    game(4, "Gamma", 4, multiplayer=False),
+    game(5, "delta", None),
+    {"steam_id": 6}, # Not fetched from IGDB in time
+    game(7, "Alpha", 16),
+    game(8, "Epsilon", 1, multiplayer=False),
+]
+
+def view(**body):
+    parsed = parse_game_view(body, serializer)
+    assert parsed is not None
+    return parsed
+
+def steam_ids(games):
+    return [game["steam_id"] for game in games]
+
+# Same sections as gameSection in static/scripts/app.js: enough players, then unknown (0 or missing), then too few
+@pytest.mark.parametrize("players, bucket", [(8, "enough"), (4, "enough"), (3, "too_few"), (1, "too_few"), (0, "unknown"), (None, "unknown")])
+def test_player_buckets(players, bucket):
+    assert PLAYER_BUCKETS[player_bucket({"supported_players": players}, GROUP_SIZE)] == bucket
+
+def test_sections_sort_order():
+    games, total, next_cursor = apply_game_view(GAMES, view(sort="sections"), GROUP_SIZE, serializer)
+    assert steam_ids(games) == [7, 4, 1, 3, 5, 6, 2, 8]
+    assert total == len(GAMES)
+    assert next_cursor is None
+
+def test_name_sort_order():
+    games, _, _ = apply_game_view(GAMES, view(sort="name"), GROUP_SIZE, serializer)
+    assert steam_ids(games) == [2, 7, 3, 5, 8, 4, 1, 6] # Names are compared case-insensitively, then by steam id
+
+def test_unsorted_view_keeps_the_order():
+    games, _, _ = apply_game_view(GAMES, view(), GROUP_SIZE, serializer)
+    assert games == GAMES
+
+def test_filters():
+    games, total, _ = apply_game_view(GAMES, view(multiplayer_only=True, player_buckets="enough,unknown"), GROUP_SIZE, serializer)
+    assert steam_ids(games) == [1, 3, 5, 7]
+    assert total == 4
+
+def test_pages_cover_every_game_once():
+    unpaged, _, _ = apply_game_view(GAMES, view(sort="sections"), GROUP_SIZE, serializer)
+    paged = []
+    cursor = None
+    while True:
+        games, total, cursor = apply_game_view(GAMES, view(limit=3, cursor=cursor), GROUP_SIZE, serializer)
+        assert total == len(GAMES)
+        assert len(games) <= 3
+        paged += games
+        if cursor is None:
+            break
+    assert paged == unpaged
+
+def test_limit_defaults_to_sections_sort():
+    assert view(limit=10)["sort"] == "sections"
+
+@pytest.mark.parametrize("body", [
+    {"sort": "players"},
+    {"format": "xml"},
+    {"limit": -1},
+    {"limit": "many"},
+    {"player_buckets": ["enough", "lots"]},
+    {"player_buckets": [["enough"]]},
+    {"cursor": 5},
+    {"cursor": ["a"]},
+    {"cursor": {"sort": "sections", "after": []}},
+    {"cursor": "not a cursor"},
+])
+def test_bad_views_are_rejected(body):
+    assert parse_game_view(body, serializer) is None
+
+def test_cursor_must_match_the_sort():
+    _, _, cursor = apply_game_view(GAMES, view(limit=3), GROUP_SIZE, serializer)
+    assert parse_game_view({"limit": 3, "sort": "name", "cursor": cursor}, serializer) is None
+    assert parse_game_view({"limit": 3, "cursor": cursor}, URLSafeSerializer("other", salt="intersection-cursor")) is None
+
+def test_columns():
+    games = [dict(GAMES[0], owners=3), GAMES[5]]
+    columns = game_columns(games)
+    assert columns["steam_id"] == [1, 6]
+    assert columns["name"] == ["Zeta", None]
+    assert columns["owners"] == [3, None]
+    assert "owners" not in game_columns(GAMES[:1])
@@ -0,0 +1,54 @@
+# This file is a part of WhatCanWePlay
+# Copyright (C) 2020 TGRCDev
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import json, threading
+from itsdangerous import URLSafeSerializer
+import fake_rust_lib
+
+def intersect(app, steamids):
+    cookie = URLSafeSerializer("secret").dumps({"steam_id": 1, "expires": 9e12})
+    response = app.test_client(use_cookies=False).post(
+        "/api/v1/intersect_owned_games", json={"steamids": steamids}, headers={"Cookie": "steam_info=" + cookie}
+    )
+    return json.loads(response.get_data())
+
+def test_requests_wait_for_one_token_refresh(make_app):
+    fake_rust_lib.libraries = {steamid: [10] for steamid in range(1, 9)}
+    app = make_app()
+
+    groups = [[steamid, steamid + 1] for steamid in range(1, 9, 2)]
+    threads = [threading.Thread(target=intersect, args=(app, group)) for group in groups]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert fake_rust_lib.token_requests == 1
+
+def test_a_failed_refresh_is_not_retried_straight_away(make_app):
+    fake_rust_lib.libraries = {steamid: [10] for steamid in range(1, 9)}
+    fake_rust_lib.twitch_down = True
+    app = make_app()
+
+    # Requests waiting on the failed refresh, and ones that come after it, don't ask Twitch again
+    groups = [[steamid, steamid + 1] for steamid in range(1, 9, 2)]
+    threads = [threading.Thread(target=intersect, args=(app, group)) for group in groups]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    intersect(app, [1, 3])
+
+    assert fake_rust_lib.token_requests == 1
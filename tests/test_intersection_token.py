@@ -0,0 +1,75 @@
+# This file is a part of WhatCanWePlay
+# Copyright (C) 2020 TGRCDev
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import json
+import pytest
+from itsdangerous import URLSafeSerializer
+import fake_rust_lib
+
+SECRET = "secret"
+USER = 1
+
+LIBRARIES = {
+    1: [10, 20, 30, 40],
+    2: [10, 20, 30, 50],
+    3: [10, 20, 60],
+    4: [70],
+    5: [10, 20, 30, 80],
+}
+
+@pytest.fixture
+def client(make_app):
+    fake_rust_lib.libraries = {steamid: list(appids) for steamid, appids in LIBRARIES.items()}
+    return make_app(**{"secret-key": SECRET, "intersection-cache-max-age": {"seconds": 0}}).test_client(use_cookies=False)
+
+def intersect(client, body):
+    fake_rust_lib.calls.clear()
+    fake_rust_lib.fetched.clear()
+    cookie = URLSafeSerializer(SECRET).dumps({"steam_id": USER, "expires": 9e12})
+    response = client.post("/api/v1/intersect_owned_games", json=body, headers={"Cookie": "steam_info=" + cookie})
+    data = json.loads(response.get_data())
+    assert data["errcode"] == 0, data
+    return sorted(game["steam_id"] for game in data["games"]), data["token"], list(fake_rust_lib.calls)
+
+def test_token_requests_only_fetch_the_users_they_add(client):
+    games, token, calls = intersect(client, {"steamids": [1, 2, 3]})
+    assert games == [10, 20]
+    assert token is not None
+    assert calls == [("count_game_owners_from", [1, 2, 3])]
+
+    games, token, calls = intersect(client, {"token": token, "add": [5]})
+    assert games == [10, 20]
+    assert calls == [("get_owned_steam_games", [5])]
+
+    # The removed user is taken out with the games list they were counted with, so a changed one isn't fetched
+    fake_rust_lib.libraries[3] = [10, 20, 30, 60]
+    games, token, calls = intersect(client, {"token": token, "remove": [3]})
+    assert games == [10, 20, 30]
+    assert calls == []
+
+def test_intersections_that_end_early_hand_out_no_token(client):
+    games, token, calls = intersect(client, {"steamids": [1, 4, 5]})
+    assert games == []
+    assert token is None
+    assert calls == [("count_game_owners_from", [1, 4, 5])]
+    assert fake_rust_lib.fetched == [1, 4]
+
+def test_groups_not_all_owning_a_game_can_still_be_followed_up(client):
+    games, token, _ = intersect(client, {"steamids": [1, 2, 4], "min_owners": 1})
+    assert games == [10, 20, 30, 40, 50, 70]
+
+    games, token, calls = intersect(client, {"token": token, "remove": [4], "min_owners": 2})
+    assert games == [10, 20, 30]
+    assert calls == []
@@ -0,0 +1,71 @@
+# This file is a part of WhatCanWePlay
+# Copyright (C) 2020 TGRCDev
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import sqlite3
+import pytest
+from whatcanweplay.cache_schema import prepare_cache
+from whatcanweplay.cache_backends import SQLiteGameCache, SQLiteMissCache, RedisClient, RedisCache
+
+NOW = 1000000.0
+
+# SQLite caches that write straight to the file instead of through the cache writer
+@pytest.fixture
+def sqlite_caches(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    prepare_cache(path)
+    cache = sqlite3.connect(path)
+    cache.row_factory = sqlite3.Row
+
+    def write(query, rows):
+        with cache:
+            cache.executemany(query, rows)
+
+    return SQLiteGameCache(lambda: cache, write, 60.0), SQLiteMissCache(lambda: cache, write)
+
+@pytest.fixture
+def redis_client(redis_server):
+    return RedisClient(redis_server().url)
+
+def test_sqlite_misses_expire(sqlite_caches):
+    _, misses = sqlite_caches
+    misses.set_many({10: (NOW + 100.0, None), 20: (NOW - 1.0, None)}, NOW + 100.0)
+
+    assert misses.get_many([10, 20, 30], NOW) == {10: (NOW + 100.0, None)}
+    assert misses.get_many([10], NOW + 200.0) == {}
+
+def test_sqlite_misses_are_kept_apart_from_games(sqlite_caches):
+    games, misses = sqlite_caches
+    game = {"steam_id": 10, "igdb_id": 100, "name": "Game", "supported_players": 4, "cover_id": "cover", "has_multiplayer": True}
+    games.set_many({10: (NOW + 100.0, game)}, NOW + 160.0)
+    misses.set_many({20: (NOW + 100.0, None)}, NOW + 100.0)
+
+    assert set(games.get_many([10, 20], NOW)) == {10}
+    assert set(misses.get_many([10, 20], NOW)) == {20}
+
+def test_sqlite_misses_can_be_cached_again(sqlite_caches):
+    _, misses = sqlite_caches
+    misses.set_many({10: (NOW - 1.0, None)}, NOW - 1.0)
+    misses.set_many({10: (NOW + 100.0, None)}, NOW + 100.0)
+
+    assert misses.get_many([10], NOW) == {10: (NOW + 100.0, None)}
+
+def test_redis_misses_are_kept_until_keep_until(redis_client):
+    misses = RedisCache(redis_client, "wcwp:miss:")
+    games = RedisCache(redis_client, "wcwp:game:")
+    misses.set_many({10: (NOW + 100.0, None), 20: (NOW + 100.0, None)}, {10: 4102444800.0, 20: 0.0})
+
+    # keep_until in the past means the entry isn't stored at all
+    assert misses.get_many([10, 20]) == {10: (NOW + 100.0, None)}
+    assert games.get_many([10]) == {}
@@ -0,0 +1,65 @@
+# This file is a part of WhatCanWePlay
+# Copyright (C) 2020 TGRCDev
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from collections import Counter
+from whatcanweplay.owner_counts import apply_owner_delta, count_owners, owner_arrays
+
+OWNED = {
+    1: [10, 20, 30, 40],
+    2: [20, 30, 50],
+    3: [30, 40, 50, 60],
+    4: [],
+    5: [10, 30, 70],
+}
+
+def counted_from_scratch(steamids):
+    owners = Counter(appid for steamid in steamids for appid in OWNED[steamid])
+    return owner_arrays(dict(owners), frozenset(steamid for steamid in steamids if not OWNED[steamid]))
+
+def as_dict(counted):
+    appids, counts, empty_users = counted
+    return dict(zip(appids, counts)), empty_users
+
+def test_owner_arrays_are_sorted_by_appid():
+    appids, counts, _ = owner_arrays({30: 2, 10: 1, 20: 3}, frozenset())
+    assert list(appids) == [10, 20, 30]
+    assert list(counts) == [1, 3, 2]
+
+def test_count_owners_matches_counting_from_scratch():
+    counted = count_owners({steamid: OWNED[steamid] for steamid in [1, 2, 3, 4]})
+    assert as_dict(counted) == as_dict(counted_from_scratch([1, 2, 3, 4]))
+
+def test_adding_users_matches_counting_from_scratch():
+    counted = apply_owner_delta(counted_from_scratch([1, 2]), {3: OWNED[3], 5: OWNED[5]}, {})
+    assert as_dict(counted) == as_dict(counted_from_scratch([1, 2, 3, 5]))
+
+def test_removing_users_drops_games_nobody_owns_anymore():
+    counted = apply_owner_delta(counted_from_scratch([1, 2, 3]), {}, {3: OWNED[3]})
+    owners, _ = as_dict(counted)
+    assert 60 not in owners
+    assert as_dict(counted) == as_dict(counted_from_scratch([1, 2]))
+
+def test_adding_and_removing_together():
+    counted = apply_owner_delta(counted_from_scratch([1, 2, 3]), {5: OWNED[5]}, {2: OWNED[2]})
+    assert as_dict(counted) == as_dict(counted_from_scratch([1, 3, 5]))
+
+def test_users_with_no_games_are_tracked():
+    counted = apply_owner_delta(counted_from_scratch([1, 2]), {4: OWNED[4]}, {})
+    assert counted[2] == frozenset([4])
+    assert as_dict(counted) == as_dict(counted_from_scratch([1, 2, 4]))
+
+    counted = apply_owner_delta(counted, {}, {4: OWNED[4]})
+    assert counted[2] == frozenset()
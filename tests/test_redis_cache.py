@@ -0,0 +1,143 @@
+# This file is a part of WhatCanWePlay
+# Copyright (C) 2020 TGRCDev
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import json, socket, time
+import pytest
+from itsdangerous import URLSafeSerializer
+from whatcanweplay.cache_backends import RedisClient, RedisCache, RedisError, now_timestamp
+import fake_rust_lib
+
+GAME = {"steam_id": 10, "igdb_id": 100, "name": "Gäme: The Sequel", "supported_players": 4, "cover_id": "cover", "has_multiplayer": True}
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def test_games_round_trip(redis_server):
+    games = RedisCache(RedisClient(redis_server().url), "wcwp:game:")
+    expiry = now_timestamp() + 100.0
+    games.set_many({10: (expiry, GAME), 20: (expiry, dict(GAME, steam_id=20, cover_id=None))}, expiry + 60.0)
+
+    assert games.get_many([10, 30, 20]) == {10: (expiry, GAME), 20: (expiry, dict(GAME, steam_id=20, cover_id=None))}
+    assert games.get_many([30]) == {}
+    assert games.get_many([]) == {}
+
+def test_entries_are_kept_until_their_own_keep_until(redis_server):
+    server = redis_server()
+    games = RedisCache(RedisClient(server.url), "wcwp:game:")
+    now = now_timestamp()
+    games.set_many({10: (now, GAME), 20: (now, GAME)}, {10: now + 100.0, 20: now + 1000.0})
+
+    database = server.redis.databases[0]
+    assert database[b"wcwp:game:10"][0] - time.monotonic() == pytest.approx(100.0, abs=5.0)
+    assert database[b"wcwp:game:20"][0] - time.monotonic() == pytest.approx(1000.0, abs=5.0)
+
+def test_auth_and_select_come_from_the_url(redis_server):
+    server = redis_server("--password", "pass word")
+    port = server.server_address[1]
+    games = RedisCache(RedisClient("redis://:pass%%20word@127.0.0.1:%d/3" % port), "wcwp:game:")
+    games.set_many({10: (0.0, GAME)}, now_timestamp() + 100.0)
+
+    assert list(server.redis.databases) == [3]
+    assert games.get_many([10]) == {10: (0.0, GAME)}
+
+    with pytest.raises(RedisError):
+        RedisCache(RedisClient("redis://:wrong@127.0.0.1:%d/3" % port), "wcwp:game:").get_many([10])
+
+def test_reconnects_after_the_server_drops_the_connection(redis_server):
+    server = redis_server()
+    games = RedisCache(RedisClient(server.url), "wcwp:game:")
+    games.set_many({10: (0.0, GAME)}, now_timestamp() + 100.0)
+
+    server.redis.drop_connections()
+    with pytest.raises((OSError, RedisError)):
+        games.get_many([10])
+    assert games.get_many([10]) == {10: (0.0, GAME)}
+
+def test_a_down_server_is_not_retried_until_the_retry_delay(monkeypatch):
+    client = RedisClient("redis://127.0.0.1:%d/0" % free_port())
+    with pytest.raises(OSError):
+        client.pipeline([("PING",)])
+
+    connects = []
+    monkeypatch.setattr(socket, "create_connection", lambda *args, **kwargs: connects.append(args))
+    with pytest.raises(RedisError):
+        client.pipeline([("PING",)])
+    assert connects == []
+    assert client.retry_after - time.monotonic() == pytest.approx(RedisClient.RETRY_DELAY, abs=1.0)
+
+def intersect(app, steamids):
+    cookie = URLSafeSerializer("secret").dumps({"steam_id": 1, "expires": 9e12})
+    response = app.test_client(use_cookies=False).post(
+        "/api/v1/intersect_owned_games", json={"steamids": steamids}, headers={"Cookie": "steam_info=" + cookie}
+    )
+    data = json.loads(response.get_data())
+    assert response.status_code == 200 and data["errcode"] == 0, data
+    return sorted(game["steam_id"] for game in data["games"])
+
+def test_a_down_server_is_a_cache_miss(make_app, monkeypatch):
+    fake_rust_lib.libraries = {1: [10, 20], 2: [10, 20], 3: [20, 30], 4: [20, 30]}
+    app = make_app(**{
+        "igdb-cache-backend": "redis",
+        "igdb-cache-redis-url": "redis://127.0.0.1:%d/0" % free_port(),
+        "igdb-cache-max-age": {"days": 1},
+        "intersection-cache-max-age": {"seconds": 0},
+    })
+
+    assert intersect(app, [1, 2]) == [10, 20]
+
+    # Later lookups and writes fail fast instead of trying to connect again
+    connects = []
+    monkeypatch.setattr(socket, "create_connection", lambda *args, **kwargs: connects.append(args))
+    assert intersect(app, [3, 4]) == [20, 30]
+    assert connects == []
+    assert fake_rust_lib.game_info_requests == [[10, 20], [30]]
+
+def test_memory_tier_in_front_of_the_shared_store(make_app, redis_server):
+    server = redis_server()
+    fake_rust_lib.libraries = {1: [10, 20], 2: [10, 20, 30]}
+    config = {
+        "igdb-cache-backend": "redis",
+        "igdb-cache-redis-url": server.url,
+        "igdb-cache-max-age": {"days": 1},
+        "intersection-cache-max-age": {"seconds": 0},
+    }
+    app = make_app(**config)
+
+    assert intersect(app, [1, 2]) == [10, 20]
+    assert fake_rust_lib.game_info_requests == [[10, 20]]
+    assert set(server.redis.databases[0]) == {b"wcwp:game:10", b"wcwp:game:20"}
+
+    # The same process answers from memory without asking Redis
+    commands = server.redis.stats["commands"]
+    assert intersect(app, [1, 2]) == [10, 20]
+    assert server.redis.stats["commands"] == commands
+
+    # Another process sharing the store gets the games from Redis instead of IGDB
+    assert intersect(make_app(**config), [1, 2]) == [10, 20]
+    assert fake_rust_lib.game_info_requests == [[10, 20]]
+    assert server.redis.stats["keyspace_hits"] == 2
+
+def test_cache_export_refuses_the_redis_backend(make_app, redis_server, tmp_path):
+    app = make_app(**{
+        "igdb-cache-backend": "redis",
+        "igdb-cache-redis-url": redis_server().url,
+        "igdb-cache-file": str(tmp_path / "cache.sqlite"),
+    })
+    result = app.test_cli_runner().invoke(args=["cache-export", str(tmp_path / "export.json.gz")])
+
+    assert "igdb-cache-backend is redis" in result.output
+    assert not (tmp_path / "export.json.gz").exists()